@@ -0,0 +1,254 @@
+# Scaling benchmark of the Transform step of the ETL (Transform_CVM.py, Merge_YFinance_CVM.py and
+# Merge_Daily_YFinance_CVM.py).
+# For each scale, synthetic data is written by Generate_Synthetic_Data.py to Data/scale_{scale} (and reused while its
+# parameters do not change). The current scripts of the Transform step are copied next to the data, with the folder
+# layout of the ETL, and each run is a new process:
+# Transform_CVM (cold):     with an empty cache, every CVM file is read and cleaned
+# Transform_CVM (warm):     again, with the cache of the cold run
+# Merge_YFinance_CVM (full): merge of the prices and of the fundamental data of the cold run
+# Merge_Daily_YFinance_CVM (full): the same with the daily bars
+# Each run records its wall time, the CPU time of its process (from os.wait4, not available on Windows), the peak
+# resident memory of its process, and the rows and size of its inputs and outputs. The results are appended to
+# Results/benchmark_history.csv with the date and git commit of the benchmark, and compared with the previous benchmark
+# of the same scale, script and mode.
+#
+# Usage: python Benchmark_ETL.py [--scales 1 10 100] [--repeats 1] [--remove-data]
+# Scale 1 writes about 0.5 GB of CVM files, and the size grows linearly with the scale.
+
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from Generate_Synthetic_Data import etl_dir, generate_data
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(benchmark_dir, 'Data')
+history_path = os.path.join(benchmark_dir, 'Results', 'benchmark_history.csv')
+
+# Scripts of the Transform step: folder (relative to the ETL folder), script, inputs and outputs (relative to the
+# folder of the data)
+scripts = {'Transform_CVM': ('Transform/CVM', 'Transform_CVM.py', ['Extract/CVM/Extracted/dfp_cia_aberta_*.csv'],
+                             ['Transform/CVM/Transformed/fundamentalData_CVM.csv']),
+           'Merge_YFinance_CVM': ('Transform/MergeAndTransform', 'Merge_YFinance_CVM.py',
+                                  ['Extract/YFinance/Extracted/technicalData_yf.csv',
+                                   'Extract/YFinance/Extracted/technicalData_BOVA11_yf.csv',
+                                   'Transform/CVM/Transformed/fundamentalData_CVM.csv'],
+                                  ['Transform/MergeAndTransform/mergedData.csv', 'Load/stockData.csv',
+                                   'Load/marketData.csv']),
+           'Merge_Daily_YFinance_CVM': ('Transform/MergeAndTransform', 'Merge_Daily_YFinance_CVM.py',
+                                        ['Extract/YFinance/Extracted/Daily/DATE.npy',
+                                         'Transform/CVM/Transformed/fundamentalData_CVM.csv'],
+                                        ['Load/stockData_daily.csv', 'Load/marketData_daily.csv'])}
+
+# Runs of each benchmark: script, mode and whether the cache of Transform_CVM.py is removed before the run
+runs = [('Transform_CVM', 'cold', True), ('Transform_CVM', 'warm', False), ('Merge_YFinance_CVM', 'full', False),
+        ('Merge_Daily_YFinance_CVM', 'full', False)]
+
+# Run a script (argv[1]) as __main__ and write the peak resident memory of the process in MB to argv[2]. The peak is
+# read by the process itself, as the ru_maxrss of a child process also counts the memory of its parent at the fork.
+runner = '''
+import os, runpy, sys
+script, peak_path = sys.argv[1:3]
+sys.argv = [script]
+try:
+    runpy.run_path(script, run_name='__main__')
+finally:
+    peak = float('nan')
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            peak = next(int(line.split()[1]) / 1024 for line in f if line.startswith('VmHWM:'))
+    elif sys.platform == 'darwin':
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2
+    with open(peak_path, 'w') as f:
+        f.write(str(peak))
+'''
+
+
+# Synthetic data of a scale. The data of a previous benchmark is reused if it was generated with the same parameters.
+def scale_data(scale, seed=0):
+    scale_dir = os.path.join(data_dir, f'scale_{scale:g}')
+    summary_path = os.path.join(scale_dir, 'synthetic_data.json')
+    if os.path.exists(summary_path):
+        with open(summary_path, 'r', encoding='utf-8') as f:
+            summary = json.load(f)
+        parameters = summary['parameters']
+        if parameters['scale'] == scale and parameters['seed'] == seed and parameters.get('daily'):
+            print(f'Scale {scale:g}: using the data in {scale_dir}')
+            return scale_dir, summary
+        shutil.rmtree(scale_dir)
+
+    print(f'Scale {scale:g}: generating synthetic data in {scale_dir}')
+    start_time = time.perf_counter()
+    summary = generate_data(scale_dir, scale, seed=seed, daily=True)
+    print(f'Scale {scale:g}: {sum(summary["rows"].values())} rows generated in {time.perf_counter() - start_time:.1f}s')
+    return scale_dir, summary
+
+
+# Copy the current scripts of the Transform step, and the modules of the ETL folder they import, to the folder of the
+# data
+def copy_scripts(scale_dir):
+    for path in glob.glob(os.path.join(etl_dir, '*.py')):
+        shutil.copy(path, scale_dir)
+    for folder, _, _, outputs in scripts.values():
+        os.makedirs(os.path.join(scale_dir, folder), exist_ok=True)
+        for path in glob.glob(os.path.join(etl_dir, folder, '*.py')):
+            shutil.copy(path, os.path.join(scale_dir, folder))
+        for output in outputs:
+            os.makedirs(os.path.dirname(os.path.join(scale_dir, output)), exist_ok=True)
+
+
+def files(scale_dir, patterns):
+    return [path for pattern in patterns for path in sorted(glob.glob(os.path.join(scale_dir, pattern)))]
+
+
+# Rows of CSV files and of arrays (.npy)
+def count_rows(paths):
+    rows = 0
+    for path in paths:
+        if path.endswith('.npy'):
+            rows += len(np.load(path, mmap_mode='r'))
+            continue
+        with open(path, 'rb') as f:
+            rows += sum(1 for _ in f) - 1
+    return rows
+
+
+def size_mb(paths):
+    return sum(os.path.getsize(path) for path in paths) / 1024 ** 2
+
+
+# Run a script in its own process, with its output written to log_path.
+# Returns the exit code, the wall time, the CPU time (user and system, NaN where os.wait4 is not available) and the
+# peak resident memory in MB of the process (NaN on Windows).
+def run_script(script, cwd, log_path):
+    peak_path = log_path + '.peak'
+    if os.path.exists(peak_path):
+        os.remove(peak_path)
+    with open(log_path, 'w', encoding='utf-8') as log:
+        start_time = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-c', runner, script, peak_path], cwd=cwd, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            cpu_seconds = usage.ru_utime + usage.ru_stime
+        else:
+            process.wait()
+            cpu_seconds = float('nan')
+        wall_seconds = time.perf_counter() - start_time
+    peak_rss_mb = float('nan')
+    if os.path.exists(peak_path):
+        with open(peak_path, 'r') as f:
+            peak_rss_mb = float(f.read())
+    return process.returncode, wall_seconds, cpu_seconds, peak_rss_mb
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=etl_dir, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+# Run the benchmark of each scale. Returns one row per run.
+# repeats:      number of runs of each script and mode
+# remove_data:  remove the data of each scale after its runs (the data of the larger scales takes several GB)
+def run_benchmark(scales=(1, 10, 100), repeats=1, seed=0, remove_data=False):
+    benchmark_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    commit = git_commit()
+    results = []
+    for scale in scales:
+        scale_dir, summary = scale_data(scale, seed)
+        copy_scripts(scale_dir)
+        failed = set()
+        for repeat in range(repeats):
+            for script_name, mode, cold in runs:
+                folder, script, inputs, outputs = scripts[script_name]
+                # The merges need the output of Transform_CVM.py
+                if script_name != 'Transform_CVM' and 'Transform_CVM' in failed:
+                    continue
+                if cold:
+                    shutil.rmtree(os.path.join(scale_dir, folder, 'Cache'), ignore_errors=True)
+                    os.makedirs(os.path.join(scale_dir, folder, 'Cache'))
+
+                print(f'Scale {scale:g}: running {script_name} ({mode}, {repeat + 1}/{repeats})')
+                return_code, wall_seconds, cpu_seconds, peak_rss_mb = \
+                    run_script(script, os.path.join(scale_dir, folder),
+                               os.path.join(scale_dir, f'{script_name}_{mode}.log'))
+                if return_code != 0:
+                    failed.add(script_name)
+                    print(f'Scale {scale:g}: {script_name} failed (exit code {return_code}, see '
+                          f'{script_name}_{mode}.log)')
+                input_paths = files(scale_dir, inputs)
+                output_paths = files(scale_dir, outputs) if return_code == 0 else []
+                results.append({'BENCHMARK_DATE': benchmark_date, 'COMMIT': commit, 'SCALE': scale,
+                                'TICKERS': summary['parameters']['tickers'], 'COMPANIES': summary['companies'],
+                                'SCRIPT': script_name, 'MODE': mode, 'REPEAT': repeat + 1,
+                                'STATUS': 'done' if return_code == 0 else f'failed ({return_code})',
+                                'INPUT_ROWS': count_rows(input_paths), 'INPUT_MB': round(size_mb(input_paths), 3),
+                                'OUTPUT_ROWS': count_rows(output_paths[:1]),
+                                'WALL_SECONDS': round(wall_seconds, 3), 'CPU_SECONDS': round(cpu_seconds, 3),
+                                'PEAK_RSS_MB': round(peak_rss_mb, 1), 'PYTHON': platform.python_version(),
+                                'PANDAS': pd.__version__})
+        if remove_data:
+            shutil.rmtree(scale_dir)
+    return pd.DataFrame(results)
+
+
+# Append the results to the history of the benchmarks
+def save_results(results, path=history_path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        history = pd.read_csv(path, sep=';', encoding='ISO-8859-1', dtype={'COMMIT': str})
+        results = pd.concat([history, results], ignore_index=True)
+    results.to_csv(path, sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+
+
+# Best run of each scale, script and mode of the last benchmark, with the best run of the previous benchmark of the
+# same scale, script and mode in the history and the relative change
+def compare_results(results, path=history_path):
+    keys = ['SCALE', 'SCRIPT', 'MODE']
+    measures = ['WALL_SECONDS', 'CPU_SECONDS', 'PEAK_RSS_MB']
+    current = results[results['STATUS'] == 'done'].groupby(keys, sort=False)[measures].min()
+    if not os.path.exists(path):
+        return current
+
+    history = pd.read_csv(path, sep=';', encoding='ISO-8859-1', dtype={'COMMIT': str})
+    history = history[(history['STATUS'] == 'done') & (history['BENCHMARK_DATE'] < results['BENCHMARK_DATE'].min())]
+    last_dates = history.groupby(keys)['BENCHMARK_DATE'].transform('max')
+    previous = history[history['BENCHMARK_DATE'] == last_dates].groupby(keys)[measures].min()
+    comparison = current.join(previous, rsuffix='_PREVIOUS')
+    for measure in ['WALL_SECONDS', 'PEAK_RSS_MB']:
+        comparison[f'{measure}_CHANGE'] = comparison[measure] / comparison[f'{measure}_PREVIOUS'] - 1
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scaling benchmark of the Transform step of the ETL')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100],
+                        help='number of tickers relative to Ticker_CVMCode.csv')
+    parser.add_argument('--repeats', type=int, default=1, help='runs of each script and mode')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--remove-data', action='store_true', help='remove the synthetic data after the runs')
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmark(args.scales, args.repeats, args.seed, args.remove_data)
+    benchmark_comparison = compare_results(benchmark_results)
+    save_results(benchmark_results)
+    print(benchmark_results[['SCALE', 'SCRIPT', 'MODE', 'STATUS', 'INPUT_ROWS', 'OUTPUT_ROWS', 'WALL_SECONDS',
+                             'CPU_SECONDS', 'PEAK_RSS_MB']].to_string(index=False))
+    print('Comparison with the previous benchmark:')
+    print(benchmark_comparison.to_string(float_format=lambda x: f'{x:,.3f}'))
+    print(f'Results saved to {history_path}')
@@ -0,0 +1,532 @@
+# Synthetic CVM and YFinance data, with the layout, columns and encoding of the files read by the Transform step:
+# Ticker_CVMCode.csv
+# Extract/CVM/Extracted/dfp_cia_aberta_{suffix}_{year}.csv    (DRE, BPA, BPP, DFC_MI and DFC_MD, '_con' and '_ind')
+# Extract/YFinance/Extracted/technicalData_yf.csv
+# Extract/YFinance/Extracted/technicalData_BOVA11_yf.csv
+# Extract/YFinance/Extracted/Daily                           (daily bars, optional, see Price_Arrays.py)
+# The data is random, but has the variants the Transform step has to handle in the real files:
+# - Earnings in 3.09, 3.11 or 3.13 (with the accounts between them), 'Consolidado do Período' only in the '_con' sheets
+# - EPS in 3.99 and its sub accounts (3.99.01.01 ON, PN first, basic and diluted, only in 3.99, zero EPS and EPS with
+#   the wrong sign)
+# - Dividends and interest on equity in a varying subset of the 6.03.xx financing accounts, in the direct (DFC_MD) or
+#   indirect (DFC_MI) cash flow statements
+# - Equity in 2.03 or 2.07, current and non-current debt (2.01.04, 2.02.01) missing for some companies
+# - Companies with '_ind' sheets only, with a year missing from the '_con' sheets, listed after the first year or
+#   delisted before the last year, values in MIL or UNIDADE
+# - Companies in the CVM files that are not in the ticker list, tickers without CVM code or company name, tickers of
+#   the same company (ON and PN), tickers without prices or with prices for part of the period
+# Each statement has about as many accounts per company as the real files, and the 'PENÚLTIMO' rows hold the values
+# of the previous year. The size of the data is set by the number of tickers: scale 1 has as many tickers as
+# ../Ticker_CVMCode.csv, with unlisted_ratio companies in the CVM files for each listed company.
+#
+# Usage: python Generate_Synthetic_Data.py <output_dir> [--scale 1] [--first-year 2012] [--last-year 2023] [--seed 0]
+#                                          [--daily]
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+etl_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.append(etl_dir)
+from Price_Arrays import save_price_arrays
+
+file_suffix = ['DRE_con', 'DFC_MI_con', 'DFC_MD_con', 'BPA_con', 'BPP_con', 'DRE_ind', 'DFC_MI_ind', 'DFC_MD_ind',
+               'BPA_ind', 'BPP_ind']
+
+# Columns of the DFP files. The balance sheets (BPA, BPP) have no DT_INI_EXERC.
+dfp_columns = ['CNPJ_CIA', 'DT_REFER', 'VERSAO', 'DENOM_CIA', 'CD_CVM', 'GRUPO_DFP', 'MOEDA', 'ESCALA_MOEDA',
+               'ORDEM_EXERC', 'DT_INI_EXERC', 'DT_FIM_EXERC', 'CD_CONTA', 'DS_CONTA', 'VL_CONTA', 'ST_CONTA_FIXA']
+
+statement_names = {'DRE': 'Demonstração do Resultado', 'BPA': 'Balanço Patrimonial Ativo',
+                   'BPP': 'Balanço Patrimonial Passivo', 'DFC_MI': 'Demonstração do Fluxo de Caixa (Método Indireto)',
+                   'DFC_MD': 'Demonstração do Fluxo de Caixa (Método Direto)'}
+scope_names = {'con': 'DF Consolidado', 'ind': 'DF Individual'}
+
+# Accounts: (CD_CONTA, DS_CONTA, KIND, FACTOR). The value of an account is FACTOR times the value of its KIND for the
+# company and year:
+# SIZE: revenue of the company (times a random weight of the company and account)
+# E:    earnings
+# EPS:  earnings per share (not scaled by ESCALA_MOEDA)
+# D:    dividends paid (times a random weight of the company and account)
+dre_accounts = [('3.01', 'Receita de Venda de Bens e/ou Serviços', 'SIZE', 1),
+                ('3.02', 'Custo dos Bens e/ou Serviços Vendidos', 'SIZE', -0.7),
+                ('3.03', 'Resultado Bruto', 'SIZE', 0.3),
+                ('3.04', 'Despesas/Receitas Operacionais', 'SIZE', -0.2),
+                ('3.04.01', 'Despesas com Vendas', 'SIZE', -0.1),
+                ('3.04.02', 'Despesas Gerais e Administrativas', 'SIZE', -0.1),
+                ('3.04.03', 'Perdas pela Não Recuperabilidade de Ativos', 'SIZE', -0.01),
+                ('3.04.04', 'Outras Receitas Operacionais', 'SIZE', 0.02),
+                ('3.04.05', 'Outras Despesas Operacionais', 'SIZE', -0.02),
+                ('3.04.06', 'Resultado de Equivalência Patrimonial', 'SIZE', 0.01),
+                ('3.05', 'Resultado Antes do Resultado Financeiro e dos Tributos', 'SIZE', 0.1),
+                ('3.06', 'Resultado Financeiro', 'SIZE', -0.02),
+                ('3.06.01', 'Receitas Financeiras', 'SIZE', 0.03),
+                ('3.06.02', 'Despesas Financeiras', 'SIZE', -0.05),
+                ('3.07', 'Resultado Antes dos Tributos sobre o Lucro', 'SIZE', 0.08),
+                ('3.08', 'Imposto de Renda e Contribuição Social sobre o Lucro', 'SIZE', -0.03),
+                ('3.08.01', 'Corrente', 'SIZE', -0.02),
+                ('3.08.02', 'Diferido', 'SIZE', -0.01)]
+# Accounts between 3.08 and the earnings account (3.09, 3.11 or 3.13)
+dre_intermediate_accounts = [('3.09', 'Resultado Líquido das Operações Continuadas', 'E', 1),
+                             ('3.10', 'Resultado Líquido de Operações Descontinuadas', 'SIZE', 0),
+                             ('3.11', 'Participações nos Resultados', 'SIZE', -0.005),
+                             ('3.12', 'Reversão dos Juros sobre Capital Próprio', 'SIZE', 0.005)]
+earnings_description = {'con': 'Lucro/Prejuízo Consolidado do Período', 'ind': 'Lucro/Prejuízo do Período'}
+# Sub accounts of the earnings account, in the '_con' sheets only
+earnings_sub_accounts = [('.01', 'Atribuído a Sócios da Empresa Controladora', 'E', 0.95),
+                         ('.02', 'Atribuído a Sócios Não Controladores', 'E', 0.05)]
+
+# EPS variants: name, probability and accounts (CD_CONTA, DS_CONTA, FACTOR of the EPS)
+eps_total = ('3.99', 'Lucro por Ação - (Reais / Ação)')
+eps_basic = ('3.99.01', 'Lucro Básico por Ação')
+eps_diluted = ('3.99.02', 'Lucro Diluído por Ação')
+eps_variants = {
+    'ON_PN': (0.35, [eps_total + (0,), eps_basic + (0,), ('3.99.01.01', 'ON', 1), ('3.99.01.02', 'PN', 1.1),
+                     eps_diluted + (0,), ('3.99.02.01', 'ON', 0.99), ('3.99.02.02', 'PN', 1.09)]),
+    'ON': (0.3, [eps_total + (0,), eps_basic + (0,), ('3.99.01.01', 'ON', 1), eps_diluted + (0,),
+                 ('3.99.02.01', 'ON', 0.99)]),
+    'PN_FIRST': (0.1, [eps_total + (0,), eps_basic + (0,), ('3.99.01.01', 'PN', 1.1), ('3.99.01.02', 'ON', 1)]),
+    'TOTAL': (0.08, [eps_total + (1,)]),
+    'GROUP': (0.07, [eps_total + (0,), eps_basic + (1,), eps_diluted + (0.99,)]),
+    'WRONG_SIGN': (0.05, [eps_total + (0,), eps_basic + (0,), ('3.99.01.01', 'ON', -1), eps_diluted + (0,),
+                          ('3.99.02.01', 'ON', 0.99)]),
+    'ZERO': (0.05, [eps_total + (0,), eps_basic + (0,), ('3.99.01.01', 'ON', 0)]),
+}
+
+bpa_accounts = [('1', 'Ativo Total', 'SIZE', 3),
+                ('1.01', 'Ativo Circulante', 'SIZE', 1),
+                ('1.01.01', 'Caixa e Equivalentes de Caixa', 'SIZE', 0.2),
+                ('1.01.02', 'Aplicações Financeiras', 'SIZE', 0.1),
+                ('1.01.03', 'Contas a Receber', 'SIZE', 0.3),
+                ('1.01.03.01', 'Clientes', 'SIZE', 0.25),
+                ('1.01.03.02', 'Outras Contas a Receber', 'SIZE', 0.05),
+                ('1.01.04', 'Estoques', 'SIZE', 0.2),
+                ('1.01.06', 'Tributos a Recuperar', 'SIZE', 0.1),
+                ('1.01.07', 'Despesas Antecipadas', 'SIZE', 0.02),
+                ('1.01.08', 'Outros Ativos Circulantes', 'SIZE', 0.08),
+                ('1.02', 'Ativo Não Circulante', 'SIZE', 2),
+                ('1.02.01', 'Ativo Realizável a Longo Prazo', 'SIZE', 0.3),
+                ('1.02.01.01', 'Aplicações Financeiras Avaliadas a Valor Justo', 'SIZE', 0.05),
+                ('1.02.01.04', 'Contas a Receber', 'SIZE', 0.05),
+                ('1.02.01.07', 'Tributos Diferidos', 'SIZE', 0.1),
+                ('1.02.01.10', 'Outros Ativos Não Circulantes', 'SIZE', 0.1),
+                ('1.02.02', 'Investimentos', 'SIZE', 0.3),
+                ('1.02.02.01', 'Participações Societárias', 'SIZE', 0.3),
+                ('1.02.03', 'Imobilizado', 'SIZE', 1),
+                ('1.02.03.01', 'Imobilizado em Operação', 'SIZE', 0.8),
+                ('1.02.03.03', 'Imobilizado em Andamento', 'SIZE', 0.2),
+                ('1.02.04', 'Intangível', 'SIZE', 0.4),
+                ('1.02.04.01', 'Intangíveis', 'SIZE', 0.4)]
+
+bpp_accounts = [('2', 'Passivo Total', 'SIZE', 3),
+                ('2.01', 'Passivo Circulante', 'SIZE', 0.8),
+                ('2.01.01', 'Obrigações Sociais e Trabalhistas', 'SIZE', 0.05),
+                ('2.01.02', 'Fornecedores', 'SIZE', 0.2),
+                ('2.01.03', 'Obrigações Fiscais', 'SIZE', 0.05),
+                ('2.01.05', 'Outras Obrigações', 'SIZE', 0.1),
+                ('2.01.06', 'Provisões', 'SIZE', 0.02),
+                ('2.02', 'Passivo Não Circulante', 'SIZE', 1),
+                ('2.02.02', 'Outras Obrigações', 'SIZE', 0.1),
+                ('2.02.03', 'Tributos Diferidos', 'SIZE', 0.1),
+                ('2.02.04', 'Provisões', 'SIZE', 0.05)]
+# Debt accounts and probability of each company having them
+bpp_debt_accounts = [(0.85, ('2.01.04', 'Empréstimos e Financiamentos', 'SIZE', 0.2)),
+                     (0.7, ('2.02.01', 'Empréstimos e Financiamentos', 'SIZE', 0.6))]
+equity_description = {'con': 'Patrimônio Líquido Consolidado', 'ind': 'Patrimônio Líquido'}
+equity_sub_accounts = [('.01', 'Capital Social Realizado', 'SIZE', 0.8),
+                       ('.02', 'Reservas de Capital', 'SIZE', 0.1),
+                       ('.04', 'Reservas de Lucros', 'SIZE', 0.3),
+                       ('.05', 'Lucros/Prejuízos Acumulados', 'SIZE', 0),
+                       ('.08', 'Outros Resultados Abrangentes', 'SIZE', 0.01)]
+
+dfc_accounts = [('6.01', 'Caixa Líquido Atividades Operacionais', 'SIZE', 0.12),
+                ('6.01.01', 'Caixa Gerado nas Operações', 'SIZE', 0.15),
+                ('6.01.01.01', 'Lucro Líquido do Exercício', 'E', 1),
+                ('6.01.01.02', 'Depreciação e Amortização', 'SIZE', 0.05),
+                ('6.01.01.03', 'Resultado de Equivalência Patrimonial', 'SIZE', -0.01),
+                ('6.01.01.04', 'Juros e Variações Monetárias', 'SIZE', 0.03),
+                ('6.01.02', 'Variações nos Ativos e Passivos', 'SIZE', -0.03),
+                ('6.01.02.01', 'Contas a Receber', 'SIZE', -0.02),
+                ('6.01.02.02', 'Estoques', 'SIZE', -0.01),
+                ('6.01.02.03', 'Fornecedores', 'SIZE', 0.01),
+                ('6.01.02.04', 'Impostos Pagos', 'SIZE', -0.02),
+                ('6.02', 'Caixa Líquido Atividades de Investimento', 'SIZE', -0.08),
+                ('6.02.01', 'Aquisição de Imobilizado', 'SIZE', -0.06),
+                ('6.02.02', 'Aquisição de Intangível', 'SIZE', -0.02),
+                ('6.02.03', 'Resgate de Aplicações Financeiras', 'SIZE', 0.01),
+                ('6.03', 'Caixa Líquido Atividades de Financiamento', 'SIZE', -0.03),
+                ('6.04', 'Variação Cambial s/ Caixa e Equivalentes', 'SIZE', 0.001),
+                ('6.05', 'Aumento (Redução) de Caixa e Equivalentes', 'SIZE', 0.01),
+                ('6.05.01', 'Saldo Inicial de Caixa e Equivalentes', 'SIZE', 0.2),
+                ('6.05.02', 'Saldo Final de Caixa e Equivalentes', 'SIZE', 0.21)]
+# Financing accounts (6.03.xx, numbered in this order) and probability of each company having them
+dfc_financing_accounts = [(0.8, ('Captação de Empréstimos e Financiamentos', 'SIZE', 0.2)),
+                          (0.8, ('Pagamento de Empréstimos e Financiamentos', 'SIZE', -0.15)),
+                          (0.6, ('Dividendos Pagos', 'D', 0.7)),
+                          (0.4, ('Juros sobre o Capital Próprio Pagos', 'D', 0.3)),
+                          (0.15, ('Dividendos e Juros sobre o Capital Próprio Pagos', 'D', 1)),
+                          (0.5, ('Pagamento de Arrendamento Mercantil', 'SIZE', -0.02)),
+                          (0.1, ('Aumento de Capital', 'SIZE', 0.05)),
+                          (0.15, ('Aquisição de Ações em Tesouraria', 'SIZE', -0.01)),
+                          (0.05, ('Dividendos Recebidos de Controladas', 'SIZE', 0.01))]
+
+# Number of random weights of each company (accounts of a company use the weight of their position)
+num_weights = 64
+
+
+def account_frame(accounts):
+    return pd.DataFrame(accounts, columns=['CD_CONTA', 'DS_CONTA', 'KIND', 'FACTOR'])
+
+
+# Accounts of the companies (C: position of the company) with the given accounts
+def cross_accounts(positions, accounts):
+    return pd.DataFrame({'C': positions}).merge(account_frame(accounts), how='cross')
+
+
+# CVM companies, listed (the first num_listed) and unlisted. Returns a dictionary of arrays, one value per company.
+def make_companies(num_companies, first_year, last_year, rng):
+    codes = np.sort(rng.choice(np.arange(1000, 1000 + max(100000, 20 * num_companies)), num_companies, replace=False))
+    first = np.where(rng.random(num_companies) < 0.2, rng.integers(first_year, last_year + 1, num_companies),
+                     first_year)
+    last = np.where(rng.random(num_companies) < 0.08, rng.integers(first_year, last_year + 1, num_companies),
+                    last_year)
+    return {'CD_CVM': codes,
+            'DENOM_CIA': np.array([f'COMPANHIA SINTÉTICA {code} S.A.' for code in codes], dtype=object),
+            'CNPJ_CIA': np.array([f'{code // 1000000:02d}.{code // 1000 % 1000:03d}.{code % 1000:03d}/0001-'
+                                  f'{code % 97:02d}' for code in codes], dtype=object),
+            'FIRST_YEAR': first, 'LAST_YEAR': np.maximum(first, last),
+            'IND_ONLY': rng.random(num_companies) < 0.15,
+            'DIRECT_DFC': rng.random(num_companies) < 0.05,
+            # Year missing from the '_con' sheets (0: none)
+            'CON_GAP_YEAR': np.where(rng.random(num_companies) < 0.1,
+                                     rng.integers(first_year, last_year + 1, num_companies), 0),
+            'MIL': rng.random(num_companies) < 0.85,
+            'VERSAO': rng.choice([1, 1, 1, 2, 3], num_companies),
+            'EARNINGS_CODE': rng.choice(['3.09', '3.11', '3.13'], num_companies, p=[0.2, 0.65, 0.15]),
+            'EQUITY_CODE': rng.choice(['2.03', '2.07'], num_companies, p=[0.9, 0.1]),
+            'EPS_VARIANT': rng.choice(list(eps_variants), num_companies,
+                                      p=[probability for probability, _ in eps_variants.values()]),
+            'SHARES': np.round(np.exp(rng.normal(18.5, 1.2, num_companies))),
+            'PAYOUT': rng.uniform(0, 0.6, num_companies)}
+
+
+# Values of the companies for each year from first_year - 1 (PENÚLTIMO of the first year) to last_year:
+# (companies, years) arrays of revenue, earnings, EPS and dividends paid
+def make_values(companies, num_years, rng):
+    num_companies = len(companies['CD_CVM'])
+    growth = rng.normal(0.05, 0.15, (num_companies, num_years)).cumsum(axis=1)
+    size = np.exp(rng.normal(21, 1.5, (num_companies, 1)) + growth)
+    earnings = size * rng.normal(0.07, 0.12, (num_companies, num_years))
+    eps = earnings / companies['SHARES'][:, np.newaxis]
+    dividends = np.maximum(earnings, 0) * companies['PAYOUT'][:, np.newaxis]
+    return {'SIZE': size, 'E': earnings, 'EPS': eps, 'D': dividends,
+            'WEIGHTS': rng.uniform(0.5, 1.5, (num_companies, num_weights))}
+
+
+# Accounts of each company in a statement and scope: C, CD_CONTA, DS_CONTA, KIND, FACTOR and ORDER (position of the
+# random weight of the account), sorted by company and account code. The random choices are made with a generator
+# seeded by the statement, so the accounts of a company are the same in every year and scope.
+def company_accounts(companies, statement, scope, seed):
+    statement_index = ['DRE', 'BPA', 'BPP', 'DFC'].index(statement)
+    rng = np.random.default_rng([seed, statement_index])
+    num_companies = len(companies['CD_CVM'])
+    positions = np.arange(num_companies)
+    pieces = []
+
+    if statement == 'DRE':
+        pieces.append(cross_accounts(positions, dre_accounts))
+        earnings_code = companies['EARNINGS_CODE']
+        for code, description, kind, factor in dre_intermediate_accounts:
+            pieces.append(cross_accounts(positions[earnings_code > code], [(code, description, kind, factor)]))
+        earnings = pd.DataFrame({'C': positions, 'CD_CONTA': earnings_code, 'DS_CONTA': earnings_description[scope],
+                                 'KIND': 'E', 'FACTOR': 1.0})
+        pieces.append(earnings)
+        if scope == 'con':
+            for suffix, description, kind, factor in earnings_sub_accounts:
+                pieces.append(earnings.assign(CD_CONTA=earnings['CD_CONTA'] + suffix, DS_CONTA=description,
+                                              KIND=kind, FACTOR=factor))
+        for variant, (_, accounts) in eps_variants.items():
+            pieces.append(cross_accounts(positions[companies['EPS_VARIANT'] == variant],
+                                         [(code, description, 'EPS', factor) for code, description, factor in
+                                          accounts]))
+    elif statement == 'BPA':
+        pieces.append(cross_accounts(positions, bpa_accounts))
+    elif statement == 'BPP':
+        pieces.append(cross_accounts(positions, bpp_accounts))
+        for probability, account in bpp_debt_accounts:
+            pieces.append(cross_accounts(positions[rng.random(num_companies) < probability], [account]))
+        equity = pd.DataFrame({'C': positions, 'CD_CONTA': companies['EQUITY_CODE'],
+                               'DS_CONTA': equity_description[scope], 'KIND': 'SIZE', 'FACTOR': 1.2})
+        pieces.append(equity)
+        for suffix, description, kind, factor in equity_sub_accounts:
+            pieces.append(equity.assign(CD_CONTA=equity['CD_CONTA'] + suffix, DS_CONTA=description, KIND=kind,
+                                        FACTOR=factor))
+    else:
+        pieces.append(cross_accounts(positions, dfc_accounts))
+        # Each company has a subset of the financing accounts, numbered from 6.03.01
+        financing = []
+        for order, (probability, (description, kind, factor)) in enumerate(dfc_financing_accounts):
+            selected = positions[rng.random(num_companies) < probability]
+            financing.append(pd.DataFrame({'C': selected, 'ORDER': order, 'DS_CONTA': description, 'KIND': kind,
+                                           'FACTOR': factor}))
+        financing = pd.concat(financing, ignore_index=True).sort_values(['C', 'ORDER'], kind='stable')
+        number = financing.groupby('C').cumcount() + 1
+        pieces.append(financing.assign(CD_CONTA='6.03.' + number.map('{:02d}'.format)).drop(columns='ORDER'))
+
+    accounts = pd.concat(pieces, ignore_index=True).sort_values(['C', 'CD_CONTA'], kind='stable', ignore_index=True)
+    # Position of the random weight of each account (different positions for the accounts of each statement)
+    accounts['ORDER'] = accounts.groupby('C').cumcount() + statement_index * num_weights // 4
+    return accounts
+
+
+# Rows of a DFP file for the companies at the given positions (one chunk of the companies)
+def statement_rows(companies, values, accounts, positions, statement, scope, year, first_year):
+    columns = [column for column in dfp_columns if statement not in ['BPA', 'BPP'] or column != 'DT_INI_EXERC']
+    if len(positions) == 0:
+        return pd.DataFrame(columns=columns)
+    # One block of accounts for each company and exercise (ÚLTIMO: year, PENÚLTIMO: year - 1)
+    blocks = pd.DataFrame({'C': np.repeat(positions, 2),
+                           'ORDEM_EXERC': np.tile(['PENÚLTIMO', 'ÚLTIMO'], len(positions)),
+                           'YEAR': np.tile([year - 1, year], len(positions))})
+    rows = blocks.merge(accounts[accounts['C'].isin(positions)], on='C')
+    c = rows['C'].to_numpy()
+    y = rows['YEAR'].to_numpy() - (first_year - 1)
+
+    kind_values = np.zeros(len(rows))
+    for kind in ['SIZE', 'E', 'EPS', 'D']:
+        mask = (rows['KIND'] == kind).to_numpy()
+        kind_values[mask] = values[kind][c[mask], y[mask]]
+    weights = values['WEIGHTS'][c, rows['ORDER'].to_numpy() % num_weights]
+    weighted = rows['KIND'].isin(['SIZE', 'D']).to_numpy()
+    value = kind_values * rows['FACTOR'].to_numpy() * np.where(weighted, weights, 1)
+    # Dividends paid are negative cash flows
+    value = np.where((rows['KIND'] == 'D').to_numpy(), -value, value)
+
+    is_eps = (rows['KIND'] == 'EPS').to_numpy()
+    mil = companies['MIL'][c]
+    # Adding 0.0 turns the negative zeros into zeros
+    value = np.where(is_eps, np.round(value, 5), np.round(np.where(mil, value / 1000, value))) + 0.0
+
+    statement_name = statement_names[statement]
+    data_frame = pd.DataFrame({
+        'CNPJ_CIA': companies['CNPJ_CIA'][c],
+        'DT_REFER': f'{year}-12-31',
+        'VERSAO': companies['VERSAO'][c],
+        'DENOM_CIA': companies['DENOM_CIA'][c],
+        'CD_CVM': companies['CD_CVM'][c],
+        'GRUPO_DFP': f'{scope_names[scope]} - {statement_name}',
+        'MOEDA': 'REAL',
+        'ESCALA_MOEDA': np.where(mil, 'MIL', 'UNIDADE'),
+        'ORDEM_EXERC': rows['ORDEM_EXERC'].to_numpy(),
+        'DT_INI_EXERC': rows['YEAR'].astype(str).to_numpy() + '-01-01',
+        'DT_FIM_EXERC': rows['YEAR'].astype(str).to_numpy() + '-12-31',
+        'CD_CONTA': rows['CD_CONTA'].to_numpy(),
+        'DS_CONTA': rows['DS_CONTA'].to_numpy(),
+        'VL_CONTA': value,
+        'ST_CONTA_FIXA': np.where(rows['CD_CONTA'].str.count(r'\.').to_numpy() <= 1, 'S', 'N')})
+    return data_frame[columns]
+
+
+# Write the DFP files of all the years. Companies are written in chunks of chunk_size, so the memory used does not
+# grow with the number of companies. Returns the number of rows of each file.
+def write_cvm_files(companies, values, first_year, last_year, out_dir, seed, chunk_size=20000):
+    os.makedirs(out_dir, exist_ok=True)
+    file_rows = {}
+    for suffix in file_suffix:
+        statement, scope = suffix.rsplit('_', 1)
+        statement_group = 'DFC' if statement.startswith('DFC') else statement
+        accounts = company_accounts(companies, statement_group, scope, seed)
+        for year in range(first_year, last_year + 1):
+            active = (companies['FIRST_YEAR'] <= year) & (companies['LAST_YEAR'] >= year)
+            if scope == 'con':
+                active &= ~companies['IND_ONLY'] & (companies['CON_GAP_YEAR'] != year)
+            if statement == 'DFC_MI':
+                active &= ~companies['DIRECT_DFC']
+            elif statement == 'DFC_MD':
+                active &= companies['DIRECT_DFC']
+            positions = np.flatnonzero(active)
+
+            file_name = f'dfp_cia_aberta_{suffix}_{year}.csv'
+            file_rows[file_name] = 0
+            for start in range(0, max(len(positions), 1), chunk_size):
+                rows = statement_rows(companies, values, accounts, positions[start:start + chunk_size], statement,
+                                      scope, year, first_year)
+                rows.to_csv(os.path.join(out_dir, file_name), sep=';', decimal='.', encoding='ISO-8859-1',
+                            index=False, header=start == 0, mode='w' if start == 0 else 'a', float_format='%.10f')
+                file_rows[file_name] += len(rows)
+    return file_rows
+
+
+# Ticker list: TICKER, C (position of the company, -1 without CVM code) and whether the company name is known.
+# The first ticker of a company ends with 3 and the next ones with 4 and 11, as ON, PN and units.
+def make_tickers(num_tickers, rng):
+    # About 62% of the tickers have a CVM code
+    has_code = rng.random(num_tickers) >= 0.38
+    # A ticker with code shares the company of the previous ticker with code with probability 0.15
+    shares_company = has_code & (rng.random(num_tickers) < 0.15)
+    shares_company[np.flatnonzero(has_code)[:1]] = False
+    company = np.where(has_code, np.cumsum(has_code & ~shares_company) - 1, -1)
+
+    group = np.cumsum(~shares_company) - 1
+    letters = np.array([''.join(chr(65 + group_id // 26 ** k % 26) for k in range(3, -1, -1)) for group_id in group])
+    suffix = np.array(['3', '4', '11', '5', '6'])[np.minimum(pd.Series(group).groupby(group).cumcount(), 4)]
+    return pd.DataFrame({'TICKER': np.char.add(letters, suffix), 'C': company,
+                         'NAMED': ~(has_code & (rng.random(num_tickers) < 0.01))})
+
+
+def write_ticker_list(tickers, companies, path):
+    listed = tickers['C'].to_numpy()
+    has_code = listed >= 0
+    named = has_code & tickers['NAMED'].to_numpy()
+    position = np.maximum(listed, 0)
+    ticker_list = pd.DataFrame({
+        'Ticker': tickers['TICKER'],
+        'CD_CVM': np.where(has_code, companies['CD_CVM'][position].astype(str), '-'),
+        'DENOM_CIA': np.where(named, companies['DENOM_CIA'][position], '-'),
+        'CNPJ_CIA': np.where(named, companies['CNPJ_CIA'][position], '-')})
+    ticker_list.to_csv(path, sep=';', encoding='ISO-8859-1', index=False)
+
+
+# Monthly prices (first day of the month) from January of first_year + 1 to December of last_year + 1, as
+# Extract_YFinance.py. Some tickers have no prices (failed downloads), start later or end earlier.
+def write_price_files(tickers, companies, first_year, last_year, out_dir, rng):
+    os.makedirs(out_dir, exist_ok=True)
+    dates = pd.date_range(f'{first_year + 1}-01-01', f'{last_year + 1}-12-01', freq='MS')
+    num_tickers, num_months = len(tickers), len(dates)
+
+    log_returns = rng.normal(0.005, 0.1, (num_tickers, num_months))
+    close = np.exp(np.log(rng.uniform(2, 80, (num_tickers, 1))) + log_returns.cumsum(axis=1))
+    # Adjusted prices are lower in the past by the dividends paid since then
+    dividend_yield = rng.uniform(0, 0.008, (num_tickers, 1))
+    adjusted = close * np.exp(-dividend_yield * np.arange(num_months - 1, -1, -1))
+
+    start = np.where(rng.random(num_tickers) < 0.15, rng.integers(0, num_months, num_tickers), 0)
+    end = np.where(rng.random(num_tickers) < 0.1, rng.integers(0, num_months, num_tickers) + 1, num_months)
+    month = np.arange(num_months)
+    available = (month >= start[:, np.newaxis]) & (month < np.maximum(end, start + 1)[:, np.newaxis])
+    available[rng.random(num_tickers) < 0.03] = False
+
+    company = tickers['C'].to_numpy()
+    shares = np.where(company >= 0, companies['SHARES'][np.maximum(company, 0)],
+                      np.round(np.exp(rng.normal(18.5, 1.2, num_tickers))))
+    ticker_index, month_index = np.nonzero(available)
+    technical_data = pd.DataFrame({'TICKER': tickers['TICKER'].to_numpy()[ticker_index],
+                                   'DATE': dates[month_index].strftime('%Y-%m-%d'),
+                                   'CLOSE': close[ticker_index, month_index],
+                                   'ADJ_CLOSE': adjusted[ticker_index, month_index],
+                                   'MARKET_CAP': close[ticker_index, month_index] * shares[ticker_index]})
+    technical_data.to_csv(os.path.join(out_dir, 'technicalData_yf.csv'), sep=';', decimal='.', encoding='ISO-8859-1',
+                          index=False)
+
+    market_data = pd.DataFrame({'TICKER': 'BOVA11.SA', 'DATE': dates.strftime('%Y-%m-%d'),
+                                'CLOSE': 60 * np.exp(rng.normal(0.006, 0.06, num_months).cumsum())})
+    market_data.to_csv(os.path.join(out_dir, 'technicalData_BOVA11_yf.csv'), sep=';', decimal='.',
+                       encoding='ISO-8859-1', index=False)
+    return {'technicalData_yf.csv': len(technical_data), 'technicalData_BOVA11_yf.csv': len(market_data)}
+
+
+# Daily bars (business days) of the tickers and of BOVA11.SA, saved to the price arrays in out_dir/Daily.
+# The bars are generated for chunk_size tickers at a time.
+def write_daily_price_arrays(tickers, companies, first_year, last_year, out_dir, rng, chunk_size=500):
+    dates = pd.bdate_range(f'{first_year + 1}-01-01', f'{last_year + 1}-12-31').to_numpy().astype('datetime64[D]')
+    num_tickers, num_days = len(tickers), len(dates)
+    company = tickers['C'].to_numpy()
+    shares = np.where(company >= 0, companies['SHARES'][np.maximum(company, 0)],
+                      np.round(np.exp(rng.normal(18.5, 1.2, num_tickers))))
+
+    ticker_rows, arrays = [], {'DATE': [], 'CLOSE': [], 'ADJ_CLOSE': [], 'MARKET_CAP': []}
+    for first in range(0, num_tickers, chunk_size):
+        size = min(chunk_size, num_tickers - first)
+        close = np.exp(np.log(rng.uniform(2, 80, (size, 1))) +
+                       rng.normal(0.00025, 0.022, (size, num_days)).cumsum(axis=1))
+        # Adjusted prices are lower in the past by the dividends paid since then
+        adjusted = close * np.exp(-rng.uniform(0, 0.0004, (size, 1)) * np.arange(num_days - 1, -1, -1))
+
+        start = np.where(rng.random(size) < 0.15, rng.integers(0, num_days, size), 0)
+        end = np.where(rng.random(size) < 0.1, rng.integers(0, num_days, size) + 1, num_days)
+        day = np.arange(num_days)
+        available = (day >= start[:, np.newaxis]) & (day < np.maximum(end, start + 1)[:, np.newaxis])
+        available[rng.random(size) < 0.03] = False
+
+        ticker_index, day_index = np.nonzero(available)
+        ticker_rows.append(available.sum(axis=1))
+        arrays['DATE'].append(dates[day_index])
+        arrays['CLOSE'].append(close[ticker_index, day_index])
+        arrays['ADJ_CLOSE'].append(adjusted[ticker_index, day_index])
+        arrays['MARKET_CAP'].append(close[ticker_index, day_index] * shares[first + ticker_index])
+
+    market_close = 60 * np.exp(rng.normal(0.0003, 0.013, num_days).cumsum())
+    ticker_rows.append([num_days])
+    arrays['DATE'].append(dates)
+    arrays['CLOSE'].append(market_close)
+    arrays['ADJ_CLOSE'].append(market_close)
+    arrays['MARKET_CAP'].append(np.full(num_days, np.nan))
+
+    rows = np.concatenate(ticker_rows)
+    stops = rows.cumsum()
+    index = pd.DataFrame({'TICKER': np.append(tickers['TICKER'].to_numpy(), 'BOVA11.SA'), 'START': stops - rows,
+                          'STOP': stops})
+    save_price_arrays(os.path.join(out_dir, 'Daily'), index[rows > 0],
+                      {name: np.concatenate(values) for name, values in arrays.items()})
+    return {'Daily': int(stops[-1])}
+
+
+# Number of tickers of scale 1 (tickers of the ETL)
+def base_tickers():
+    return len(pd.read_csv(os.path.join(etl_dir, 'Ticker_CVMCode.csv'), sep=';', encoding='ISO-8859-1'))
+
+
+# Write the synthetic data to output_dir (a folder with the layout of the ETL folder)
+# tickers:          number of tickers (default: scale times the number of tickers of the ETL)
+# unlisted_ratio:   companies in the CVM files that are not in the ticker list, for each listed company
+# daily:            also write daily bars
+# Returns the parameters and the number of rows of each file, also saved in output_dir/synthetic_data.json.
+def generate_data(output_dir, scale=1, tickers=None, first_year=2012, last_year=2023, unlisted_ratio=5, seed=0,
+                  daily=False):
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    num_tickers = tickers or int(round(scale * base_tickers()))
+    ticker_frame = make_tickers(num_tickers, rng)
+    num_listed = ticker_frame['C'].max() + 1
+    companies = make_companies(max(1, int(round(num_listed * (1 + unlisted_ratio)))), first_year, last_year, rng)
+    values = make_values(companies, last_year - first_year + 2, rng)
+
+    write_ticker_list(ticker_frame, companies, os.path.join(output_dir, 'Ticker_CVMCode.csv'))
+    file_rows = write_cvm_files(companies, values, first_year, last_year,
+                                os.path.join(output_dir, 'Extract', 'CVM', 'Extracted'), seed)
+    file_rows.update(write_price_files(ticker_frame, companies, first_year, last_year,
+                                       os.path.join(output_dir, 'Extract', 'YFinance', 'Extracted'), rng))
+    if daily:
+        file_rows.update(write_daily_price_arrays(ticker_frame, companies, first_year, last_year,
+                                                  os.path.join(output_dir, 'Extract', 'YFinance', 'Extracted'), rng))
+
+    summary = {'parameters': {'scale': scale, 'tickers': num_tickers, 'first_year': first_year,
+                              'last_year': last_year, 'unlisted_ratio': unlisted_ratio, 'seed': seed,
+                              'daily': daily},
+               'companies': len(companies['CD_CVM']), 'rows': file_rows}
+    with open(os.path.join(output_dir, 'synthetic_data.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic CVM and YFinance data for the ETL')
+    parser.add_argument('output_dir', help='folder of the data (with the layout of the ETL folder)')
+    parser.add_argument('--scale', type=float, default=1, help='number of tickers, relative to Ticker_CVMCode.csv')
+    parser.add_argument('--tickers', type=int, default=None, help='number of tickers (instead of --scale)')
+    parser.add_argument('--first-year', type=int, default=2012, help='first year of the CVM files')
+    parser.add_argument('--last-year', type=int, default=2023, help='last year of the CVM files')
+    parser.add_argument('--unlisted-ratio', type=float, default=5, help='unlisted companies per listed company')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random data')
+    parser.add_argument('--daily', action='store_true', help='also write daily bars')
+    args = parser.parse_args()
+
+    data_summary = generate_data(args.output_dir, args.scale, args.tickers, args.first_year, args.last_year,
+                                 args.unlisted_ratio, args.seed, args.daily)
+    print(f'{data_summary["parameters"]["tickers"]} tickers, {data_summary["companies"]} CVM companies, '
+          f'{sum(data_summary["rows"].values())} rows written to {args.output_dir}')
@@ -0,0 +1,139 @@
+# Download and extraction of the CVM DFP archives.
+# Files are downloaded concurrently by a bounded pool of workers. Interrupted downloads are resumed with HTTP range
+# requests and files already downloaded are only transferred again if the server reports a change (ETag/Last-Modified).
+# The manifest keeps the headers and the SHA-256 checksum of every downloaded file.
+
+import hashlib
+import json
+import os
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from zipfile import ZipFile
+
+chunk_size = 1024 * 1024
+
+
+def read_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def write_manifest(manifest_path, manifest):
+    # Write to a temporary file first, so an interrupted run does not leave a corrupted manifest
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# First byte of a 206 response, from its Content-Range header (bytes {first}-{last}/{length}), or None
+def content_range_start(content_range):
+    if not content_range or not content_range.startswith('bytes '):
+        return None
+    first = content_range[len('bytes '):].split('-', 1)[0]
+    return int(first) if first.strip().isdigit() else None
+
+
+# Download a single file to out_path.
+# entry: manifest entry of the previous download of the file (or None)
+# Returns the new manifest entry and whether the file changed
+def download_file(url, out_path, entry=None, timeout=60):
+    part_path = out_path + '.part'
+    headers = {}
+
+    # Only trust the previous download if the local file matches the recorded checksum
+    valid = entry is not None and os.path.exists(out_path) and file_sha256(out_path) == entry.get('sha256')
+    if valid:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    # Resume an interrupted download. If-Range makes the server send the whole file if it changed in the meantime.
+    # The validator of the interrupted download is kept next to the partial file.
+    resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if resume_from and os.path.exists(part_path + '.json'):
+        with open(part_path + '.json', 'r', encoding='utf-8') as f:
+            validator = json.load(f)
+        if validator.get('etag') or validator.get('last_modified'):
+            headers['Range'] = f'bytes={resume_from}-'
+            headers['If-Range'] = validator.get('etag') or validator.get('last_modified')
+
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return entry, False
+        if e.code == 416 and resume_from:
+            # Range not satisfiable: the partial file is no longer valid
+            os.remove(part_path)
+            return download_file(url, out_path, entry, timeout)
+        raise
+
+    with response:
+        if response.status == 206 and content_range_start(response.headers.get('Content-Range')) != resume_from:
+            # The server sent another part of the file: appending it would corrupt the file, so start over
+            os.remove(part_path)
+            return download_file(url, out_path, entry, timeout)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status != 206:
+            with open(part_path + '.json', 'w', encoding='utf-8') as f:
+                json.dump({'etag': etag, 'last_modified': last_modified}, f)
+        mode = 'ab' if response.status == 206 else 'wb'
+        with open(part_path, mode) as f:
+            for chunk in iter(lambda: response.read(chunk_size), b''):
+                f.write(chunk)
+
+    os.replace(part_path, out_path)
+    os.remove(part_path + '.json')
+    return {'url': url, 'etag': etag, 'last_modified': last_modified, 'size': os.path.getsize(out_path),
+            'sha256': file_sha256(out_path)}, True
+
+
+# Download files concurrently.
+# files: list of file names, downloaded from url_base to out_dir
+# Returns the list of files that changed
+def download_files(url_base, files, out_dir, manifest_path, max_workers=4):
+    manifest = read_manifest(manifest_path)
+    changed = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(download_file, url_base + file, os.path.join(out_dir, file), manifest.get(file)):
+                   file for file in files}
+        for i, future in enumerate(as_completed(futures)):
+            file = futures[future]
+            try:
+                entry, file_changed = future.result()
+            except Exception as e:
+                print(f'Failed to download {file}: {e}')
+                continue
+            # The manifest is only updated by the main thread
+            manifest[file] = entry
+            write_manifest(manifest_path, manifest)
+            print(f'Downloaded File ({i+1}/{len(files)}):', file, '' if file_changed else '(not modified)')
+            if file_changed:
+                changed.append(file)
+
+    return changed
+
+
+# Extract only the members of a zip file accepted by select
+def extract_members(zip_path, out_dir, select, overwrite=False):
+    extracted = []
+    with ZipFile(zip_path, 'r') as zip_file:
+        for member in zip_file.namelist():
+            if select(member) and (overwrite or not os.path.exists(os.path.join(out_dir, member))):
+                zip_file.extract(member, out_dir)
+                extracted.append(member)
+    return extracted
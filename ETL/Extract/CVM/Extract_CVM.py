@@ -1,29 +1,70 @@
 # From data available on CVM, extracts .csv files and store then in the Extract folder
+# DFP:  annual financial statements (dfp_cia_aberta_*)
+# ITR:  quarterly financial statements of the first three quarters (itr_cia_aberta_*), about 3 times the size of DFP
 
 # Imports
-import wget
-from zipfile import ZipFile
 import os
+import re
+import sys
+
+from Download_CVM import download_files, extract_members
+
+sys.path.append('../..')
+from Stage_Profiler import StageProfiler
+
+# Time, bytes and memory of each stage (see Stage_Profiler.py)
+profiler = StageProfiler('Extract_CVM')
 
 # Subtract 1 from first year, as the fundamental data will be shifted by six months.
 # i.e. Analysis from 2013 to 2023 -> first_year = 2012
 first_year = 2012
 last_year = 2023
 
-url_base = 'https://dados.cvm.gov.br/dados/CIA_ABERTA/DOC/DFP/DADOS/'
+# Documents to download and the URL of their files. Remove 'itr' to use the annual statements only.
+url_bases = {'dfp': 'https://dados.cvm.gov.br/dados/CIA_ABERTA/DOC/DFP/DADOS/',
+             'itr': 'https://dados.cvm.gov.br/dados/CIA_ABERTA/DOC/ITR/DADOS/'}
+
+# Number of files downloaded at the same time
+max_workers = 4
+
+# Extract the CSV files from the zip files. Not needed if Transform_CVM.py reads the zip files directly
+# (read_mode = 'zip')
+extract_csv_files = True
+
+# CSV File Names Suffixes used in the Transform step (see Transform_CVM.py)
+file_suffix = ['DRE_con', 'DFC_MI_con', 'DFC_MD_con', 'BPA_con', 'BPP_con', 'DRE_ind', 'DFC_MI_ind', 'DFC_MD_ind',
+               'BPA_ind', 'BPP_ind']
+member_pattern = re.compile(rf'({"|".join(url_bases)})_cia_aberta_({"|".join(file_suffix)})_\d{{4}}\.csv')
 
 # Get file names to download
-zip_files = []
-for year in range(first_year, last_year+1):
-    if not os.path.exists(f'dfp_cia_aberta_{year}.zip'):
-        zip_files.append(f'dfp_cia_aberta_{year}.zip')
+zip_files = {document: [f'{document}_cia_aberta_{year}.zip' for year in range(first_year, last_year+1)]
+             for document in url_bases}
 
 # Download files
-for i, file in enumerate(zip_files):
-    print('Dowloading File ('+str(i+1)+'/'+str(len(zip_files))+'):', file)
-    wget.download(url_base+file, out='Extracted')
+# Files already in the Extracted folder are only downloaded again if they changed in the CVM server
+download_stage = profiler.start('download', rows_in=sum(len(files) for files in zip_files.values()))
+changed_files = []
+for document, url_base in url_bases.items():
+    changed_files += download_files(url_base, zip_files[document], 'Extracted', 'Extracted/manifest.json',
+                                    max_workers)
+for file in changed_files:
+    download_stage.wrote_file('Extracted/'+file)
+profiler.stop(rows_out=len(changed_files))
 
 # Extract files
-for i, file in enumerate(zip_files):
-    print('Extractiong File ('+str(i+1)+'/'+str(len(zip_files))+'):', file)
-    ZipFile('Extracted/'+file, 'r').extractall('Extracted')
+# Only the CSV files used in the Transform step are extracted. Files that changed are extracted again.
+for document, files in zip_files.items():
+    for i, file in enumerate(files):
+        if not extract_csv_files or not os.path.exists('Extracted/'+file):
+            continue
+        print('Extracting File ('+str(i+1)+'/'+str(len(files))+'):', file)
+        # Stages extract/{document}_{year}: rows_out is the number of CSV files extracted
+        with profiler.stage(f'extract/{document}_{first_year + i}') as stage:
+            stage.read_file('Extracted/'+file)
+            members = extract_members('Extracted/'+file, 'Extracted', member_pattern.fullmatch,
+                                      overwrite=file in changed_files)
+            for member in members:
+                stage.wrote_file('Extracted/'+member)
+            stage.rows_out = len(members)
+
+profiler.save()
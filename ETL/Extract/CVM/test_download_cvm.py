@@ -0,0 +1,178 @@
+# Tests of the resumable, conditional downloads of Download_CVM.py against a local HTTP stand-in of the CVM server.
+# The stand-in serves one file with an ETag and a Last-Modified date, and supports conditional and range requests.
+# Run with: python -m pytest ETL/Extract/CVM
+
+import json
+import os
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from Download_CVM import download_file, file_sha256
+
+body = bytes(range(256)) * 40
+
+
+# State of the stand-in server: the file it serves and the requests it received
+class StandIn:
+    def __init__(self):
+        self.body = body
+        self.etag = '"v1"'
+        self.last_modified = formatdate(0, usegmt=True)
+        # Offset added to the start of the range sent in 206 responses (a server sending the wrong part of the file)
+        self.range_offset = 0
+        # (request headers, response status) of every request
+        self.requests = []
+        self.url = None
+
+    def statuses(self):
+        return [status for _, status in self.requests]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, content=b'', headers=None):
+        self.server.stand_in.requests.append((dict(self.headers), status))
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        validators = {'ETag': stand_in.etag, 'Last-Modified': stand_in.last_modified}
+
+        if self.headers.get('If-None-Match') is not None:
+            if self.headers['If-None-Match'] == stand_in.etag:
+                return self.respond(304, headers=validators)
+        elif self.headers.get('If-Modified-Since') == stand_in.last_modified:
+            return self.respond(304, headers=validators)
+
+        requested = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if requested and (if_range is None or if_range in (stand_in.etag, stand_in.last_modified)):
+            start = int(requested[len('bytes='):].split('-')[0])
+            if start >= len(stand_in.body):
+                return self.respond(416, headers={'Content-Range': f'bytes */{len(stand_in.body)}'})
+            start = max(start + stand_in.range_offset, 0)
+            content_range = f'bytes {start}-{len(stand_in.body) - 1}/{len(stand_in.body)}'
+            return self.respond(206, stand_in.body[start:], {**validators, 'Content-Range': content_range})
+
+        self.respond(200, stand_in.body, validators)
+
+
+@pytest.fixture
+def server():
+    http_server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    http_server.stand_in = StandIn()
+    http_server.stand_in.url = f'http://127.0.0.1:{http_server.server_port}/dfp_cia_aberta_2020.zip'
+    thread = threading.Thread(target=http_server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield http_server.stand_in
+    http_server.shutdown()
+    http_server.server_close()
+    thread.join()
+
+
+# Partial file of an interrupted download, with the validator of the response it came from
+def write_partial(out_path, content, etag):
+    with open(out_path + '.part', 'wb') as f:
+        f.write(content)
+    with open(out_path + '.part.json', 'w', encoding='utf-8') as f:
+        json.dump({'etag': etag, 'last_modified': None}, f)
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def assert_downloaded(out_path, entry, content):
+    assert read_file(out_path) == content
+    assert entry['sha256'] == file_sha256(out_path)
+    assert entry['size'] == len(content)
+    assert not os.path.exists(out_path + '.part')
+    assert not os.path.exists(out_path + '.part.json')
+
+
+def test_fresh_download(server, tmp_path):
+    out_path = str(tmp_path / 'dfp.zip')
+    entry, changed = download_file(server.url, out_path)
+
+    assert changed
+    assert_downloaded(out_path, entry, body)
+    assert entry['etag'] == server.etag
+    assert entry['last_modified'] == server.last_modified
+    assert server.statuses() == [200]
+
+
+def test_not_modified_is_skipped(server, tmp_path):
+    out_path = str(tmp_path / 'dfp.zip')
+    entry, _ = download_file(server.url, out_path)
+
+    new_entry, changed = download_file(server.url, out_path, entry)
+    assert not changed
+    assert new_entry == entry
+    assert server.statuses() == [200, 304]
+    assert server.requests[-1][0]['If-None-Match'] == server.etag
+    assert server.requests[-1][0]['If-Modified-Since'] == server.last_modified
+
+
+def test_changed_file_is_downloaded_again(server, tmp_path):
+    out_path = str(tmp_path / 'dfp.zip')
+    entry, _ = download_file(server.url, out_path)
+    server.body, server.etag = body[::-1], '"v2"'
+
+    entry, changed = download_file(server.url, out_path, entry)
+    assert changed
+    assert_downloaded(out_path, entry, body[::-1])
+    assert server.statuses() == [200, 200]
+
+
+def test_partial_file_is_resumed(server, tmp_path):
+    out_path = str(tmp_path / 'dfp.zip')
+    write_partial(out_path, body[:3000], server.etag)
+
+    entry, changed = download_file(server.url, out_path)
+    assert changed
+    assert_downloaded(out_path, entry, body)
+    assert server.statuses() == [206]
+    assert server.requests[0][0]['Range'] == 'bytes=3000-'
+    assert server.requests[0][0]['If-Range'] == server.etag
+
+
+def test_if_range_mismatch_downloads_the_whole_file(server, tmp_path):
+    out_path = str(tmp_path / 'dfp.zip')
+    write_partial(out_path, b'stale' * 600, '"v0"')
+
+    entry, changed = download_file(server.url, out_path)
+    assert changed
+    assert_downloaded(out_path, entry, body)
+    assert server.statuses() == [200]
+
+
+def test_range_not_satisfiable_restarts(server, tmp_path):
+    out_path = str(tmp_path / 'dfp.zip')
+    write_partial(out_path, body + b'extra', server.etag)
+
+    entry, changed = download_file(server.url, out_path)
+    assert changed
+    assert_downloaded(out_path, entry, body)
+    assert server.statuses() == [416, 200]
+
+
+def test_wrong_content_range_restarts(server, tmp_path):
+    out_path = str(tmp_path / 'dfp.zip')
+    write_partial(out_path, body[:3000], server.etag)
+    server.range_offset = -1000
+
+    entry, changed = download_file(server.url, out_path)
+    assert changed
+    assert_downloaded(out_path, entry, body)
+    assert server.statuses() == [206, 200]
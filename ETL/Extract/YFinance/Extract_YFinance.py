@@ -1,8 +1,22 @@
 # Extract technical data from assets
+# Monthly bars (interval = '1mo') are saved to technicalData_yf.csv and technicalData_BOVA11_yf.csv, for
+# Merge_YFinance_CVM.py. Daily bars (interval = '1d') are saved to the price arrays in Extracted/Daily (see
+# Price_Arrays.py), with BOVA11 as the ticker BOVA11.SA, for Merge_Daily_YFinance_CVM.py.
+
+import os
+import sys
 
-import yfinance as yf
 import pandas as pd
 
+from Fetch_YFinance import YFinanceBackend, FixtureBackend, update_price_store, fetch_shares_outstanding
+
+sys.path.append('../..')
+from Price_Arrays import write_price_arrays
+from Stage_Profiler import StageProfiler
+
+# Time, rows, bytes and memory of each stage (see Stage_Profiler.py)
+profiler = StageProfiler('Extract_YFinance')
+
 # Ticker list
 stockList = pd.read_csv(f'../../Ticker_CVMCode.csv', sep=';', encoding='ISO-8859-1')
 tickers = stockList['Ticker']
@@ -11,80 +25,95 @@ tickers = stockList['Ticker']
 start_date = "2013-01-01"
 end_date = "2024-12-31"
 
+# Fetch backend:
+# YFinanceBackend():                fetch data from Yahoo Finance
+# FixtureBackend('<fixture_dir>'):  read fixture data (offline runs, see Fetch_YFinance.py)
+backend = YFinanceBackend()
+
+# Bar interval: 1mo or 1d
+interval = '1mo'
+
+# Local price store (one file per ticker). Only the bars after the last stored date are fetched.
+store_dir = 'Extracted/Prices' if interval == '1mo' else f'Extracted/Prices_{interval}'
+
+# Price arrays of the daily bars
+daily_dir = 'Extracted/Daily'
+
+# Number of tickers per download request
+batch_size = 50
+
+# Number of concurrent requests for the number of shares and maximum number of requests per second
+max_workers = 8
+requests_per_second = 2
+
+########################################################################################################################
+# Extract information from the tickers
+symbols = [ticker + ".SA" for ticker in tickers]
+
+print(f"Extracting data from {len(symbols)} tickers")
+# Historical values
+profiler.start('prices', rows_in=len(symbols) + 1)
+prices = update_price_store(backend, symbols + ["BOVA11.SA"], start_date, end_date, store_dir, interval=interval,
+                            batch_size=batch_size)
+profiler.stop(rows_out=sum(len(stock_info) for stock_info in prices.values()))
+# Number of shares
+profiler.start('shares', rows_in=len(symbols))
+shares_outstanding = fetch_shares_outstanding(backend, symbols, max_workers, requests_per_second)
+profiler.stop(rows_out=sum(shares is not None for shares in shares_outstanding.values()))
+
 # Prepare a DataFrame for results
+stocks_stage = profiler.start('stocks', rows_in=len(symbols))
 results = []
 
-# Extract information from the ticker
-for ticker in tickers:
-    print(f"Extracting data from {ticker}")
-
-    try:
-        # Historical values
-        stock_info = yf.download(ticker + ".SA", start=start_date, end=end_date, interval="1mo")
-        # Number of shares
-        shares_outstanding = yf.Ticker(ticker + ".SA").info.get('sharesOutstanding', None)
-        # Market Cap
-        stock_info["Market Cap"] = stock_info['Close'] * shares_outstanding
-        # Ticker
-        stock_info['Ticker'] = ticker
-        # Reset index and append
-        results.append(stock_info.reset_index())
-
-    except Exception as e:
-        print(f"Failed to fetch data for {ticker}: {e}")
-
-# Combine all data into a single DataFrame and rename columns
+for ticker, symbol in zip(tickers, symbols):
+    if shares_outstanding[symbol] is None:
+        print(f"Failed to fetch data for {ticker}: number of shares not available")
+        continue
+    stock_info = prices[symbol]
+    stock_info = stock_info[(stock_info['DATE'] >= start_date) & (stock_info['DATE'] < end_date)].copy()
+    # Market Cap
+    stock_info['MARKET_CAP'] = stock_info['CLOSE'] * shares_outstanding[symbol]
+    # Ticker
+    stock_info['TICKER'] = ticker
+    results.append(stock_info)
+
+# Combine all data into a single DataFrame
 technicalData_yf = pd.concat(results, ignore_index=True)
 
-# Rename columns
-technicalData_yf.rename(
-    columns={
-        'Ticker': 'TICKER',
-        'Date': 'DATE',
-        'Close': 'CLOSE',
-        'Adj Close': 'ADJ_CLOSE',
-        'Market Cap': 'MARKET_CAP'
-    },
-    inplace=True
-)
-
 technicalData_yf = technicalData_yf[['TICKER', 'DATE', 'CLOSE', 'ADJ_CLOSE', 'MARKET_CAP']]
 
-# Save to a CSV file
-technicalData_yf.to_csv("Extracted/technicalData_yf.csv", sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+# Save to a CSV file (daily bars are saved with BOVA11 below)
+if interval == '1mo':
+    technicalData_yf.to_csv("Extracted/technicalData_yf.csv", sep=';', decimal='.', encoding='ISO-8859-1',
+                            index=False)
+    stocks_stage.wrote_file("Extracted/technicalData_yf.csv")
+profiler.stop(rows_out=len(technicalData_yf))
 
 ########################################################################################################################
 # Extract BOVA11
 print(f"Extracting data from BOVA11")
+market_stage = profiler.start('market')
 
-# Prepare a DataFrame for results
-results = []
+technicalData_BOVA11_yf = prices["BOVA11.SA"]
+technicalData_BOVA11_yf = technicalData_BOVA11_yf[(technicalData_BOVA11_yf['DATE'] >= start_date) &
+                                                  (technicalData_BOVA11_yf['DATE'] < end_date)].copy()
 
-# Historical values
-stock_info = yf.download("BOVA11.SA", start=start_date, end=end_date, interval="1mo")
-# Number of shares
-shares_outstanding = yf.Ticker("BOVA11.SA").info.get('sharesOutstanding', None)
 # Ticker
-stock_info['Ticker'] = "BOVA11.SA"
-# Reset index and append
-results.append(stock_info.reset_index())
-
-# Combine all data into a single DataFrame and rename columns
-technicalData_yf = pd.concat(results, ignore_index=True)
+technicalData_BOVA11_yf['TICKER'] = "BOVA11.SA"
 
+if interval == '1mo':
+    technicalData_BOVA11_yf = technicalData_BOVA11_yf[['TICKER', 'DATE', 'CLOSE']]
 
-# Rename columns
-technicalData_yf.rename(
-    columns={
-        'Ticker': 'TICKER',
-        'Date': 'DATE',
-        'Close': 'CLOSE'
-    },
-    inplace=True
-)
+    # Save to a CSV file
+    technicalData_BOVA11_yf.to_csv("Extracted/technicalData_BOVA11_yf.csv", sep=';', decimal='.',
+                                   encoding='ISO-8859-1', index=False)
+    market_stage.wrote_file("Extracted/technicalData_BOVA11_yf.csv")
+else:
+    # Save the stocks and BOVA11 (without MARKET_CAP) to the price arrays
+    write_price_arrays(daily_dir, pd.concat([technicalData_yf, technicalData_BOVA11_yf], ignore_index=True))
+    for name in os.listdir(daily_dir):
+        market_stage.wrote_file(os.path.join(daily_dir, name))
+profiler.stop(rows_out=len(technicalData_BOVA11_yf))
 
-technicalData_yf = technicalData_yf[['TICKER', 'DATE', 'CLOSE']]
+profiler.save()
 
-# Save to a CSV file
-technicalData_yf.to_csv("Extracted/technicalData_BOVA11_yf.csv", sep=';', decimal='.', encoding='ISO-8859-1',
-                        index=False)
@@ -0,0 +1,187 @@
+# Batched and incremental extraction of prices and number of shares.
+# Prices are kept in a local store with one CSV file per ticker, so later runs only fetch the months after the last
+# cached date. ADJ_CLOSE is adjusted by Yahoo Finance for the dividends and splits until the day it is fetched, so after
+# a new dividend or split the cached ADJ_CLOSE values are on another basis than the new ones: the ADJ_CLOSE/CLOSE ratio
+# of the last cached bar (fetched again) is compared, and if it changed the whole history of the ticker is fetched
+# again. The data is fetched through a backend: YFinanceBackend fetches from Yahoo Finance and FixtureBackend
+# reads fixture files, so the extraction can run offline.
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+price_columns = ['DATE', 'CLOSE', 'ADJ_CLOSE']
+
+# Relative change of the ADJ_CLOSE/CLOSE ratio of a bar above which its adjustment changed
+adjustment_tolerance = 1e-6
+
+
+# Fetch data from Yahoo Finance
+class YFinanceBackend:
+    def __init__(self):
+        import yfinance as yf
+        self.yf = yf
+
+    # Historical values of several tickers in a single request
+    # Returns a dictionary with a DataFrame (DATE, CLOSE, ADJ_CLOSE) for each ticker with data
+    def download(self, symbols, start, end, interval):
+        # auto_adjust=False keeps the 'Adj Close' column
+        data = self.yf.download(symbols, start=start, end=end, interval=interval, group_by='ticker',
+                                auto_adjust=False, progress=False)
+        prices = {}
+        for symbol in symbols:
+            if data.empty or symbol not in data.columns.get_level_values(0):
+                continue
+            stock_info = data[symbol].dropna(subset=['Close'])
+            dates = stock_info.index
+            if dates.tz is not None:
+                dates = dates.tz_localize(None)
+            prices[symbol] = pd.DataFrame({'DATE': dates,
+                                           'CLOSE': stock_info['Close'].values,
+                                           'ADJ_CLOSE': stock_info['Adj Close'].values})
+        return prices
+
+    def info(self, symbol):
+        return self.yf.Ticker(symbol).info
+
+
+# Read data from fixture files:
+# {fixture_dir}/prices/{symbol}.csv:    DATE;CLOSE;ADJ_CLOSE
+# {fixture_dir}/info.json:              {symbol: {"sharesOutstanding": value}}
+class FixtureBackend:
+    def __init__(self, fixture_dir):
+        self.fixture_dir = fixture_dir
+        with open(os.path.join(fixture_dir, 'info.json'), 'r', encoding='utf-8') as f:
+            self.infos = json.load(f)
+
+    def download(self, symbols, start, end, interval):
+        prices = {}
+        for symbol in symbols:
+            path = os.path.join(self.fixture_dir, 'prices', f'{symbol}.csv')
+            if not os.path.exists(path):
+                continue
+            stock_info = pd.read_csv(path, sep=';', parse_dates=['DATE'])
+            prices[symbol] = stock_info[(stock_info['DATE'] >= start) & (stock_info['DATE'] < end)][price_columns]
+        return prices
+
+    def info(self, symbol):
+        return self.infos.get(symbol, {})
+
+
+# Limit the number of requests per second shared by several threads
+class RateLimiter:
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = max(0.0, self.next_time - now)
+            self.next_time = max(now, self.next_time) + self.interval
+        time.sleep(wait_time)
+
+
+def store_path(store_dir, symbol):
+    return os.path.join(store_dir, f'{symbol}.csv')
+
+
+def read_store(store_dir, symbol):
+    path = store_path(store_dir, symbol)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=price_columns)
+    return pd.read_csv(path, sep=';', parse_dates=['DATE'])
+
+
+def save_store(store_dir, symbol, prices):
+    prices = prices.sort_values('DATE', ignore_index=True)
+    prices.to_csv(store_path(store_dir, symbol), sep=';', decimal='.', index=False)
+    return prices
+
+
+# True if the ADJ_CLOSE/CLOSE ratio of the bars both in the cached and in the fetched prices changed (a dividend or a
+# split after the last run), or if there are no such bars to compare
+def adjustment_changed(cached, fetched, tolerance=adjustment_tolerance):
+    overlap = cached.merge(fetched, on='DATE', suffixes=('_CACHED', '_FETCHED'))
+    if overlap.empty:
+        return True
+    cached_ratio = overlap['ADJ_CLOSE_CACHED'] / overlap['CLOSE_CACHED']
+    fetched_ratio = overlap['ADJ_CLOSE_FETCHED'] / overlap['CLOSE_FETCHED']
+    return bool(((fetched_ratio / cached_ratio - 1).abs() > tolerance).any())
+
+
+# Update the local price store and return the prices of every ticker.
+# Tickers are grouped by the date they must be fetched from (the last cached date, which is fetched again as the last
+# bar may have been incomplete) and each group is fetched in batches of batch_size tickers. The tickers whose adjustment
+# changed are fetched again from start_date, replacing their cached prices.
+def update_price_store(backend, symbols, start_date, end_date, store_dir, interval='1mo', batch_size=50):
+    os.makedirs(store_dir, exist_ok=True)
+    stored = {symbol: read_store(store_dir, symbol) for symbol in symbols}
+
+    fetch_start = {}
+    for symbol, prices in stored.items():
+        fetch_start[symbol] = prices['DATE'].max().strftime('%Y-%m-%d') if not prices.empty else start_date
+
+    groups = {}
+    for symbol, start in fetch_start.items():
+        if start < end_date:
+            groups.setdefault(start, []).append(symbol)
+
+    refetch = []
+    for start, group in groups.items():
+        for i in range(0, len(group), batch_size):
+            batch = group[i:i+batch_size]
+            print(f'Fetching prices from {start} for {len(batch)} tickers')
+            try:
+                fetched = backend.download(batch, start, end_date, interval)
+            except Exception as e:
+                print(f'Failed to fetch prices for {batch}: {e}')
+                continue
+            for symbol, prices in fetched.items():
+                if prices.empty:
+                    continue
+                # Fetched rows replace the cached rows of the same date
+                cached = stored[symbol]
+                if not cached.empty:
+                    if adjustment_changed(cached, prices):
+                        refetch.append(symbol)
+                        continue
+                    prices = pd.concat([cached[~cached['DATE'].isin(prices['DATE'])], prices], ignore_index=True)
+                stored[symbol] = save_store(store_dir, symbol, prices)
+
+    # Whole history of the tickers with adjusted prices on another basis
+    for i in range(0, len(refetch), batch_size):
+        batch = refetch[i:i+batch_size]
+        print(f'Fetching prices from {start_date} for {len(batch)} tickers (adjusted prices changed)')
+        try:
+            fetched = backend.download(batch, start_date, end_date, interval)
+        except Exception as e:
+            print(f'Failed to fetch prices for {batch}: {e}')
+            continue
+        for symbol, prices in fetched.items():
+            if not prices.empty:
+                stored[symbol] = save_store(store_dir, symbol, prices)
+
+    return stored
+
+
+# Fetch the number of shares of every ticker concurrently
+# Returns a dictionary with the number of shares of each ticker (None if not available)
+def fetch_shares_outstanding(backend, symbols, max_workers=8, requests_per_second=2):
+    rate_limiter = RateLimiter(requests_per_second)
+
+    def fetch(symbol):
+        rate_limiter.wait()
+        try:
+            return backend.info(symbol).get('sharesOutstanding', None)
+        except Exception as e:
+            print(f'Failed to fetch info for {symbol}: {e}')
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(symbols, executor.map(fetch, symbols)))
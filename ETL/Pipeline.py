@@ -0,0 +1,201 @@
+# Run the ETL scripts as a pipeline of stages:
+# Extract_CVM -> Transform_CVM -> Merge_YFinance_CVM -> Load/stockData.csv
+# Extract_YFinance ------------------^
+#                                 -> Merge_Daily_YFinance_CVM -> Load/stockData_daily.csv
+#
+# Merge_YFinance_CVM runs on the monthly bars and Merge_Daily_YFinance_CVM on the daily bars of Extract_YFinance
+# (interval = '1mo' or '1d'). A merge is skipped when its bars were not extracted.
+# Each stage declares its input and output files. A stage is skipped when the content of its inputs and outputs did not
+# change since its last successful run, and stages that do not depend on each other (the CVM and YFinance extracts) run
+# concurrently. Each script runs in its own folder, as the scripts use paths relative to it.
+# Each script writes the report of its stages to the Reports folder (see Stage_Profiler.py).
+#
+# Usage: python Pipeline.py [--force] [--skip-extract] [--profile-stages STAGES]
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+etl_dir = os.path.dirname(os.path.abspath(__file__))
+state_path = os.path.join(etl_dir, 'Load', 'pipeline_state.json')
+
+# folder:       folder of the script, relative to the ETL folder
+# inputs:       glob patterns of the input files, relative to the ETL folder
+# outputs:      glob patterns of the output files, relative to the ETL folder
+# depends_on:   stages that must finish before the stage runs
+# always_run:   run even if the inputs did not change (the extract stages read remote data and decide by themselves
+#               what must be downloaded again)
+Stage = namedtuple('Stage', ['name', 'folder', 'script', 'inputs', 'outputs', 'depends_on', 'always_run'])
+
+stages = [
+    Stage('Extract_CVM', 'Extract/CVM', 'Extract_CVM.py',
+          inputs=['Extract/CVM/*.py', 'Stage_Profiler.py'],
+          outputs=['Extract/CVM/Extracted/*_cia_aberta_*'],
+          depends_on=[], always_run=True),
+    Stage('Extract_YFinance', 'Extract/YFinance', 'Extract_YFinance.py',
+          inputs=['Extract/YFinance/*.py', 'Stage_Profiler.py', 'Price_Arrays.py', 'Ticker_CVMCode.csv'],
+          outputs=['Extract/YFinance/Extracted/technicalData_yf.csv',
+                   'Extract/YFinance/Extracted/technicalData_BOVA11_yf.csv'],
+          depends_on=[], always_run=True),
+    Stage('Transform_CVM', 'Transform/CVM', 'Transform_CVM.py',
+          inputs=['Transform/CVM/*.py', 'Stage_Profiler.py', 'Ticker_CVMCode.csv',
+                  'Extract/CVM/Extracted/*_cia_aberta_*'],
+          outputs=['Transform/CVM/Transformed/fundamentalData_CVM.csv'],
+          depends_on=['Extract_CVM'], always_run=False),
+    Stage('Merge_YFinance_CVM', 'Transform/MergeAndTransform', 'Merge_YFinance_CVM.py',
+          inputs=['Transform/MergeAndTransform/Merge_YFinance_CVM.py', 'Stage_Profiler.py',
+                  'Extract/YFinance/Extracted/technicalData_yf.csv',
+                  'Extract/YFinance/Extracted/technicalData_BOVA11_yf.csv',
+                  'Transform/CVM/Transformed/fundamentalData_CVM.csv'],
+          outputs=['Transform/MergeAndTransform/mergedData.csv', 'Load/stockData.csv', 'Load/marketData.csv'],
+          depends_on=['Transform_CVM', 'Extract_YFinance'], always_run=False),
+    Stage('Merge_Daily_YFinance_CVM', 'Transform/MergeAndTransform', 'Merge_Daily_YFinance_CVM.py',
+          inputs=['Transform/MergeAndTransform/Merge_Daily_YFinance_CVM.py', 'Stage_Profiler.py', 'Price_Arrays.py',
+                  'Extract/YFinance/Extracted/Daily/*',
+                  'Transform/CVM/Transformed/fundamentalData_CVM.csv'],
+          outputs=['Load/stockData_daily.csv', 'Load/marketData_daily.csv'],
+          depends_on=['Transform_CVM', 'Extract_YFinance'], always_run=False),
+]
+
+# Stages skipped when one of their inputs is missing (the bars of the interval of Extract_YFinance.py)
+optional_stages = ['Merge_YFinance_CVM', 'Merge_Daily_YFinance_CVM']
+
+print_lock = threading.Lock()
+
+
+def read_state():
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'stages': {}, 'files': {}}
+
+
+def write_state(state):
+    with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(state_path + '.tmp', state_path)
+
+
+# SHA-256 of a file. The hashes are kept in the state with the size and modification time of the files, so files that
+# were not modified are not read again.
+def file_hash(path, file_hashes):
+    stat = os.stat(os.path.join(etl_dir, path))
+    cached = file_hashes.get(path)
+    if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached['sha256']
+    sha256 = hashlib.sha256()
+    with open(os.path.join(etl_dir, path), 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    file_hashes[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256.hexdigest()}
+    return file_hashes[path]['sha256']
+
+
+# Hash of the content of all the files matching the patterns (None if a pattern has no match)
+def files_hash(patterns, file_hashes):
+    sha256 = hashlib.sha256()
+    for pattern in patterns:
+        paths = sorted(os.path.relpath(path, etl_dir) for path in glob.glob(os.path.join(etl_dir, pattern))
+                       if os.path.isfile(path) and not path.endswith(('.part', '.json', '.tmp')))
+        if not paths:
+            return None
+        for path in paths:
+            sha256.update(path.encode())
+            sha256.update(file_hash(path, file_hashes).encode())
+    return sha256.hexdigest()
+
+
+def run_script(stage):
+    # Stream the output of the script with the name of the stage
+    process = subprocess.Popen([sys.executable, '-u', stage.script], cwd=os.path.join(etl_dir, stage.folder),
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8',
+                               errors='replace')
+    for line in process.stdout:
+        with print_lock:
+            print(f'[{stage.name}] {line}', end='')
+    return process.wait()
+
+
+def run_pipeline(force=False, skip_extract=False, max_workers=2):
+    state = read_state()
+    state_lock = threading.Lock()
+    status = {}
+
+    def run_stage(stage):
+        with state_lock:
+            inputs_hash = files_hash(stage.inputs, state['files'])
+            outputs_hash = files_hash(stage.outputs, state['files'])
+        last_run = state['stages'].get(stage.name, {})
+
+        if skip_extract and stage.always_run:
+            return 'skipped'
+        if inputs_hash is None and stage.name in optional_stages:
+            return 'skipped'
+        if not force and not stage.always_run and outputs_hash is not None and \
+                last_run.get('inputs') == inputs_hash and last_run.get('outputs') == outputs_hash:
+            return 'up to date'
+
+        start_time = time.time()
+        with print_lock:
+            print(f'Running {stage.name}')
+        if run_script(stage) != 0:
+            return 'failed'
+
+        with state_lock:
+            # The outputs of a stage may be inputs of the stage itself (i.e. the extracted files)
+            state['stages'][stage.name] = {'inputs': files_hash(stage.inputs, state['files']),
+                                           'outputs': files_hash(stage.outputs, state['files']),
+                                           'duration': round(time.time() - start_time, 3)}
+            write_state(state)
+        return 'done'
+
+    # Run each stage as soon as all the stages it depends on are finished
+    pending = {stage.name: stage for stage in stages}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if any(status.get(dependency) == 'failed' for dependency in stage.depends_on):
+                    status[name] = 'failed'
+                    print(f'{name}: not run, a stage it depends on failed')
+                    del pending[name]
+                elif all(dependency in status for dependency in stage.depends_on):
+                    running[executor.submit(run_stage, stage)] = name
+                    del pending[name]
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    status[name] = future.result()
+                except Exception as e:
+                    print(f'{name} failed: {e}')
+                    status[name] = 'failed'
+                print(f'{name}: {status[name]}')
+
+    return status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the ETL pipeline')
+    parser.add_argument('--force', action='store_true', help='run every stage, even if its inputs did not change')
+    parser.add_argument('--skip-extract', action='store_true', help='do not run the extract stages (offline runs)')
+    parser.add_argument('--profile-stages', default=None,
+                        help='stages of the scripts to run under cProfile, comma separated (* for all)')
+    args = parser.parse_args()
+
+    # Read by the StageProfiler of each script
+    if args.profile_stages:
+        os.environ['ETL_PROFILE_STAGES'] = args.profile_stages
+
+    result = run_pipeline(force=args.force, skip_extract=args.skip_extract)
+    sys.exit(1 if 'failed' in result.values() else 0)
@@ -0,0 +1,89 @@
+# Price store of contiguous arrays, for the daily prices (see Extract_YFinance.py and Merge_Daily_YFinance_CVM.py).
+# The rows of all the tickers are kept in one .npy file per column, sorted by ticker and date, so the rows of each
+# ticker (and of a range of tickers) are a contiguous slice. The files are memory mapped when read, so only the slices
+# used are loaded. The store folder holds:
+# DATE.npy:                 dates of the bars (datetime64[D])
+# CLOSE.npy, ADJ_CLOSE.npy, MARKET_CAP.npy:   values of the bars (float64, MARKET_CAP is NaN for BOVA11)
+# tickers.csv:              TICKER;START;STOP, the slice of the rows of each ticker
+#
+# Lookups by ticker and date (the price one year later, the last fundamental data before a date) are sorted searches
+# over composite keys (ticker code, day), instead of merges: for sorted keys, np.searchsorted finds the last row at or
+# before each query in O(log n), with no intermediate tables.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+value_columns = ['CLOSE', 'ADJ_CLOSE', 'MARKET_CAP']
+
+
+# Write the prices (TICKER, DATE and the value columns, MARKET_CAP is optional) to the store
+def write_price_arrays(store_dir, prices):
+    prices = prices.sort_values(['TICKER', 'DATE'], kind='stable', ignore_index=True)
+    tickers = prices.groupby('TICKER', sort=False).size()
+    stops = tickers.cumsum().to_numpy()
+    index = pd.DataFrame({'TICKER': tickers.index, 'START': stops - tickers.to_numpy(), 'STOP': stops})
+
+    arrays = {'DATE': pd.to_datetime(prices['DATE']).to_numpy().astype('datetime64[D]')}
+    for column in value_columns:
+        arrays[column] = prices[column].to_numpy(dtype=np.float64) if column in prices else \
+            np.full(len(prices), np.nan)
+    save_price_arrays(store_dir, index, arrays)
+    return index
+
+
+# Write the ticker index (TICKER, START, STOP) and the arrays (DATE and the value columns, in the order of the index) to
+# the store. Each file is written to a temporary file first, so an interrupted write does not leave a store with files
+# of different lengths.
+def save_price_arrays(store_dir, index, arrays):
+    os.makedirs(store_dir, exist_ok=True)
+    for name in ['DATE'] + value_columns:
+        # np.save adds .npy to the file name
+        np.save(os.path.join(store_dir, f'{name}.tmp'), arrays[name])
+        os.replace(os.path.join(store_dir, f'{name}.tmp.npy'), os.path.join(store_dir, f'{name}.npy'))
+    index.to_csv(os.path.join(store_dir, 'tickers.csv.tmp'), sep=';', encoding='ISO-8859-1', index=False)
+    os.replace(os.path.join(store_dir, 'tickers.csv.tmp'), os.path.join(store_dir, 'tickers.csv'))
+
+
+# Read the store: the ticker index and a dictionary of the arrays (memory mapped with mmap_mode='r')
+def read_price_arrays(store_dir, mmap_mode='r'):
+    index = pd.read_csv(os.path.join(store_dir, 'tickers.csv'), sep=';', encoding='ISO-8859-1')
+    arrays = {name: np.load(os.path.join(store_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+              for name in ['DATE'] + value_columns}
+    return index, arrays
+
+
+# Composite sort keys of (ticker code, day): the keys of rows sorted by ticker code and date are sorted
+def composite_keys(codes, days):
+    return np.asarray(codes, dtype=np.int64) * 2 ** 32 + (np.asarray(days, dtype=np.int64) + 2 ** 31)
+
+
+# Position of the last row of the same ticker at or before each query (ticker code, day), or -1 if there is none
+# keys, codes:  composite keys and ticker codes of the rows, sorted by key
+def asof_positions(keys, codes, query_codes, query_days):
+    positions = np.searchsorted(keys, composite_keys(query_codes, query_days), side='right') - 1
+    found = positions >= 0
+    found[found] = codes[positions[found]] == np.asarray(query_codes)[found]
+    return np.where(found, positions, -1)
+
+
+# Days since 1970-01-01 of datetime64 values
+def day_numbers(dates):
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+# Position of the bar of the same ticker one year after each bar: the last bar at or before the same date of the next
+# year, if it is at most max_gap_days before it (-1 otherwise, i.e. after the last bar of the ticker).
+# With monthly bars on the first day of each month, it is the bar of the same month of the next year.
+def year_ahead_positions(codes, dates, max_gap_days=7):
+    days = day_numbers(dates)
+    target_days = day_numbers(pd.DatetimeIndex(dates) + pd.DateOffset(years=1))
+    positions = asof_positions(composite_keys(codes, days), codes, codes, target_days)
+    too_old = (positions >= 0) & (days[positions] < target_days - max_gap_days)
+    return np.where(too_old, -1, positions)
+
+
+# Values at the positions, NaN where the position is -1
+def take(values, positions):
+    return np.where(positions >= 0, np.asarray(values)[np.maximum(positions, 0)], np.nan)
@@ -0,0 +1,209 @@
+# Instrumentation of the ETL scripts.
+# A StageProfiler records, for each named stage of a script and the sub-steps nested in it:
+# WALL_SECONDS, CPU_SECONDS:    elapsed time and CPU time (user and system, all the threads) of the process
+# ROWS_IN, ROWS_OUT:            rows given by the script
+# BYTES_READ, BYTES_WRITTEN:    size of the files given by the script with read_file and wrote_file
+# PEAK_RSS_MB:                  peak resident memory of the process during the stage. On Linux, the peak is reset at
+#                               the start of each stage (/proc/self/clear_refs). Elsewhere, it is the peak of the
+#                               process since it started (not available on Windows).
+# A stage run more than once (i.e. in a loop) is aggregated by name: the times, rows and bytes are added and the peak is
+# the maximum. The name of a stage nested in another one is prefixed with the name of the outer stage (load/DRE_con).
+# The bytes of a nested stage are also added to the stages around it, so the files are given in the innermost stage.
+#
+# save writes the report of the run to the Reports folder:
+# {script}_last_run.json:   stages of the last run, in the order they started, and totals of the run
+# {script}_stages.csv:      stages of every run (RUN_ID: start time of the run), to compare the runs
+# Stages can also run under cProfile: set the environment variable ETL_PROFILE_STAGES to a comma separated list of stage
+# names (or * for every top level stage), i.e. with python Pipeline.py --profile-stages. The statistics of each profiled
+# stage are dumped to Reports/Profiles/{script}_{stage}.prof (open them with pstats or snakeviz). A stage nested in a
+# profiled stage is not profiled on its own.
+
+import cProfile
+import json
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+reports_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Reports')
+
+report_columns = ['RUN_ID', 'SCRIPT', 'STAGE', 'CALLS', 'WALL_SECONDS', 'CPU_SECONDS', 'ROWS_IN', 'ROWS_OUT',
+                  'BYTES_READ', 'BYTES_WRITTEN', 'PEAK_RSS_MB']
+
+
+# Reset the peak resident memory of the process (Linux only). Returns False if it can not be reset.
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+# Peak resident memory of the process in MB (since the last reset on Linux)
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is not None:
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** (2 if sys.platform == 'darwin' else 1)
+    return float('nan')
+
+
+# Measures of a running stage. The script sets rows_in and rows_out and gives the files read and written.
+class Stage:
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_rss_mb = 0.0
+
+    def read_file(self, path):
+        self.bytes_read += os.path.getsize(path)
+
+    def wrote_file(self, path):
+        self.bytes_written += os.path.getsize(path)
+
+
+class StageProfiler:
+    # script:           name of the script, used in the names of the report files
+    # profile_stages:   stages to run under cProfile (default: from ETL_PROFILE_STAGES)
+    def __init__(self, script, report_dir=reports_dir, profile_stages=None):
+        self.script = script
+        self.report_dir = report_dir
+        if profile_stages is None:
+            profile_stages = [name for name in os.environ.get('ETL_PROFILE_STAGES', '').split(',') if name]
+        self.profile_stages = profile_stages
+        self.run_id = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.start_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+        self.resets_peak = reset_peak_rss()
+        self.run_peak_rss_mb = 0.0
+        # Running stages: (stage, start time, start CPU time, profile)
+        self.running = []
+        # Measures of each stage name, in the order the stages started
+        self.totals = {}
+        self.profiles = {}
+
+    # Record the peak memory so far in the running stages
+    def update_peaks(self):
+        peak = peak_rss_mb()
+        self.run_peak_rss_mb = max(self.run_peak_rss_mb, peak)
+        for stage, _, _, _ in self.running:
+            stage.peak_rss_mb = max(stage.peak_rss_mb, peak)
+        return peak
+
+    def start(self, name, rows_in=None):
+        if self.running:
+            name = f'{self.running[-1][0].name}/{name}'
+        stage = Stage(name, rows_in)
+        self.totals.setdefault(name, {'STAGE': name, 'CALLS': 0, 'WALL_SECONDS': 0.0, 'CPU_SECONDS': 0.0,
+                                      'ROWS_IN': None, 'ROWS_OUT': None, 'BYTES_READ': 0, 'BYTES_WRITTEN': 0,
+                                      'PEAK_RSS_MB': 0.0})
+
+        profile = None
+        profiling = any(running_profile is not None for _, _, _, running_profile in self.running)
+        if not profiling and (name in self.profile_stages or ('*' in self.profile_stages and not self.running)):
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+
+        self.update_peaks()
+        if self.resets_peak:
+            reset_peak_rss()
+        self.running.append((stage, time.perf_counter(), time.process_time(), profile))
+        if profile is not None:
+            profile.enable()
+        return stage
+
+    # Stop the last started stage (rows_in and rows_out: rows of the stage, if not already set)
+    def stop(self, rows_in=None, rows_out=None):
+        stage, start_time, start_cpu_time, profile = self.running[-1]
+        if profile is not None:
+            profile.disable()
+        wall_seconds = time.perf_counter() - start_time
+        cpu_seconds = time.process_time() - start_cpu_time
+        self.update_peaks()
+        self.running.pop()
+        if rows_in is not None:
+            stage.rows_in = rows_in
+        if rows_out is not None:
+            stage.rows_out = rows_out
+
+        total = self.totals[stage.name]
+        total['CALLS'] += 1
+        total['WALL_SECONDS'] += wall_seconds
+        total['CPU_SECONDS'] += cpu_seconds
+        for column, value in [('ROWS_IN', stage.rows_in), ('ROWS_OUT', stage.rows_out)]:
+            if value is not None:
+                total[column] = (total[column] or 0) + int(value)
+        total['BYTES_READ'] += stage.bytes_read
+        total['BYTES_WRITTEN'] += stage.bytes_written
+        total['PEAK_RSS_MB'] = max(total['PEAK_RSS_MB'], stage.peak_rss_mb)
+        # The peak and the bytes of a nested stage are also the ones of the stage around it
+        if self.running:
+            outer_stage = self.running[-1][0]
+            outer_stage.peak_rss_mb = max(outer_stage.peak_rss_mb, stage.peak_rss_mb)
+            outer_stage.bytes_read += stage.bytes_read
+            outer_stage.bytes_written += stage.bytes_written
+        return stage
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        stage = self.start(name, rows_in)
+        try:
+            yield stage
+        finally:
+            self.stop()
+
+    # Measures of the stages, and of the whole run (STAGE: run)
+    def report(self):
+        self.update_peaks()
+        run = {'STAGE': 'run', 'CALLS': 1, 'WALL_SECONDS': time.perf_counter() - self.start_time,
+               'CPU_SECONDS': time.process_time() - self.start_cpu_time, 'ROWS_IN': None, 'ROWS_OUT': None,
+               'BYTES_READ': sum(total['BYTES_READ'] for name, total in self.totals.items() if '/' not in name),
+               'BYTES_WRITTEN': sum(total['BYTES_WRITTEN'] for name, total in self.totals.items() if '/' not in name),
+               'PEAK_RSS_MB': self.run_peak_rss_mb}
+        report = pd.DataFrame([run] + list(self.totals.values())).assign(RUN_ID=self.run_id, SCRIPT=self.script)
+        report[['WALL_SECONDS', 'CPU_SECONDS']] = report[['WALL_SECONDS', 'CPU_SECONDS']].round(4)
+        report['PEAK_RSS_MB'] = report['PEAK_RSS_MB'].round(1)
+        return report[report_columns]
+
+    # Write the report of the run (and the cProfile statistics of the profiled stages) and print it
+    def save(self):
+        report = self.report()
+        os.makedirs(self.report_dir, exist_ok=True)
+        with open(os.path.join(self.report_dir, f'{self.script}_last_run.json'), 'w', encoding='utf-8') as f:
+            json.dump({'script': self.script, 'run_id': self.run_id, 'python': platform.python_version(),
+                       'platform': platform.platform(), 'peak_rss_reset': self.resets_peak,
+                       'stages': json.loads(report.drop(columns=['RUN_ID', 'SCRIPT']).to_json(orient='records'))},
+                      f, indent=2)
+        history_path = os.path.join(self.report_dir, f'{self.script}_stages.csv')
+        report.to_csv(history_path, sep=';', decimal='.', encoding='ISO-8859-1', index=False,
+                      mode='a' if os.path.exists(history_path) else 'w', header=not os.path.exists(history_path))
+
+        if self.profiles:
+            os.makedirs(os.path.join(self.report_dir, 'Profiles'), exist_ok=True)
+            for name, profile in self.profiles.items():
+                profile.dump_stats(os.path.join(self.report_dir, 'Profiles',
+                                                f'{self.script}_{name.replace("/", "_")}.prof'))
+
+        print(f'{self.script} stages:')
+        print(report.drop(columns=['RUN_ID', 'SCRIPT']).to_string(index=False, na_rep=''))
+        return report
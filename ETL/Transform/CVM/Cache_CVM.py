@@ -0,0 +1,56 @@
+# Columnar cache for the cleaned CVM sheets.
+# Each source file is cleaned once and stored as a Parquet file in the Cache folder. The manifest keeps the name, size
+# and modification time of the source file, so a cached table is only rebuilt when its source file changes.
+
+import json
+import os
+
+import pandas as pd
+
+# Increase when the cleaning of the sheets changes, so every cached table is rebuilt
+CACHE_VERSION = 3
+
+cache_dir = 'Cache'
+manifest_path = os.path.join(cache_dir, 'manifest.json')
+
+
+def read_manifest():
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def write_manifest(manifest):
+    # Write to a temporary file first, so an interrupted run does not leave a corrupted manifest
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+# Identify the version of a source file by its name, size and modification time, and the settings used to clean it
+def source_key(source_path, settings=None):
+    stat = os.stat(source_path)
+    return {'file': os.path.basename(source_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'version': CACHE_VERSION, 'settings': settings or {}}
+
+
+# Return the cleaned table of a source file, from the cache if the source file did not change or by calling build
+# otherwise. The second value returned tells if the table was loaded from the cache.
+# name:     name of the table, if the source file holds more than one table (i.e. the members of a zip file)
+# settings: settings the cleaning depends on (the table is rebuilt if they change)
+def cached_table(source_path, build, name=None, settings=None):
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = read_manifest()
+    name = name or os.path.basename(source_path)
+    table_path = os.path.join(cache_dir, os.path.splitext(name)[0] + '.parquet')
+    key = source_key(source_path, settings)
+
+    if manifest.get(name) == key and os.path.exists(table_path):
+        return pd.read_parquet(table_path), True
+
+    table = build()
+    table.to_parquet(table_path, index=False)
+    manifest[name] = key
+    write_manifest(manifest)
+    return table, False
@@ -0,0 +1,72 @@
+# Classification of the CVM sheet rows by account role.
+# The DS_CONTA/CD_CONTA rules used to find each fundamental are evaluated once per sheet, over the unique account
+# codes and descriptions, and stored in the categorical ROLE column. The extraction steps then only need equality tests
+# on ROLE instead of running regexes over every row.
+
+import numpy as np
+import pandas as pd
+
+# Account roles:
+# OTHER:                Account of no interest
+# EARNINGS:             Lucro/Prejuízo (Consolidado) do Período
+# EPS:                  Lucro por Ação (3.99.XX)
+# EPS_ON:               Lucro por Ação of ordinary stocks (3.99.XX with DS_CONTA 'ON')
+# CURRENT_ASSETS:       Ativo Circulante (1.01)
+# CURRENT_LIABILITIES:  Passivo Circulante (2.01)
+# GROSS_DEBT:           Empréstimos e Financiamentos, current (2.01.04) and non-current (2.02.01)
+# EQUITY:               Patrimônio Líquido (Consolidado)
+# DIVIDEND:             Dividends and interest on equity paid (6.03.01 to 6.03.20)
+ACCOUNT_ROLES = ['OTHER', 'EARNINGS', 'EPS', 'EPS_ON', 'CURRENT_ASSETS', 'CURRENT_LIABILITIES', 'GROSS_DEBT', 'EQUITY',
+                 'DIVIDEND']
+
+# Roles of the Earnings per Share rows
+EPS_ROLES = ['EPS', 'EPS_ON']
+
+# Earnings and Equity descriptions differ between the '_con' and '_ind' sheets
+EARNINGS_PERIOD_PATTERN = {'con': "consolidado do per[ií]odo", 'ind': "do per[ií]odo"}
+EQUITY_PATTERN = {'con': "patrim[oô]nio l[ií]quido consolidado", 'ind': "patrim[oô]nio l[ií]quido"}
+
+DIVIDEND_CODES = [f"6.03.{i:02d}" for i in range(1, 21)]
+
+
+# Evaluate a case-insensitive regex over the categories of a column and broadcast the result to its rows
+def match_categories(column, pattern):
+    column = column.astype('category')
+    matches = column.cat.categories.astype(str).str.contains(pattern, case=False, na=False, regex=True)
+    # Rows with NaN have code -1, which points to the appended False
+    return np.append(np.asarray(matches, dtype=bool), False)[column.cat.codes.to_numpy()]
+
+
+# Add the categorical ROLE column to a sheet
+# statement: DRE, BPA, BPP or DFC
+# scope:     con or ind
+def classify_accounts(data_frame, statement, scope):
+    cd_conta = data_frame['CD_CONTA']
+    conditions = []
+    roles = []
+
+    if statement == 'DRE':
+        eps = match_categories(cd_conta, r"^3\.99")
+        conditions += [eps & (data_frame['DS_CONTA'] == 'ON').to_numpy(),
+                       eps,
+                       match_categories(data_frame['DS_CONTA'], "lucro") &
+                       match_categories(data_frame['DS_CONTA'], "preju[ií]zo") &
+                       match_categories(data_frame['DS_CONTA'], EARNINGS_PERIOD_PATTERN[scope])]
+        roles += ['EPS_ON', 'EPS', 'EARNINGS']
+    elif statement == 'BPA':
+        conditions += [(cd_conta == '1.01').to_numpy()]
+        roles += ['CURRENT_ASSETS']
+    elif statement == 'BPP':
+        conditions += [(cd_conta == '2.01').to_numpy(),
+                       cd_conta.isin(['2.01.04', '2.02.01']).to_numpy(),
+                       match_categories(data_frame['DS_CONTA'], EQUITY_PATTERN[scope])]
+        roles += ['CURRENT_LIABILITIES', 'GROSS_DEBT', 'EQUITY']
+    elif statement == 'DFC':
+        conditions += [cd_conta.isin(DIVIDEND_CODES).to_numpy() &
+                       (match_categories(data_frame['DS_CONTA'], "dividend") |
+                        (match_categories(data_frame['DS_CONTA'], "juro") &
+                         match_categories(data_frame['DS_CONTA'], "capital pr[oó]prio")))]
+        roles += ['DIVIDEND']
+
+    data_frame['ROLE'] = pd.Categorical(np.select(conditions, roles, default='OTHER'), categories=ACCOUNT_ROLES)
+    return data_frame
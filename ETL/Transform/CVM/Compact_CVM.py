@@ -0,0 +1,68 @@
+# Compact in-memory representation of the cleaned CVM sheets.
+# With all the years of all the sheets loaded at once, the repeated strings and 8 byte values take most of the memory.
+# The cleaned tables keep:
+# CD_CVM:               integer (int32)
+# CD_CONTA, DS_CONTA:   categorical (one copy of each account code and description)
+# DT_REFER:             month of the reference date (int16, months since 1970-01), as the reference dates of the DFP
+#                       and ITR sheets are month ends (a date that is not a month end raises ValueError). Use
+#                       reference_dates to get the dates back.
+# VL_CONTA:             float64, or float32 with value_dtype = 'float32' (values with about 7 significant digits)
+# ROLE:                 categorical (see Classify_CVM.py)
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+category_columns = ['CD_CONTA', 'DS_CONTA', 'ROLE']
+
+
+# Month of each date (months since 1970-01). Raises ValueError if a date is not the last day of its month, as the date
+# could not be restored from the month.
+def month_codes(dates):
+    dates = pd.to_datetime(dates)
+    not_month_ends = dates[~dates.dt.is_month_end]
+    if not not_month_ends.empty:
+        raise ValueError(f'reference dates that are not month ends: {sorted(not_month_ends.dt.date.unique())[:5]}')
+    return ((dates.dt.year - 1970) * 12 + dates.dt.month - 1).astype('int16')
+
+
+# Dates from the month codes (NaN for missing months): last day of the month, shifted by months_shift months.
+# Each distinct month is converted once.
+def reference_dates(codes, months_shift=0):
+    months = codes.dropna().unique()
+    month_numbers = months.astype(int)
+    month_ends = pd.to_datetime(pd.DataFrame({'year': month_numbers // 12 + 1970, 'month': month_numbers % 12 + 1,
+                                              'day': 1})) + pd.offsets.MonthEnd(0)
+    shifted = month_ends + pd.DateOffset(months=months_shift)
+    return codes.map(pd.Series(shifted.to_numpy(), index=months))
+
+
+def compact_table(data_frame, value_dtype='float64'):
+    data_frame['CD_CVM'] = data_frame['CD_CVM'].astype('int32')
+    data_frame['DT_REFER'] = month_codes(data_frame['DT_REFER'])
+    data_frame['VL_CONTA'] = data_frame['VL_CONTA'].astype(value_dtype)
+    for column in category_columns:
+        data_frame[column] = data_frame[column].astype('category')
+    return data_frame
+
+
+# Concatenate tables with categorical columns. The categories of each column are merged without converting the values
+# back to strings. Columns that are not categorical (i.e. the empty columns of a table read from a Parquet file) are
+# converted first.
+def combine_tables(tables):
+    tables = [table for table in tables if not table.empty] or tables[:1]
+    columns = [column for column in category_columns if column in tables[0].columns]
+    combined = pd.concat([table.drop(columns=columns) for table in tables], ignore_index=True)
+    for column in columns:
+        combined[column] = union_categoricals([table[column].astype('category') for table in tables])
+    return combined[tables[0].columns]
+
+
+# Memory used by each table, in MB
+def memory_report(data_frames):
+    report = pd.DataFrame([{'TABLE': name, 'ROWS': len(table),
+                            'MB': table.memory_usage(index=True, deep=True).sum() / 2**20}
+                           for name, table in data_frames.items()])
+    report['BYTES_PER_ROW'] = report['MB'] * 2**20 / report['ROWS'].clip(lower=1)
+    report.loc[len(report)] = ['Total', report['ROWS'].sum(), report['MB'].sum(),
+                               report['MB'].sum() * 2**20 / max(report['ROWS'].sum(), 1)]
+    return report.round(2)
@@ -0,0 +1,83 @@
+# Trailing twelve month (TTM) values of the flows of the CVM statements (earnings, EPS and dividends).
+# The DRE and DFC of the ITR files (first three quarters) and of the DFP files (fourth quarter) hold the values from the
+# start of the year to the end of the quarter (year to date, YTD). The value of each quarter is the difference between
+# the YTD values of the quarter and of the quarter before, and the TTM value is the sum of the last four quarters, a
+# rolling sum over the quarters of each company. The TTM value is NaN if one of the four quarters is missing. At the
+# fourth quarter, the TTM value is the YTD value (the annual value), so the annual statements alone give the annual
+# values.
+#
+# The YTD values and the TTM values of the last run are kept in the Cache folder. Only the companies with YTD values
+# that changed since the last run (i.e. a new quarter) are computed again, the others keep their cached TTM values.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from Cache_CVM import cache_dir
+
+ttm_cache_path = os.path.join(cache_dir, 'ttm_flows.parquet')
+
+
+# Quarter of each reference date (quarters since 1970, counted from 0). NaN if the reference date is not the end of a
+# quarter. DT_REFER is the month code of Compact_CVM.py (months since 1970-01) or a date.
+def quarter_numbers(reference_dates):
+    if pd.api.types.is_numeric_dtype(reference_dates):
+        months = reference_dates.astype('float64')
+    else:
+        dates = pd.to_datetime(reference_dates)
+        months = ((dates.dt.year - 1970) * 12 + dates.dt.month - 1).astype('float64')
+    return ((months + 1) / 3 - 1).where((months + 1) % 3 == 0)
+
+
+# TTM values of the flows (CD_CVM, QUARTER and the YTD values of the columns, one row per company and quarter).
+# Returns the flows with the TTM values in the {column}_TTM columns.
+def ttm_values(flows, columns):
+    if flows.empty:
+        return flows.assign(**{f'{column}_TTM': pd.Series(dtype='float64') for column in columns})
+    # Every quarter from the first to the last quarter of each company
+    bounds = flows.groupby('CD_CVM')['QUARTER'].agg(['min', 'max'])
+    lengths = (bounds['max'] - bounds['min'] + 1).to_numpy(dtype=np.int64)
+    offsets = np.arange(lengths.sum()) - np.repeat(lengths.cumsum() - lengths, lengths)
+    quarters = pd.MultiIndex.from_arrays([np.repeat(bounds.index.to_numpy(), lengths),
+                                          np.repeat(bounds['min'].to_numpy(dtype=np.int64), lengths) + offsets],
+                                         names=['CD_CVM', 'QUARTER'])
+    ytd = flows.set_index(['CD_CVM', 'QUARTER'])[columns].reindex(quarters)
+
+    # Value of each quarter: the YTD value minus the YTD value of the quarter before, in the same year
+    first_quarter = (quarters.get_level_values('QUARTER') % 4 == 0)[:, np.newaxis]
+    quarter_values = ytd - np.where(first_quarter, 0, ytd.groupby(level='CD_CVM').shift(1))
+
+    # Sum of the last four quarters of each company
+    ttm = quarter_values.groupby(level='CD_CVM').rolling(4, min_periods=4).sum().droplevel(0)
+    fourth_quarter = quarters.get_level_values('QUARTER') % 4 == 3
+    ttm[fourth_quarter] = ytd[fourth_quarter]
+
+    ttm = ttm.rename(columns={column: f'{column}_TTM' for column in columns})
+    return flows.join(ttm, on=['CD_CVM', 'QUARTER'])
+
+
+# Companies with rows of the new flows that are not in the old flows, or the other way around
+def changed_companies(new, old):
+    compared = new.merge(old, how='outer', indicator=True)
+    return compared.loc[compared['_merge'] != 'both', 'CD_CVM'].unique()
+
+
+# TTM values of the flows, computed again only for the companies whose flows changed since the last run.
+# Returns the flows with the TTM values and the number of companies computed again.
+def incremental_ttm_values(flows, columns, cache_path=ttm_cache_path):
+    flows = flows[['CD_CVM', 'QUARTER'] + columns].astype({'QUARTER': 'int64',
+                                                           **{column: 'float64' for column in columns}})
+    ttm_columns = [f'{column}_TTM' for column in columns]
+    cached = pd.read_parquet(cache_path) if os.path.exists(cache_path) else None
+    if cached is None or list(cached.columns) != list(flows.columns) + ttm_columns:
+        result, changed = ttm_values(flows, columns), flows['CD_CVM'].unique()
+    else:
+        changed = changed_companies(flows, cached[flows.columns])
+        unchanged = cached[~cached['CD_CVM'].isin(changed)]
+        result = pd.concat([unchanged, ttm_values(flows[flows['CD_CVM'].isin(changed)], columns)],
+                           ignore_index=True)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    result.to_parquet(cache_path, index=False)
+    return result, len(changed)
@@ -1,9 +1,27 @@
 # From the data Extracted in the Extract Step, get the relevant Fundamental Data for the analysis and store it in a
 # CSV File
+# The annual statements (DFP) give the data of the fourth quarter and the quarterly statements (ITR) the data of the
+# first three quarters. Earnings, EPS and dividends are trailing twelve month values (see TTM_CVM.py), and the balance
+# sheet items are the ones of the last quarter.
+
+import os
+import sys
+from zipfile import ZipFile
 
 import pandas as pd
 import numpy as np
 
+from Cache_CVM import cached_table
+from Classify_CVM import classify_accounts, EPS_ROLES
+from Compact_CVM import compact_table, combine_tables, reference_dates, memory_report
+from TTM_CVM import quarter_numbers, incremental_ttm_values
+
+sys.path.append('../..')
+from Stage_Profiler import StageProfiler
+
+# Time, rows, bytes and memory of each stage (see Stage_Profiler.py)
+profiler = StageProfiler('Transform_CVM')
+
 ########################################################################################################################
 # Data import
 
@@ -31,23 +49,120 @@ file_suffix = ['DRE_con', 'DFC_MI_con', 'DFC_MD_con', 'BPA_con', 'BPP_con', 'DRE
 first_year = 2012
 last_year = 2023
 
+# Documents to read: dfp (annual statements) and itr (quarterly statements). The ITR files that were not extracted
+# are skipped.
+documents = ['dfp', 'itr']
+
+# Read the CSV files extracted in the Extract step or stream them directly from the yearly zip files
+read_mode = 'csv'  # csv or zip
+
+extracted_dir = '../../Extract/CVM/Extracted'
+
+# Only the columns used in the Transform step are read, in chunks of chunk_size rows
+sheet_columns = ['CD_CVM', 'DT_REFER', 'ORDEM_EXERC', 'ESCALA_MOEDA', 'CD_CONTA', 'DS_CONTA', 'VL_CONTA']
+sheet_dtypes = {'ORDEM_EXERC': str, 'ESCALA_MOEDA': str, 'CD_CONTA': 'category', 'DS_CONTA': 'category'}
+chunk_size = 200000
+
+# Type of the VL_CONTA values kept in memory (see Compact_CVM.py)
+value_dtype = 'float64'  # float64 or float32
+
+
+# file_size:    size of the file in bytes (for the stage report)
+# ytd:          keep only the year to date values. The DRE of the ITR files has the values of the quarter and the values
+#               from the start of the year for each account, the year to date values are the ones with the first
+#               DT_INI_EXERC.
+def read_sheet(file, file_size, ytd=False):
+    with profiler.stage('read') as stage:
+        stage.bytes_read += file_size
+        chunks = pd.read_csv(file, sep=';', decimal='.', encoding='ISO-8859-1',
+                             usecols=sheet_columns + ['DT_INI_EXERC'] * ytd, dtype=sheet_dtypes, chunksize=chunk_size)
+        # Remove data from second to last year (Penúltimo) while reading
+        sheet = combine_tables([chunk[chunk['ORDEM_EXERC'] == 'ÚLTIMO'] for chunk in chunks])
+        if ytd:
+            first_start = sheet.groupby(['CD_CVM', 'DT_REFER', 'CD_CONTA'], observed=True)['DT_INI_EXERC'].\
+                transform('min')
+            sheet = sheet[sheet['DT_INI_EXERC'] == first_start].drop(columns='DT_INI_EXERC').reset_index(drop=True)
+        stage.rows_out = len(sheet)
+    return sheet
+
+
+# Read a sheet from the extracted CSV file or from the member of the zip file of the year
+# document: dfp or itr
+def read_cvm_file(suffix, year, document='dfp'):
+    file_name = f'{document}_cia_aberta_{suffix}_{year}.csv'
+    # The flows of the ITR files are read as year to date values (the balance sheets have no DT_INI_EXERC)
+    ytd = document == 'itr' and suffix.split('_')[0] in ['DRE', 'DFC']
+    if read_mode == 'zip':
+        zip_path = f'{extracted_dir}/{document}_cia_aberta_{year}.zip'
+        return zip_path, file_name, lambda: read_zip_member(zip_path, file_name, suffix, ytd)
+    path = f'{extracted_dir}/{file_name}'
+    return path, file_name, lambda: clean_sheet(read_sheet(path, os.path.getsize(path), ytd), suffix)
+
+
+def read_zip_member(zip_path, member, suffix, ytd=False):
+    with ZipFile(zip_path, 'r') as zip_file:
+        with zip_file.open(member) as file:
+            return clean_sheet(read_sheet(file, zip_file.getinfo(member).compress_size, ytd), suffix)
+
+
+########################################################################################################################
+# Cleaning
+# Each file is cleaned right after it is read. The cleaned tables are cached (see Cache_CVM.py), so only the files that
+# changed since the last run are read and cleaned again. The cleaned tables are kept in a compact form (see
+# Compact_CVM.py): DT_REFER holds the month of the reference date.
+
+
+def clean_sheet(data_frame, suffix):
+    with profiler.stage('clean', rows_in=len(data_frame)) as stage:
+        data_frame = data_frame.copy()
+
+        # Tag each row with its account role (see Classify_CVM.py)
+        statement, scope = suffix.split('_')[0], suffix.split('_')[-1]
+        data_frame = classify_accounts(data_frame, statement, scope)
+
+        # If column ESCALA_MOEDA is MIL, multiply VL_CONTA by 1000
+        # Except if the row shows EPS value (CD_CONTA 3.99.XX)
+        data_frame['VL_CONTA'] = np.where((data_frame['ESCALA_MOEDA'] == 'MIL') &
+                                          (~data_frame['ROLE'].isin(EPS_ROLES)),
+                                          data_frame['VL_CONTA'] * 1000,
+                                          data_frame['VL_CONTA'])
+        # Drop columns of no interest
+        data_frame.drop(['ESCALA_MOEDA', 'ORDEM_EXERC'], axis=1, inplace=True)
+
+        data_frame = compact_table(data_frame, value_dtype)
+        stage.rows_out = len(data_frame)
+    return data_frame
+
+
 # Dictionary to store DataFrames with suffix as the key
 data_frames = {}
 
+# Stages load/{suffix}, with the read and clean sub-steps of the files that are not cached
+# The sheets of the DFP and ITR files are kept in the same table (the ITR reference dates are the ends of the first
+# three quarters).
 for suffix in file_suffix:
-    file = pd.DataFrame()
-    for year in range(first_year, last_year+1):
-        file = pd.concat([file, pd.read_csv(f'../../Extract/CVM/Extracted/dfp_cia_aberta_{suffix}_{year}.csv', sep=';',
-                                            decimal='.', encoding='ISO-8859-1')])
-        print(f'{suffix} ({year}) - Shape: {file.shape}')
-    data_frames[suffix] = file  # store in dictionary
-    print(f'Combined DataFrame for {suffix}: {file.shape}')
-
+    with profiler.stage(f'load/{suffix}') as load_stage:
+        sheets = []
+        for document in documents:
+            for year in range(first_year, last_year+1):
+                source_path, file_name, build = read_cvm_file(suffix, year, document)
+                if document == 'itr' and not os.path.exists(source_path):
+                    print(f'{suffix} ({document} {year}) - not found, skipped')
+                    continue
+                sheet, cached = cached_table(source_path, build, file_name, {'value_dtype': value_dtype})
+                sheets.append(sheet)
+                print(f'{suffix} ({document} {year}) - Shape: {sheet.shape}' + (' (cached)' if cached else ''))
+        # Concatenate all years at once
+        data_frames[suffix] = combine_tables(sheets)  # store in dictionary
+        print(f'Combined DataFrame for {suffix}: {data_frames[suffix].shape}')
+        load_stage.rows_out = len(data_frames[suffix])
+
+profiler.start('combine_dfc')
 # Combine DFC_MI_con and DFC_MD_con into a new DataFrame
-data_frames['DFC_con'] = pd.concat([data_frames['DFC_MI_con'], data_frames['DFC_MD_con']], ignore_index=True)
+data_frames['DFC_con'] = combine_tables([data_frames['DFC_MI_con'], data_frames['DFC_MD_con']])
 
 # Combine DFC_MI_ind and DFC_MD_ind into a new DataFrame
-data_frames['DFC_ind'] = pd.concat([data_frames['DFC_MI_ind'], data_frames['DFC_MD_ind']], ignore_index=True)
+data_frames['DFC_ind'] = combine_tables([data_frames['DFC_MI_ind'], data_frames['DFC_MD_ind']])
 
 # Drop the old DFC_MI_con and DFC_MD_con DataFrames
 del data_frames['DFC_MI_con']
@@ -55,287 +170,187 @@ del data_frames['DFC_MD_con']
 # Drop the old DFC_MI_ind and DFC_MD_ind DataFrames
 del data_frames['DFC_MI_ind']
 del data_frames['DFC_MD_ind']
+profiler.stop(rows_out=len(data_frames['DFC_con']) + len(data_frames['DFC_ind']))
 
-########################################################################################################################
-# Cleaning
-
-for key in data_frames.keys():
-    print(f'Cleaning ORDER_EXERC from {key}')
-
-    # Remove data from second to last year (Penúltimo)
-    data_frames[key] = data_frames[key][data_frames[key]['ORDEM_EXERC'] == 'ÚLTIMO']
-
-    # Transform DT_REFER to DateTime.
-    # Shift DateTime six months in the future (to keep the model in training phase from accessing data it would
-    # not have access to)
-    data_frames[key]['DT_REFER'] = pd.to_datetime(data_frames[key]['DT_REFER']) + pd.DateOffset(months=6)
-
-    # Turn CD_CVM to String
-    data_frames[key]['CD_CVM'] = data_frames[key]['CD_CVM'].astype(str)
-
-    # If column ESCALA_MOEDA is MIL, multiply VL_CONTA by 1000
-    # Except if the row shows EPS value (CD_CONTA contains 3.99)
-    data_frames[key]['VL_CONTA'] = np.where((data_frames[key]['ESCALA_MOEDA'] == 'MIL') &
-                                            (~data_frames[key]['CD_CONTA'].
-                                            str.contains("3.99", case=False, na=False)),
-                                            data_frames[key]['VL_CONTA'] * 1000,
-                                            data_frames[key]['VL_CONTA'])
-    # Drop columns of no interest
-    data_frames[key].drop(['CNPJ_CIA', 'VERSAO', 'GRUPO_DFP', 'MOEDA', 'ESCALA_MOEDA', 'ORDEM_EXERC',
-                          'DT_FIM_EXERC', 'ST_CONTA_FIXA'], axis=1, inplace=True)
-    if key in ['DRE_con', 'DFC_con', 'DRE_ind', 'DFC_ind']:
-        data_frames[key].drop(
-            ['DT_INI_EXERC'], axis=1, inplace=True)
+print('Memory usage of the CVM tables:')
+print(memory_report(data_frames).to_string(index=False))
 
 ########################################################################################################################
 # The resulting dataframes will be merged with the Ticker_CVMCode data in order to create a new Dataframe with only the
-# stocks of interest. The script will run through the sheets generated so far to fill the empty spaces with the
-# fundamental data required.
+# stocks of interest. Every fundamental is extracted for all the companies at once and then merged on CD_CVM and
+# DT_REFER, instead of filtering the sheets once for each ticker.
 
+profiler.start('tickers').read_file('../../Ticker_CVMCode.csv')
 stockList = pd.read_csv(f'../../Ticker_CVMCode.csv', sep=';', encoding='ISO-8859-1')
 
 # Drop rows with companies without information
 stockList = stockList[stockList['DENOM_CIA'] != '-']
+stockList = stockList[['Ticker', 'CD_CVM']].rename(columns={'Ticker': 'TICKER'})
+stockList['CD_CVM'] = stockList['CD_CVM'].astype('int32')
+profiler.stop(rows_out=len(stockList))
+
+########################################################################################################################
+# Extract Earnings
+print('Extracting Earnings')
+profiler.start('fundamentals/E', rows_in=len(data_frames['DRE_con']) + len(data_frames['DRE_ind']))
+
+
+# Filter sheet to get only data regarding Earnings
+def filter_earnings(data_frame):
+    earnings_data = data_frame[data_frame['ROLE'] == 'EARNINGS']
+    return earnings_data[['CD_CVM', 'DT_REFER', 'VL_CONTA']].rename(columns={'VL_CONTA': 'E'})
+
+
+earnings_con = filter_earnings(data_frames['DRE_con'])
+earnings_ind = filter_earnings(data_frames['DRE_ind'])
 
-# Add empty columns with the relevant data:
-columns = {
-    'TICKER': None,
-    'DT_REFER': None,   # Reference Date
-    'E': None,          # Earnings
-    'EPS': None,        # Earnings per Share
-    'CA': None,         # Current Assets
-    'CL': None,         # Current Liabilities
-    'GROSS_DEBT': None,
-    'EQUITY': None,
-    'D': None           # Dividends
-}
-
-# Add the columns all at once
-fundamentalData = pd.DataFrame(columns=columns)
-
-# The script will run through each stock of the stockList dataframe and collect the relevant data from the sheets
-# extracted earlier
-for i, ticker in enumerate(stockList['Ticker']):
-
-    # Trigger to orient the processes inside the if's statements
-    # 0: no effect
-    # 1: data unavailable in the '_con' sheets
-    # 2: data unavailable in any sheet
-    trigger = 0
-
-    # Get CVM Code from Ticker
-    cvm_code = stockList[stockList['Ticker'] == ticker]['CD_CVM'].iloc[0]
-    print(f'Processing {ticker}: {i+1}/{len(stockList["Ticker"])}')
-
-    ####################################################################################################################
-    # Extract Earnings
-    # Filter sheet to get only data of the analysed Ticker and data regarding Earnings
-    filtered_data = data_frames['DRE_con'][(data_frames['DRE_con']['CD_CVM'] == cvm_code) &
-                                           data_frames['DRE_con']['DS_CONTA'].
-                                           str.contains("lucro", case=False, na=False) &
-                                           data_frames['DRE_con']['DS_CONTA'].
-                                           str.contains("preju[ií]zo", case=False, na=False) &
-                                           data_frames['DRE_con']['DS_CONTA'].
-                                           str.contains("consolidado do per[ií]odo", case=False, na=False)]
-
-    fundamentalData = pd.concat([fundamentalData, pd.DataFrame({'TICKER': [ticker] * len(filtered_data['DT_REFER']),
-                                                                'DT_REFER': filtered_data['DT_REFER'],
-                                                                'E': filtered_data['VL_CONTA']})], ignore_index=True)
-
-    # If the Stock is not present in DRE_con Sheet, it must be searched for in the DRE_ind
-    if filtered_data.empty:
-        trigger = 1
-        filtered_data = data_frames['DRE_ind'][(data_frames['DRE_ind']['CD_CVM'] == cvm_code) &
-                                               data_frames['DRE_ind']['DS_CONTA'].
-                                               str.contains("lucro", case=False, na=False) &
-                                               data_frames['DRE_ind']['DS_CONTA'].
-                                               str.contains("preju[ií]zo", case=False, na=False) &
-                                               data_frames['DRE_ind']['DS_CONTA'].
-                                               str.contains("do per[ií]odo", case=False, na=False)]
-        fundamentalData = pd.concat([fundamentalData, pd.DataFrame({'TICKER': [ticker] * len(filtered_data['DT_REFER']),
-                                                                    'DT_REFER': filtered_data['DT_REFER'],
-                                                                    'E': filtered_data['VL_CONTA']})],
-                                    ignore_index=True)
-        # If the ticker is also not present in DRE_ind, append it in the fundamentalData but keep all columns empty
-        if filtered_data.empty:
-            trigger = 2
-            print('Warning: Ticker not in DRE Sheets!')
-            fundamentalData = pd.concat([fundamentalData, pd.DataFrame({'TICKER': ticker})])
-
-    ####################################################################################################################
-    # Extract Earning per Share
-    # Filter sheet to get only data of the analysed Ticker and data regarding Earnings per Share
-    # Iterate in the Dates extracted from the Earnings step:
-    for date in filtered_data['DT_REFER']:
-        # If data is in _con Sheet
-        if trigger == 0:
-            filtered_EPS = data_frames['DRE_con'][(data_frames['DRE_con']['CD_CVM'] == cvm_code) &
-                                                  (data_frames['DRE_con']['DT_REFER'] == date) &
-                                                  data_frames['DRE_con']['CD_CONTA'].
-                                                  str.contains("3.99", case=False, na=False)]
-        # If data is in _ind Sheet
-        elif trigger == 1:
-            filtered_EPS = data_frames['DRE_ind'][(data_frames['DRE_ind']['CD_CVM'] == cvm_code) &
-                                                  (data_frames['DRE_ind']['DT_REFER'] == date) &
-                                                  data_frames['DRE_ind']['CD_CONTA'].
-                                                  str.contains("3.99", case=False, na=False)]
-        # If no data was retrieved in the previous iteration
-        else:
-            break
-
-        EPS = None  # Initialize EPS to None or another default value
-
-        # CD_CONTA values related to EPS. It is not standardized, so some trial and error is required to get a valid
-        # value.
-        codes_to_check = ['3.99.02.02', '3.99.02.01', '3.99.01.02', '3.99.01.01', '3.99.02', '3.99.01', '3.99']
-
-        for code in codes_to_check:
-            values = filtered_EPS['VL_CONTA'][filtered_EPS['CD_CONTA'] == code]
-            ds_conta = filtered_EPS['DS_CONTA'][filtered_EPS['CD_CONTA'] == code]
-            earnings = fundamentalData.loc[(fundamentalData['TICKER'] == ticker) &
-                                           (fundamentalData['DT_REFER'] == date), 'E'].iloc[0]
-            if not values.empty and values.iloc[0] != 0:
-                EPS = values.iloc[0]
-
-                # Check if the conditions to break the loop are met
-                # If checking codes 3.99.0X.0X, only break in the DS_CONTA received is 'ON' (ordinary stocks)
-                # Also check for errors in the EPS entry (Earnings and EPS must have the same sign)
-                if ((code in ['3.99.02.02', '3.99.02.01', '3.99.01.02', '3.99.01.01'] and ds_conta.iloc[0] == 'ON') or
-                        code in ['3.99.02', '3.99.01']) and \
-                        (earnings * EPS > 0):
-                    break  # Stop once we find a valid EPS value
-            elif (code == '3.99') and (values.iloc[0] == 0):
-                EPS = 0
-
-        fundamentalData.loc[(fundamentalData['TICKER'] == ticker) &
-                            (fundamentalData['DT_REFER'] == date), 'EPS'] = EPS
-
-    ####################################################################################################################
-    # Extract Current Assets (CA)
-    filtered_CA = pd.DataFrame()
-    if trigger == 0:
-        filtered_CA = data_frames['BPA_con'][(data_frames['BPA_con']['CD_CVM'] == cvm_code) &
-                                             (data_frames['BPA_con']['CD_CONTA'] == '1.01')].copy()
-    elif trigger == 1:
-        filtered_CA = data_frames['BPA_ind'][(data_frames['BPA_ind']['CD_CVM'] == cvm_code) &
-                                             (data_frames['BPA_ind']['CD_CONTA'] == '1.01')].copy()
-    else:
-        continue
-    filtered_CA.loc[:, 'TICKER'] = ticker
-
-    # MergeAndTransform the current fundamentalData to the filtered_CA dataframe where TICKER and DT_REFER match.
-    # Assign the VL_CONTA value in filtered_CA to CA in fundamentalData
-    merged_df = fundamentalData[fundamentalData['TICKER'] == ticker].\
-        merge(filtered_CA[['TICKER', 'DT_REFER', 'VL_CONTA']], on=['TICKER', 'DT_REFER'], how='left')
-    fundamentalData.loc[fundamentalData['TICKER'] == ticker, 'CA'] = merged_df['VL_CONTA'].values
-
-    ####################################################################################################################
-    # Extract Current Liabilities (CL)
-    filtered_CL = pd.DataFrame()
-    if trigger == 0:
-        filtered_CL = data_frames['BPP_con'][(data_frames['BPP_con']['CD_CVM'] == cvm_code) &
-                                             (data_frames['BPP_con']['CD_CONTA'] == '2.01')].copy()
-    elif trigger == 1:
-        filtered_CL = data_frames['BPP_ind'][(data_frames['BPP_ind']['CD_CVM'] == cvm_code) &
-                                             (data_frames['BPP_ind']['CD_CONTA'] == '2.01')].copy()
-    else:
-        continue
-    filtered_CL.loc[:, 'TICKER'] = ticker
-
-    # MergeAndTransform the current fundamentalData to the filtered_CL dataframe where TICKER and DT_REFER match.
-    # Assign the VL_CONTA value in filtered_CL to CL in fundamentalData
-    merged_df = fundamentalData[fundamentalData['TICKER'] == ticker].\
-        merge(filtered_CL[['TICKER', 'DT_REFER', 'VL_CONTA']], on=['TICKER', 'DT_REFER'], how='left')
-    fundamentalData.loc[fundamentalData['TICKER'] == ticker, 'CL'] = merged_df['VL_CONTA'].values
-
-    ####################################################################################################################
-    # Extract Gross Debt
-    filtered_GD = pd.DataFrame()
-    aggregated_GD = pd.DataFrame()
-    if trigger == 0:
-        filtered_GD = data_frames['BPP_con'][(data_frames['BPP_con']['CD_CVM'] == cvm_code) &
-                                             ((data_frames['BPP_con']['CD_CONTA'] == '2.01.04') |
-                                             (data_frames['BPP_con']['CD_CONTA'] == '2.02.01'))].copy()
-
-    elif trigger == 1:
-        filtered_GD = data_frames['BPP_ind'][(data_frames['BPP_ind']['CD_CVM'] == cvm_code) &
-                                             ((data_frames['BPP_ind']['CD_CONTA'] == '2.01.04') |
-                                              (data_frames['BPP_ind']['CD_CONTA'] == '2.02.01'))].copy()
-    else:
-        continue
-    if not filtered_GD.empty:
-        filtered_GD.loc[:, 'TICKER'] = ticker
-        # Gross debt is the sum of the values of current debt and non-current debt
-        aggregated_GD = filtered_GD.groupby(['TICKER', 'DT_REFER'], as_index=False)['VL_CONTA'].sum()
-
-        # MergeAndTransform the current fundamentalData to the aggregated_GD dataframe where TICKER and DT_REFER match.
-        # Assign the VL_CONTA value in aggregated_GD to GROSS DEBT in fundamentalData
-        merged_df = fundamentalData[fundamentalData['TICKER'] == ticker].\
-            merge(aggregated_GD[['TICKER', 'DT_REFER', 'VL_CONTA']], on=['TICKER', 'DT_REFER'], how='left')
-        fundamentalData.loc[fundamentalData['TICKER'] == ticker, 'GROSS_DEBT'] = merged_df['VL_CONTA'].values
-
-    ####################################################################################################################
-    # Extract Equity (patrimônio líquido)
-    filtered_EQ = pd.DataFrame()
-    if trigger == 0:
-        filtered_EQ = data_frames['BPP_con'][(data_frames['BPP_con']['CD_CVM'] == cvm_code) &
-                                             data_frames['BPP_con']['DS_CONTA'].
-                                             str.contains("patrim[oô]nio l[ií]quido consolidado",
-                                                          case=False, na=False)].copy()
-    elif trigger == 1:
-        filtered_EQ = data_frames['BPP_ind'][(data_frames['BPP_ind']['CD_CVM'] == cvm_code) &
-                                             data_frames['BPP_ind']['DS_CONTA'].
-                                             str.contains("patrim[oô]nio l[ií]quido",
-                                                          case=False, na=False)].copy()
-    else:
-        continue
-    filtered_EQ.loc[:, 'TICKER'] = ticker
-
-    # MergeAndTransform the current fundamentalData to the filtered_EQ dataframe where TICKER and DT_REFER match.
-    # Assign the VL_CONTA value in filtered_EQ to EQUITY in fundamentalData
-    merged_df = fundamentalData[fundamentalData['TICKER'] == ticker].\
-        merge(filtered_EQ[['TICKER', 'DT_REFER', 'VL_CONTA']], on=['TICKER', 'DT_REFER'], how='left')
-    fundamentalData.loc[fundamentalData['TICKER'] == ticker, 'EQUITY'] = merged_df['VL_CONTA'].values
-
-    ####################################################################################################################
-    # Extract Dividends (D)
-    filtered_D = pd.DataFrame()
-    aggregated_D = pd.DataFrame()
-    if trigger == 0:
-        filtered_D = data_frames['DFC_con'][(data_frames['DFC_con']['CD_CVM'] == cvm_code) &
-                                            (data_frames['DFC_con']['CD_CONTA'].isin(
-                                                [f"6.03.{i:02d}" for i in range(1, 21)])) &
-                                            (data_frames['DFC_con']['DS_CONTA'].
-                                             str.contains("dividend", case=False, na=False) |
-                                             (data_frames['DFC_con']['DS_CONTA'].
-                                              str.contains("juro", case=False, na=False) &
-                                              data_frames['DFC_con']['DS_CONTA'].
-                                              str.contains("capital pr[oó]prio", case=False, na=False))) &
-                                            (data_frames['DFC_con']['VL_CONTA'] < 0)].copy()
-
-    elif trigger == 1:
-        filtered_D = data_frames['DFC_ind'][(data_frames['DFC_ind']['CD_CVM'] == cvm_code) &
-                                            (data_frames['DFC_ind']['CD_CONTA'].isin(
-                                                [f"6.03.{i:02d}" for i in range(1, 21)])) &
-                                            (data_frames['DFC_ind']['DS_CONTA'].
-                                             str.contains("dividend", case=False, na=False) |
-                                             (data_frames['DFC_ind']['DS_CONTA'].
-                                             str.contains("juro", case=False, na=False) &
-                                             data_frames['DFC_ind']['DS_CONTA'].
-                                             str.contains("capital pr[oó]prio", case=False, na=False))) &
-                                            (data_frames['DFC_ind']['VL_CONTA'] < 0)].copy()
-    else:
-        continue
-    if not filtered_D.empty:
-        filtered_D.loc[:, 'TICKER'] = ticker
-        # Aggregate values extracted by sum
-        aggregated_D = filtered_D.groupby(['TICKER', 'DT_REFER'], as_index=False)['VL_CONTA'].sum()
-
-        # MergeAndTransform the current fundamentalData to the aggregated_D dataframe where TICKER and DT_REFER match.
-        # Assign the VL_CONTA value in aggregated_D to D in fundamentalData
-        merged_df = fundamentalData[fundamentalData['TICKER'] == ticker].\
-            merge(aggregated_D[['TICKER', 'DT_REFER', 'VL_CONTA']], on=['TICKER', 'DT_REFER'], how='left')
-        fundamentalData.loc[fundamentalData['TICKER'] == ticker, 'D'] = merged_df['VL_CONTA'].values
+# Companies not present in the DRE_con Sheet must be searched for in the DRE_ind Sheet
+con_codes = earnings_con['CD_CVM'].unique()
+earnings_ind = earnings_ind[~earnings_ind['CD_CVM'].isin(con_codes)]
+ind_codes = earnings_ind['CD_CVM'].unique()
+
+# Tickers that are also not present in DRE_ind are kept in the fundamentalData with all columns empty
+fundamentalData = stockList.merge(pd.concat([earnings_con, earnings_ind], ignore_index=True), on='CD_CVM', how='left')
+for ticker in fundamentalData.loc[fundamentalData['DT_REFER'].isna(), 'TICKER']:
+    print(f'Warning: {ticker} not in DRE Sheets!')
+profiler.stop(rows_out=fundamentalData['E'].notna().sum())
+
+
+# Get the rows of a sheet with the given account roles for each company, from the '_con' sheet if the earnings were
+# found there or from the '_ind' sheet otherwise
+def filter_sheets(sheet, roles):
+    data_con = data_frames[f'{sheet}_con']
+    data_ind = data_frames[f'{sheet}_ind']
+    return pd.concat([data_con[data_con['CD_CVM'].isin(con_codes) & data_con['ROLE'].isin(roles)],
+                      data_ind[data_ind['CD_CVM'].isin(ind_codes) & data_ind['ROLE'].isin(roles)]], ignore_index=True)
+
+
+# Assign the VL_CONTA value of the filtered data to a feature of fundamentalData where CD_CVM and DT_REFER match
+def merge_feature(fundamental_data, filtered_data, feature):
+    filtered_data = filtered_data[['CD_CVM', 'DT_REFER', 'VL_CONTA']].rename(columns={'VL_CONTA': feature})
+    return fundamental_data.merge(filtered_data, on=['CD_CVM', 'DT_REFER'], how='left')
+
+
+########################################################################################################################
+# Extract Earning per Share
+print('Extracting Earnings per Share')
+profiler.start('fundamentals/EPS')
+
+# CD_CONTA values related to EPS. It is not standardized, so some trial and error is required to get a valid value.
+# The codes are listed by priority.
+codes_to_check = ['3.99.02.02', '3.99.02.01', '3.99.01.02', '3.99.01.01', '3.99.02', '3.99.01', '3.99']
+
+# Only the first entry of each code is considered for each company and date
+filtered_EPS = filter_sheets('DRE', EPS_ROLES)
+eps_rows_in = len(filtered_EPS)
+filtered_EPS = filtered_EPS[filtered_EPS['CD_CONTA'].isin(codes_to_check)]
+filtered_EPS = filtered_EPS.drop_duplicates(subset=['CD_CVM', 'DT_REFER', 'CD_CONTA'], keep='first')
+filtered_EPS['PRIORITY'] = filtered_EPS['CD_CONTA'].map({code: i for i, code in enumerate(codes_to_check)})
+
+# EPS entries are checked against the first Earnings value of each company and date
+filtered_EPS = filtered_EPS.merge(fundamentalData.drop_duplicates(subset=['CD_CVM', 'DT_REFER'], keep='first')
+                                  [['CD_CVM', 'DT_REFER', 'E']], on=['CD_CVM', 'DT_REFER'], how='inner')
+
+# A code is a valid EPS if the conditions to stop searching are met:
+# If checking codes 3.99.0X.0X, only accept it if the DS_CONTA received is 'ON' (ordinary stocks)
+# Also check for errors in the EPS entry (Earnings and EPS must have the same sign)
+valid_EPS = filtered_EPS[(filtered_EPS['VL_CONTA'] != 0) &
+                         (((filtered_EPS['PRIORITY'] <= 3) & (filtered_EPS['ROLE'] == 'EPS_ON')) |
+                          filtered_EPS['PRIORITY'].isin([4, 5])) &
+                         (filtered_EPS['E'] * filtered_EPS['VL_CONTA'] > 0)]
+
+# If no code is valid, the EPS is the non-zero value of the code with the lowest priority, or zero if 3.99 is zero
+fallback_EPS = filtered_EPS[(filtered_EPS['VL_CONTA'] != 0) | (filtered_EPS['CD_CONTA'] == '3.99')]
+
+selected_EPS = pd.concat([valid_EPS.sort_values('PRIORITY', kind='stable').
+                         drop_duplicates(subset=['CD_CVM', 'DT_REFER'], keep='first'),
+                          fallback_EPS.sort_values('PRIORITY', kind='stable').
+                         drop_duplicates(subset=['CD_CVM', 'DT_REFER'], keep='last')])
+selected_EPS = selected_EPS.drop_duplicates(subset=['CD_CVM', 'DT_REFER'], keep='first')
+
+# Zero EPS values are stored as integers, as in the original per ticker extraction
+selected_EPS['VL_CONTA'] = selected_EPS['VL_CONTA'].astype(object)
+selected_EPS.loc[selected_EPS['VL_CONTA'] == 0, 'VL_CONTA'] = 0
+
+fundamentalData = merge_feature(fundamentalData, selected_EPS, 'EPS')
+profiler.stop(rows_in=eps_rows_in, rows_out=fundamentalData['EPS'].notna().sum())
+
+########################################################################################################################
+# Extract Current Assets (CA)
+print('Extracting Current Assets')
+profiler.start('fundamentals/CA')
+filtered_CA = filter_sheets('BPA', ['CURRENT_ASSETS'])
+fundamentalData = merge_feature(fundamentalData, filtered_CA.drop_duplicates(subset=['CD_CVM', 'DT_REFER']), 'CA')
+profiler.stop(rows_in=len(filtered_CA), rows_out=fundamentalData['CA'].notna().sum())
+
+########################################################################################################################
+# Extract Current Liabilities (CL)
+print('Extracting Current Liabilities')
+profiler.start('fundamentals/CL')
+filtered_CL = filter_sheets('BPP', ['CURRENT_LIABILITIES'])
+fundamentalData = merge_feature(fundamentalData, filtered_CL.drop_duplicates(subset=['CD_CVM', 'DT_REFER']), 'CL')
+profiler.stop(rows_in=len(filtered_CL), rows_out=fundamentalData['CL'].notna().sum())
+
+########################################################################################################################
+# Extract Gross Debt
+print('Extracting Gross Debt')
+profiler.start('fundamentals/GROSS_DEBT')
+filtered_GD = filter_sheets('BPP', ['GROSS_DEBT'])
+
+# Gross debt is the sum of the values of current debt and non-current debt
+aggregated_GD = filtered_GD.groupby(['CD_CVM', 'DT_REFER'], as_index=False, observed=True)['VL_CONTA'].sum()
+fundamentalData = merge_feature(fundamentalData, aggregated_GD, 'GROSS_DEBT')
+profiler.stop(rows_in=len(filtered_GD), rows_out=fundamentalData['GROSS_DEBT'].notna().sum())
+
+########################################################################################################################
+# Extract Equity (patrimônio líquido)
+print('Extracting Equity')
+profiler.start('fundamentals/EQUITY')
+filtered_EQ = filter_sheets('BPP', ['EQUITY'])
+fundamentalData = merge_feature(fundamentalData, filtered_EQ.drop_duplicates(subset=['CD_CVM', 'DT_REFER']), 'EQUITY')
+profiler.stop(rows_in=len(filtered_EQ), rows_out=fundamentalData['EQUITY'].notna().sum())
+
+########################################################################################################################
+# Extract Dividends (D)
+print('Extracting Dividends')
+profiler.start('fundamentals/D')
+
+# Only negative values are dividend payouts
+filtered_D = filter_sheets('DFC', ['DIVIDEND'])
+filtered_D = filtered_D[filtered_D['VL_CONTA'] < 0]
+
+# Aggregate values extracted by sum
+aggregated_D = filtered_D.groupby(['CD_CVM', 'DT_REFER'], as_index=False, observed=True)['VL_CONTA'].sum()
+fundamentalData = merge_feature(fundamentalData, aggregated_D, 'D')
+profiler.stop(rows_in=len(filtered_D), rows_out=fundamentalData['D'].notna().sum())
+
+########################################################################################################################
+# Trailing twelve month values of the flows (E, EPS and D)
+# The values extracted from the ITR files are year to date values. They are replaced by the TTM values of the company
+# (see TTM_CVM.py). The fourth quarter (DFP) keeps the annual values. Dividends are 0 in quarters without dividends.
+print('Computing trailing twelve month values')
+ttm_stage = profiler.start('fundamentals/TTM')
+ttm_columns = ['E', 'EPS', 'D']
+fundamentalData['QUARTER'] = quarter_numbers(fundamentalData['DT_REFER'])
+flows = fundamentalData.dropna(subset=['QUARTER']).drop_duplicates(subset=['CD_CVM', 'QUARTER'], keep='first')
+flows = flows.assign(D=flows['D'].fillna(0.0))
+ttm_flows, changed_companies = incremental_ttm_values(flows, ttm_columns)
+print(f'TTM values computed for {changed_companies} companies')
+
+fundamentalData = fundamentalData.merge(ttm_flows[['CD_CVM', 'QUARTER'] + [f'{column}_TTM' for column in ttm_columns]],
+                                        on=['CD_CVM', 'QUARTER'], how='left')
+quarterly = fundamentalData['QUARTER'].notna() & (fundamentalData['QUARTER'] % 4 != 3)
+for column in ttm_columns:
+    fundamentalData.loc[quarterly, column] = fundamentalData.loc[quarterly, f'{column}_TTM']
+profiler.stop(rows_in=len(flows), rows_out=quarterly.sum())
+
+save_stage = profiler.start('save')
+fundamentalData = fundamentalData[['TICKER', 'DT_REFER', 'E', 'EPS', 'CA', 'CL', 'GROSS_DEBT', 'EQUITY', 'D']]
+
+# Transform DT_REFER to DateTime.
+# Shift DateTime six months in the future (to keep the model in training phase from accessing data it would
+# not have access to)
+fundamentalData['DT_REFER'] = reference_dates(fundamentalData['DT_REFER'], months_shift=6)
 
 # fill NaN with zeros
 fundamentalData.fillna({'D': 0.0}, inplace=True)
@@ -343,8 +358,12 @@ fundamentalData.fillna({'CL': 0.0}, inplace=True)
 fundamentalData.fillna({'GROSS_DEBT': 0.0}, inplace=True)
 
 fundamentalData.to_csv('Transformed/fundamentalData_CVM.csv', sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+save_stage.wrote_file('Transformed/fundamentalData_CVM.csv')
+profiler.stop(rows_out=len(fundamentalData))
 print('fundamentalData_CVM successfully generated')
 
+profiler.save()
+
 # NOTES
 
 # Get only CD_CONTA of interest
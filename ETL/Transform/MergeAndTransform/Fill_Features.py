@@ -0,0 +1,33 @@
+# Fill of the fundamental features of the merged data (see Merge_YFinance_CVM.py).
+# The price rows of a ticker have no fundamental data, except in the months where the ticker reported. Every row takes
+# the values of the most recent fundamental data of its ticker, at least one day and at most 365 days before DATE.
+
+import numpy as np
+import pandas as pd
+
+
+# Fill NaN in fundamental data where Date difference is within 1 year
+# All the features are filled at once with a sorted as-of join per ticker.
+# profiler: StageProfiler of the script, records the stages fill/asof and fill/{feature}
+def fill_features(merged_data, fundamental_data, features, profiler):
+    with profiler.stage('fill/asof', rows_in=len(merged_data)) as stage:
+        reference = fundamental_data[['TICKER', 'DT_REFER'] + features].dropna(subset=['DT_REFER'])
+        # Fundamental data can only be used from the day after DT_REFER on.
+        # Ties keep the order of the fundamental data, so the last row of the ticker and date is used.
+        reference = reference.assign(FILL_DATE=reference['DT_REFER'] + pd.Timedelta(days=1)).\
+            sort_values('FILL_DATE', kind='stable')
+
+        dated = merged_data.loc[merged_data['DATE'].notna(), ['TICKER', 'DATE']].sort_values('DATE', kind='stable')
+        filled = pd.merge_asof(dated.reset_index(), reference, left_on='DATE', right_on='FILL_DATE', by='TICKER',
+                               direction='backward').set_index('index')
+
+        # Discard values older than 365 days
+        filled.loc[(filled['DATE'] - filled['DT_REFER']).dt.days > 365, features] = np.nan
+        stage.rows_out = len(filled)
+
+    for feature in features:
+        print('Forward filling NaNs for:', feature)
+        with profiler.stage(f'fill/{feature}', rows_in=merged_data[feature].notna().sum()) as stage:
+            merged_data[feature] = merged_data[feature].fillna(filled[feature])
+            stage.rows_out = merged_data[feature].notna().sum()
+    return merged_data
@@ -0,0 +1,172 @@
+# Daily version of Merge_YFinance_CVM.py, for the daily bars saved by Extract_YFinance.py (interval = '1d') to the
+# price arrays in Extract/YFinance/Extracted/Daily (see Price_Arrays.py).
+# 1 - Get the adjusted close price one year after each bar (the last bar of the ticker at or before the same date of the
+#     next year) with a sorted search per ticker, instead of a self merge on (TICKER, YEAR-1, MONTH).
+# 2 - Attach the most recent fundamental data of the ticker (at least one day and at most 365 days before DATE) to each
+#     bar with a sorted search on (ticker, date), instead of an outer merge and a fill of each feature.
+# 3 - Calculate the features of Merge_YFinance_CVM.py.
+# The tickers are processed in chunks of contiguous rows of the memory mapped arrays, and each chunk is appended to
+# the output, so the memory used depends on the chunk size and not on the number of bars. With monthly bars, the rows
+# are the ones of Merge_YFinance_CVM.py. The raw merged data (mergedData.csv) is not saved.
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append('../..')
+from Price_Arrays import read_price_arrays, composite_keys, asof_positions, day_numbers, year_ahead_positions, take
+from Stage_Profiler import StageProfiler
+
+prices_dir = '../../Extract/YFinance/Extracted/Daily'
+fundamental_path = '../CVM/Transformed/fundamentalData_CVM.csv'
+market_output_path = '../../Load/marketData_daily.csv'
+stock_output_path = '../../Load/stockData_daily.csv'
+
+market_ticker = 'BOVA11.SA'
+
+# Number of tickers processed at once
+tickers_per_chunk = 100
+
+# A bar one year after is only used if it is at most max_gap_days before the same date of the next year
+max_gap_days = 7
+
+# Fundamental data is used from 1 to max_age_days days after DT_REFER
+max_age_days = 365
+
+# List of fundamental features
+fundamental_features = ['E', 'EPS', 'CA', 'CL', 'GROSS_DEBT', 'EQUITY', 'D']
+
+stock_columns = ['TICKER', 'DATE', 'PE', 'BVPS', 'ROE', 'DPR', 'DY', 'PBR', 'CA', 'GROSS_DEBT', 'ANS', 'CURRENT_RATIO',
+                 'EPS', 'APPRECIATION', 'CLASS']
+
+# Time, rows, bytes and memory of each stage (see Stage_Profiler.py)
+profiler = StageProfiler('Merge_Daily_YFinance_CVM')
+
+index, arrays = read_price_arrays(prices_dir)
+codes_of_tickers = pd.Series(np.arange(len(index)), index=index['TICKER'])
+
+########################################################################################################################
+# Get market appreciation from BOVA11
+print('Processing Market Data')
+market_stage = profiler.start('market')
+if market_ticker in codes_of_tickers:
+    start, stop = index.loc[codes_of_tickers[market_ticker], ['START', 'STOP']]
+    market_dates = np.asarray(arrays['DATE'][start:stop])
+    market_close = np.asarray(arrays['CLOSE'][start:stop])
+    marketData = pd.DataFrame({'TICKER': market_ticker, 'DATE': market_dates, 'CLOSE': market_close,
+                               'FUTURE_CLOSE': take(market_close, year_ahead_positions(np.zeros(stop - start),
+                                                                                       market_dates, max_gap_days))})
+    # Get 1 year appreciation
+    marketData['APPRECIATION'] = marketData['FUTURE_CLOSE']/marketData['CLOSE'] - 1
+    # Drop the bars of the last year (no FUTURE_CLOSE)
+    marketData = marketData.dropna(subset=['FUTURE_CLOSE'])
+
+    # Save IBOVESPA data
+    marketData.to_csv(market_output_path, sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+    market_stage.wrote_file(market_output_path)
+    profiler.stop(rows_in=stop - start, rows_out=len(marketData))
+else:
+    print(f'{market_ticker} not found in {prices_dir}')
+    profiler.stop()
+
+########################################################################################################################
+# Fundamental Data
+# Retrieve fundamental data, sorted by ticker and by the first date it can be used (the day after DT_REFER). Ties keep
+# the order of the fundamental data, so the last row of the ticker and date is used.
+print('Processing Fundamental Data')
+fundamental_stage = profiler.start('fundamental')
+fundamental_stage.read_file(fundamental_path)
+fundamentalData_CVM = pd.read_csv(fundamental_path, sep=';', encoding='ISO-8859-1')
+fundamental_stage.rows_in = len(fundamentalData_CVM)
+
+fundamentalData_CVM['DT_REFER'] = pd.to_datetime(fundamentalData_CVM['DT_REFER'])
+fundamentalData_CVM['CODE'] = fundamentalData_CVM['TICKER'].map(codes_of_tickers)
+fundamentalData_CVM = fundamentalData_CVM.dropna(subset=['CODE', 'DT_REFER'])
+fundamentalData_CVM['CODE'] = fundamentalData_CVM['CODE'].astype(np.int64)
+fundamentalData_CVM['FILL_DAY'] = day_numbers(fundamentalData_CVM['DT_REFER']) + 1
+fundamentalData_CVM = fundamentalData_CVM.sort_values(['CODE', 'FILL_DAY'], kind='stable', ignore_index=True)
+
+fundamental_codes = fundamentalData_CVM['CODE'].to_numpy()
+fundamental_keys = composite_keys(fundamental_codes, fundamentalData_CVM['FILL_DAY'])
+fundamental_days = fundamentalData_CVM['FILL_DAY'].to_numpy() - 1
+fundamental_values = {feature: fundamentalData_CVM[feature].to_numpy(dtype=np.float64)
+                      for feature in fundamental_features}
+profiler.stop(rows_out=len(fundamentalData_CVM))
+
+
+########################################################################################################################
+# Merge, calculate the features and save each chunk of tickers
+# Returns the rows of the stocks of the tickers first to last - 1 (index positions), with the features
+def merge_chunk(first, last):
+    start, stop = index['START'].iat[first], index['STOP'].iat[last - 1]
+    codes = np.repeat(np.arange(first, last), (index['STOP'] - index['START']).to_numpy()[first:last])
+    dates = np.asarray(arrays['DATE'][start:stop])
+    days = day_numbers(dates)
+
+    with profiler.stage('future', rows_in=stop - start) as stage:
+        adjusted_close = np.asarray(arrays['ADJ_CLOSE'][start:stop])
+        future_adjusted_close = take(adjusted_close, year_ahead_positions(codes, dates, max_gap_days))
+        # Bars of the stocks with an adjusted close price in the next year
+        rows = ~np.isnan(future_adjusted_close)
+        if market_ticker in codes_of_tickers:
+            rows &= codes != codes_of_tickers[market_ticker]
+        stage.rows_out = rows.sum()
+
+    with profiler.stage('asof', rows_in=rows.sum()) as stage:
+        positions = asof_positions(fundamental_keys, fundamental_codes, codes[rows], days[rows])
+        # Discard values older than max_age_days
+        positions[(positions >= 0) & (days[rows] - fundamental_days[np.maximum(positions, 0)] > max_age_days)] = -1
+        merged_data = pd.DataFrame({'TICKER': index['TICKER'].to_numpy()[codes[rows]], 'DATE': dates[rows],
+                                    'ADJ_CLOSE': adjusted_close[rows],
+                                    'MARKET_CAP': np.asarray(arrays['MARKET_CAP'][start:stop])[rows],
+                                    'FUTURE_ADJ_CLOSE': future_adjusted_close[rows]})
+        for feature in fundamental_features:
+            merged_data[feature] = take(fundamental_values[feature], positions)
+        # Drop rows without fundamental data and with EPS = 0 (ANS will be infinite)
+        merged_data = merged_data[merged_data['E'].notna() & (merged_data['EPS'] != 0)].copy()
+        stage.rows_out = len(merged_data)
+
+    with profiler.stage('features', rows_in=len(merged_data)):
+        # Weighted Average Number of Shares
+        merged_data['ANS'] = merged_data['E']/merged_data['EPS']
+        # Price to Earnings Ratio
+        merged_data['PE'] = merged_data['MARKET_CAP']/merged_data['E']
+        # Book Value per Share
+        merged_data['BVPS'] = merged_data['EQUITY']/merged_data['ANS']
+        # Return on Equities
+        merged_data['ROE'] = merged_data['E']/merged_data['EQUITY']
+        # Dividend Payout Ratio
+        merged_data['DPR'] = -merged_data['D']/merged_data['E']
+        # Dividend Yield
+        merged_data['DY'] = -merged_data['D']/merged_data['MARKET_CAP']
+        # Price to Book Ratio
+        merged_data['PBR'] = merged_data['MARKET_CAP']/merged_data['EQUITY']
+        # Current Ratio
+        merged_data['CURRENT_RATIO'] = merged_data['CA']/merged_data['CL']
+        # 1 Year Asset Appreciation
+        merged_data['APPRECIATION'] = merged_data['FUTURE_ADJ_CLOSE']/merged_data['ADJ_CLOSE'] - 1
+        # Class
+        merged_data['CLASS'] = (merged_data['APPRECIATION'] >= 0.8).astype(int)
+    return merged_data[stock_columns]
+
+
+print(f'Merging {len(index)} tickers ({len(arrays["DATE"])} bars)')
+# The chunks are written to a temporary file, which replaces the output at the end
+temporary_path = stock_output_path + '.tmp'
+pd.DataFrame(columns=stock_columns).to_csv(temporary_path, sep=';', encoding='ISO-8859-1', index=False)
+for first in range(0, len(index), tickers_per_chunk):
+    last = min(first + tickers_per_chunk, len(index))
+    with profiler.stage('chunk', rows_in=index['STOP'].iat[last - 1] - index['START'].iat[first]) as chunk_stage:
+        stockData = merge_chunk(first, last)
+        with profiler.stage('save', rows_in=len(stockData)) as save_stage:
+            file_size = os.path.getsize(temporary_path)
+            stockData.to_csv(temporary_path, sep=';', decimal='.', encoding='ISO-8859-1', index=False, mode='a',
+                             header=False)
+            save_stage.bytes_written += os.path.getsize(temporary_path) - file_size
+        chunk_stage.rows_out = len(stockData)
+    print(f'Processed {last}/{len(index)} tickers')
+os.replace(temporary_path, stock_output_path)
+
+profiler.save()
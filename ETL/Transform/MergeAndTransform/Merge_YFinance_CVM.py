@@ -2,14 +2,105 @@
 # 2 - Perform drill across operation on year and year+1 to get the asset appreciation in a given year.
 # 3 - Transform the data to get the final DataFrame with the necessary features.
 
+import os
+import shutil
+import sys
+
 import pandas as pd
 
+sys.path.append('../..')
+from Stage_Profiler import StageProfiler
+from Fill_Features import fill_features
+
+# Update mode:
+# full:     rebuild mergedData.csv, marketData.csv and stockData.csv from all the input data
+# append:   only compute the (TICKER, YEAR, MONTH) rows affected by the input rows that changed since the last run, and
+#           upsert them into the existing outputs. Runs as full if there is no previous run to compare with.
+update_mode = 'full'  # full or append
+
+technical_path = '../../Extract/YFinance/Extracted/technicalData_yf.csv'
+market_path = '../../Extract/YFinance/Extracted/technicalData_BOVA11_yf.csv'
+fundamental_path = '../CVM/Transformed/fundamentalData_CVM.csv'
+merged_path = 'mergedData.csv'
+market_output_path = '../../Load/marketData.csv'
+stock_output_path = '../../Load/stockData.csv'
+
+# Copy of the inputs of the last run, used to find the changed rows in append mode
+snapshot_dir = 'Snapshot'
+
+keys = ['TICKER', 'YEAR', 'MONTH']
+
+# Time, rows, bytes and memory of each stage (see Stage_Profiler.py)
+profiler = StageProfiler('Merge_YFinance_CVM')
+
+
+def snapshot_path(path):
+    return os.path.join(snapshot_dir, os.path.basename(path))
+
+
+def read_input(path):
+    return pd.read_csv(path, sep=';', encoding='ISO-8859-1')
+
+
+# Rows of the new input that are not in the snapshot of the last run, and rows of the snapshot that are no longer in
+# the new input (rows are compared with all their columns, as read from the CSV files)
+def changed_rows(path):
+    new = read_input(path)
+    old = read_input(snapshot_path(path))
+    compared = new.merge(old, how='outer', indicator=True)
+    return compared[compared['_merge'] != 'both'].drop(columns='_merge')
+
+
+# (TICKER, YEAR, MONTH) keys of the changed price rows and of the rows 12 months before, whose future price changed
+def price_keys(changed):
+    dates = pd.to_datetime(changed['DATE'])
+    current = pd.DataFrame({'TICKER': changed['TICKER'], 'YEAR': dates.dt.year, 'MONTH': dates.dt.month})
+    previous = current.assign(YEAR=current['YEAR'] - 1)
+    return pd.concat([current, previous], ignore_index=True).drop_duplicates()
+
+
+# (TICKER, YEAR, MONTH) keys of the rows using changed fundamental data: the row merged with it and the price rows of
+# the ticker filled with it (from 1 to 365 days after DT_REFER, see Fill_Features.py)
+def fundamental_keys(changed, technical_data):
+    dates = pd.to_datetime(changed['DT_REFER'])
+    merged = pd.DataFrame({'TICKER': changed['TICKER'], 'YEAR': dates.dt.year, 'MONTH': dates.dt.month + 1})
+
+    changed = pd.DataFrame({'TICKER': changed['TICKER'], 'DT_REFER': dates}).dropna().drop_duplicates()
+    filled = technical_data[['TICKER', 'DATE', 'YEAR', 'MONTH']].merge(changed, on='TICKER')
+    days = (filled['DATE'] - filled['DT_REFER']).dt.days
+    filled = filled.loc[(days >= 1) & (days <= 365), keys]
+    return pd.concat([merged, filled], ignore_index=True).drop_duplicates()
+
+
+def key_mask(data_frame, affected_keys):
+    return pd.MultiIndex.from_frame(data_frame[keys]).isin(pd.MultiIndex.from_frame(affected_keys[keys]))
+
+
+# Replace the rows of the affected keys in an output file by the new rows, keeping the output sorted by key
+def upsert(path, new_rows, affected_keys, date_columns):
+    old = pd.read_csv(path, sep=';', encoding='ISO-8859-1', parse_dates=date_columns, float_precision='round_trip')
+    old['YEAR'] = old['DATE'].dt.year
+    old['MONTH'] = old['DATE'].dt.month
+    old = old[~key_mask(old, affected_keys)]
+    print(f'Upserting {len(new_rows)} rows into {path} ({len(old)} rows kept)')
+    data_frame = pd.concat([old, new_rows], ignore_index=True)
+    return data_frame.sort_values(keys, kind='stable', ignore_index=True)
+
+
+# Append mode needs the snapshots and outputs of a previous run
+if update_mode == 'append' and not all(os.path.exists(path) for path in
+                                       [snapshot_path(technical_path), snapshot_path(market_path),
+                                        snapshot_path(fundamental_path), merged_path, market_output_path]):
+    print('No previous run found, running in full mode')
+    update_mode = 'full'
+
 ########################################################################################################################
 # Technical Data
 # Retrieve technical data
 print('Processing Technical Data')
-technicalData_yf = pd.read_csv(f'../../Extract/YFinance/Extracted/technicalData_yf.csv', sep=';',
-                               encoding='ISO-8859-1')
+profiler.start('technical').read_file(technical_path)
+technicalData_yf = read_input(technical_path)
+technical_rows = len(technicalData_yf)
 
 # Convert Date to pd.Datetime
 technicalData_yf['DATE'] = pd.to_datetime(technicalData_yf['DATE'])
@@ -31,12 +122,14 @@ technicalData_yf_future = technicalData_yf_future.rename(
 )
 
 technicalData_yf = technicalData_yf.merge(technicalData_yf_future, on=['TICKER', 'YEAR', 'MONTH'], how='left')
+profiler.stop(rows_in=technical_rows, rows_out=len(technicalData_yf))
 
 ########################################################################################################################
 # Get market aprreciation from BOVA11:
-
-technicalData_BOVA11_yf = pd.read_csv(f'../../Extract/YFinance/Extracted/technicalData_BOVA11_yf.csv', sep=';',
-                               encoding='ISO-8859-1')
+market_stage = profiler.start('market')
+market_stage.read_file(market_path)
+technicalData_BOVA11_yf = read_input(market_path)
+market_stage.rows_in = len(technicalData_BOVA11_yf)
 
 # Convert Date to pd.Datetime
 technicalData_BOVA11_yf['DATE'] = pd.to_datetime(technicalData_BOVA11_yf['DATE'])
@@ -68,15 +161,27 @@ technicalData_BOVA11_yf['APPRECIATION'] = \
 # (which are residues from the previous iterations)
 technicalData_BOVA11_yf.dropna(subset=['FUTURE_CLOSE'], how='any', inplace=True)
 
+marketData = technicalData_BOVA11_yf[['TICKER', 'DATE', 'CLOSE', 'FUTURE_CLOSE', 'APPRECIATION']]
+
+# Append mode: only the rows of the changed months and of the months 12 months before them are replaced
+if update_mode == 'append':
+    affected_market_keys = price_keys(changed_rows(market_path))
+    marketData = upsert(market_output_path, technicalData_BOVA11_yf[key_mask(technicalData_BOVA11_yf,
+                                                                             affected_market_keys)],
+                        affected_market_keys, ['DATE'])
+    marketData = marketData[['TICKER', 'DATE', 'CLOSE', 'FUTURE_CLOSE', 'APPRECIATION']]
+
 # Save IBOVESPA data
-technicalData_BOVA11_yf[['TICKER', 'DATE', 'CLOSE', 'FUTURE_CLOSE', 'APPRECIATION']].\
-    to_csv("../../Load/marketData.csv", sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+marketData.to_csv(market_output_path, sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+market_stage.wrote_file(market_output_path)
+profiler.stop(rows_out=len(marketData))
 
 ########################################################################################################################
 # Fundamental Data
 # Retrieve fundamental data
 print('Processing Fundamental Data')
-fundamentalData_CVM = pd.read_csv(f'../CVM/Transformed/fundamentalData_CVM.csv', sep=';', encoding='ISO-8859-1')
+profiler.start('fundamental').read_file(fundamental_path)
+fundamentalData_CVM = read_input(fundamental_path)
 
 # Convert Date to pd.Datetime
 fundamentalData_CVM['DT_REFER'] = pd.to_datetime(fundamentalData_CVM['DT_REFER'])
@@ -86,87 +191,111 @@ fundamentalData_CVM['YEAR'] = fundamentalData_CVM['DT_REFER'].dt.year
 
 # as most dates are from the end of the month, add 1 to month.
 fundamentalData_CVM['MONTH'] = fundamentalData_CVM['DT_REFER'].dt.month + 1
+profiler.stop(rows_out=len(fundamentalData_CVM))
 
 ####################################################################################################################
 # Outer merge Data
-mergedData = technicalData_yf.merge(fundamentalData_CVM, on=['TICKER', 'YEAR', 'MONTH'], how='outer')
+profiler.start('merge', rows_in=len(technicalData_yf) + len(fundamentalData_CVM))
+# Append mode: only the affected rows are merged. The future prices and the fundamental data used to fill the rows
+# still come from all the input data.
+if update_mode == 'append':
+    affected_keys = pd.concat([price_keys(changed_rows(technical_path)),
+                               fundamental_keys(changed_rows(fundamental_path), technicalData_yf)],
+                              ignore_index=True).drop_duplicates()
+    print(f'Affected (TICKER, YEAR, MONTH) rows: {len(affected_keys)}')
+    mergedData = technicalData_yf[key_mask(technicalData_yf, affected_keys)].\
+        merge(fundamentalData_CVM[key_mask(fundamentalData_CVM, affected_keys)], on=['TICKER', 'YEAR', 'MONTH'],
+              how='outer')
+else:
+    mergedData = technicalData_yf.merge(fundamentalData_CVM, on=['TICKER', 'YEAR', 'MONTH'], how='outer')
+profiler.stop(rows_out=len(mergedData))
 
 # List of fundamental features that need to be filled in NaN Spaces
 fundamental_features = ['E', 'EPS', 'CA', 'CL', 'GROSS_DEBT', 'EQUITY', 'D']
 
-
-# Fill NaN in fundamental data where Date difference is within 1 year
-def fill_feature(row, feature, fundamental_data):
-    if pd.isna(row[feature]):
-        ref = fundamental_data[
-            (fundamental_data['TICKER'] == row['TICKER']) &
-            ((row['DATE'] - fundamental_data['DT_REFER']).dt.days <= 365) &
-            ((row['DATE'] - fundamental_data['DT_REFER']).dt.days > 0)
-        ]
-        if not ref.empty:
-            return ref[feature].iloc[-1]  # Take the most recent value within the range
-    return row[feature]
-
-
 # Apply the filling logic to all fundamental features
-for fundamental_feature in fundamental_features:
-    print('Forward filling NaNs for:', fundamental_feature)
-    mergedData[fundamental_feature] = mergedData.apply(
-        lambda row: fill_feature(row, fundamental_feature, fundamentalData_CVM), axis=1
-    )
+mergedData = fill_features(mergedData, fundamentalData_CVM, fundamental_features, profiler)
 
 ####################################################################################################################
 # Calculate other features
 print('Calculating all features')
 
 # Weighted Average Number of Shares
-mergedData['ANS'] = mergedData['E']/mergedData['EPS']
+with profiler.stage('features/ANS'):
+    mergedData['ANS'] = mergedData['E']/mergedData['EPS']
 
 # Price to Earnings Ratio
-mergedData['PE'] = mergedData['MARKET_CAP']/mergedData['E']
+with profiler.stage('features/PE'):
+    mergedData['PE'] = mergedData['MARKET_CAP']/mergedData['E']
 
 # Book Value per Share
-mergedData['BVPS'] = mergedData['EQUITY']/mergedData['ANS']
+with profiler.stage('features/BVPS'):
+    mergedData['BVPS'] = mergedData['EQUITY']/mergedData['ANS']
 
 # Return on Equities
-mergedData['ROE'] = mergedData['E']/mergedData['EQUITY']
+with profiler.stage('features/ROE'):
+    mergedData['ROE'] = mergedData['E']/mergedData['EQUITY']
 
 # Dividend Payout Ratio
-mergedData['DPR'] = -mergedData['D']/mergedData['E']
+with profiler.stage('features/DPR'):
+    mergedData['DPR'] = -mergedData['D']/mergedData['E']
 
 # Dividend Yield
-mergedData['DY'] = -mergedData['D']/mergedData['MARKET_CAP']
+with profiler.stage('features/DY'):
+    mergedData['DY'] = -mergedData['D']/mergedData['MARKET_CAP']
 
 # Price to Book Ratio
-mergedData['PBR'] = mergedData['MARKET_CAP']/mergedData['EQUITY']
+with profiler.stage('features/PBR'):
+    mergedData['PBR'] = mergedData['MARKET_CAP']/mergedData['EQUITY']
 
 # Current Ratio
-mergedData['CURRENT_RATIO'] = mergedData['CA']/mergedData['CL']
+with profiler.stage('features/CURRENT_RATIO'):
+    mergedData['CURRENT_RATIO'] = mergedData['CA']/mergedData['CL']
 
 # 1 Year Asset Appreciation
-mergedData['APPRECIATION'] = mergedData['FUTURE_ADJ_CLOSE']/mergedData['ADJ_CLOSE'] - 1
+with profiler.stage('features/APPRECIATION'):
+    mergedData['APPRECIATION'] = mergedData['FUTURE_ADJ_CLOSE']/mergedData['ADJ_CLOSE'] - 1
 
 # Class
-mergedData['CLASS'] = 0
-mergedData.loc[mergedData['APPRECIATION'] >= 0.8, 'CLASS'] = 1
+with profiler.stage('features/CLASS'):
+    mergedData['CLASS'] = 0
+    mergedData.loc[mergedData['APPRECIATION'] >= 0.8, 'CLASS'] = 1
 
 ####################################################################################################################
 # Clean and save
 print('Cleaning Data')
+profiler.start('clean', rows_in=len(mergedData))
 # Drop rows with NaN values in fundamental data or adjusted close price in next year
 # (which are residues from the previous iterations)
 mergedData.dropna(subset=['E', 'FUTURE_ADJ_CLOSE'], how='any', inplace=True)
 
 # Drop rows with EPS = 0 (ANS will be infinite)
 mergedData = mergedData[mergedData['EPS'] != 0]
+profiler.stop(rows_out=len(mergedData))
+
+# Append mode: replace the affected rows of the last run
+if update_mode == 'append':
+    mergedData = upsert(merged_path, mergedData, affected_keys, ['DATE', 'DT_REFER'])
 
 # Save raw data to CSV
 print('Saving Data')
-mergedData.to_csv("mergedData.csv", sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+save_stage = profiler.start('save')
+mergedData.to_csv(merged_path, sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+save_stage.wrote_file(merged_path)
 
 # Clean unused columns for the final model input
 
 stockData = mergedData[['TICKER', 'DATE', 'PE', 'BVPS', 'ROE', 'DPR', 'DY', 'PBR', 'CA', 'GROSS_DEBT', 'ANS', 
                         'CURRENT_RATIO', 'EPS', 'APPRECIATION', 'CLASS']]
 
-stockData.to_csv("../../Load/stockData.csv", sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+stockData.to_csv(stock_output_path, sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+save_stage.wrote_file(stock_output_path)
+profiler.stop(rows_out=len(stockData))
+
+# Keep a copy of the inputs for the next run in append mode
+with profiler.stage('snapshot'):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for path in [technical_path, market_path, fundamental_path]:
+        shutil.copyfile(path, snapshot_path(path))
+
+profiler.save()
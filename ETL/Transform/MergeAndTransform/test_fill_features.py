@@ -0,0 +1,84 @@
+# Regression test of fill_features (Fill_Features.py) against the row-wise fill_feature it replaced in
+# Merge_YFinance_CVM.py.
+# Run with: python -m pytest ETL/Transform/MergeAndTransform
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+from Stage_Profiler import StageProfiler
+from Fill_Features import fill_features
+
+features = ['E', 'EPS', 'CA']
+
+
+# Row-wise fill of the original script (one apply per feature)
+def fill_feature(row, feature, fundamental_data):
+    if pd.isna(row[feature]):
+        ref = fundamental_data[
+            (fundamental_data['TICKER'] == row['TICKER']) &
+            ((row['DATE'] - fundamental_data['DT_REFER']).dt.days <= 365) &
+            ((row['DATE'] - fundamental_data['DT_REFER']).dt.days > 0)
+        ]
+        if not ref.empty:
+            return ref[feature].iloc[-1]  # Take the most recent value within the range
+    return row[feature]
+
+
+# Fundamental data sorted by ticker and DT_REFER, as written by the CVM transform
+def fundamental_fixture():
+    rows = [
+        # Irregular dates, and a gap of more than 365 days after 2019-03-31
+        ('AAAA3', '2018-03-31', 1.0, 0.1, 10.0),
+        ('AAAA3', '2018-07-15', 2.0, 0.2, 20.0),
+        ('AAAA3', '2019-03-31', 3.0, np.nan, 30.0),
+        ('AAAA3', '2020-09-30', 4.0, 0.4, 40.0),
+        # Duplicate DT_REFER: the last row is used
+        ('AAAA3', '2020-12-31', 5.0, 0.5, 50.0),
+        ('AAAA3', '2020-12-31', 6.0, 0.6, np.nan),
+        ('BBBB4', '2019-06-30', 7.0, 0.7, 70.0),
+        ('BBBB4', '2019-06-30', 8.0, 0.8, 80.0),
+        ('BBBB4', None, 9.0, 0.9, 90.0),
+    ]
+    fundamental_data = pd.DataFrame(rows, columns=['TICKER', 'DT_REFER'] + features)
+    fundamental_data['DT_REFER'] = pd.to_datetime(fundamental_data['DT_REFER'])
+    return fundamental_data
+
+
+# Outer merge of prices and fundamental data: some rows already have features, some have no DATE
+def merged_fixture():
+    dates = ['2018-03-31',  # same day as DT_REFER: not filled
+             '2018-04-01', '2018-07-15', '2018-07-16', '2019-03-31', '2019-04-01',
+             '2020-03-31',  # exactly 366 days after 2019-03-31: not filled
+             '2020-03-30',  # exactly 365 days after 2019-03-31
+             '2020-10-01', '2021-01-01', '2021-12-31', '2022-01-01', '2017-01-02']
+    rows = [('AAAA3', date) for date in dates] + \
+        [('BBBB4', date) for date in ['2019-06-30', '2019-07-01', '2020-06-29', '2020-06-30', '2020-07-01']] + \
+        [('CCCC3', '2019-07-01'), ('AAAA3', None), ('BBBB4', None)]
+    merged_data = pd.DataFrame(rows, columns=['TICKER', 'DATE'])
+    merged_data['DATE'] = pd.to_datetime(merged_data['DATE'])
+    for feature in features:
+        merged_data[feature] = np.nan
+    # Rows with their own fundamental data keep it, features missing in them are still filled
+    merged_data.loc[2, features] = [-1.0, -0.1, -10.0]
+    merged_data.loc[9, 'E'] = -2.0
+    merged_data.loc[len(dates) + 3, 'CA'] = -3.0
+    return merged_data.sample(frac=1, random_state=0)
+
+
+def test_fill_features_matches_row_wise_fill():
+    fundamental_data = fundamental_fixture()
+
+    expected = merged_fixture()
+    for feature in features:
+        expected[feature] = expected.apply(lambda row: fill_feature(row, feature, fundamental_data), axis=1)
+
+    filled = fill_features(merged_fixture(), fundamental_data, features, StageProfiler('test_fill_features'))
+    pdt.assert_frame_equal(filled, expected)
+    # The fixture covers filled and unfilled rows
+    assert filled['E'].notna().sum() > expected.shape[0] // 2
+    assert filled['E'].isna().any()
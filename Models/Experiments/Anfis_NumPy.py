@@ -0,0 +1,111 @@
+# ANFIS implemented with NumPy, as an alternative to the Keras layers of the notebook (see build_anfis in
+# Train_Models.py). The model is the same: gaussian membership functions centered on the subtractive clustering centers,
+# rule strengths (product of the memberships), normalized strengths and linear consequents. The layers are fused in a
+# few matrix products over the batch of samples and all the rules at once:
+# - The log of the rule strengths is -sum_f (x_f - m_fr)^2 / (2 s_fr^2), which expands to
+#   -(X^2 @ A - 2 X @ (M * A) + sum_f M^2 * A), with A = 1 / (2 S^2). No (samples, features, rules) array is built.
+# - The strengths are normalized in log space (softmax), so samples far from every rule center do not give NaN (the
+#   Keras model multiplies the memberships, which underflow to 0 and give 0 / 0).
+# - The backward pass computes the gradients of the mean squared error with the same products.
+# Training uses the optimizer of the notebook (SGD with learning rate 0.01 and Nesterov momentum 0.9, batches of 32
+# shuffled samples, as keras.Model.fit).
+#
+# The parameters are a dictionary with the names of the notebook weights (and of the artifacts of Score_Models.py):
+# means, stds, rule_weights:    (features, rules)
+# biases:                       (rules,)
+
+import numpy as np
+
+from Subtractive_Clustering import subtractive_clustering
+
+parameter_names = ['means', 'stds', 'rule_weights', 'biases']
+
+
+# Initial parameters as the notebook: means on the rule centers, stds of 1, Glorot uniform rule weights and zero biases
+def init_parameters(rule_centers, seed=None):
+    rule_centers = np.asarray(rule_centers, dtype=np.float64)
+    num_features, num_rules = rule_centers.shape
+    limit = np.sqrt(6 / (num_features + num_rules))
+    rng = np.random.default_rng(seed)
+    return {'means': rule_centers.copy(), 'stds': np.ones_like(rule_centers),
+            'rule_weights': rng.uniform(-limit, limit, size=rule_centers.shape), 'biases': np.zeros(num_rules)}
+
+
+# Output of the model for the samples X (samples, features). With keep=True, also returns the intermediate values
+# used by anfis_backward.
+def anfis_forward(parameters, X, keep=False):
+    means = parameters['means']
+    inverse_variances = 0.5 / parameters['stds'] ** 2
+    log_strengths = 2 * (X @ (means * inverse_variances)) - (X * X) @ inverse_variances
+    log_strengths -= (means * means * inverse_variances).sum(axis=0)
+    log_strengths -= log_strengths.max(axis=1, keepdims=True)
+    normalized = np.exp(log_strengths)
+    normalized /= normalized.sum(axis=1, keepdims=True)
+    consequents = X @ parameters['rule_weights'] + parameters['biases']
+    output = (normalized * consequents).sum(axis=1)
+    if keep:
+        return output, (X, normalized, consequents, output)
+    return output
+
+
+# Gradients of the parameters, from the gradient of the loss with respect to the outputs (samples,)
+def anfis_backward(parameters, kept, output_gradient):
+    X, normalized, consequents, output = kept
+    means = parameters['means']
+    stds = parameters['stds']
+
+    # Consequents: output = sum_r normalized_r * consequent_r
+    weighted_gradient = output_gradient[:, np.newaxis] * normalized
+    gradients = {'rule_weights': X.T @ weighted_gradient, 'biases': weighted_gradient.sum(axis=0)}
+
+    # Softmax of the log strengths: d output / d log_strength_r = normalized_r * (consequent_r - output)
+    log_gradient = weighted_gradient * (consequents - output[:, np.newaxis])
+    X_log_gradient = X.T @ log_gradient
+    log_gradient_sum = log_gradient.sum(axis=0)
+    # log_strength_r = -sum_f (x_f - m_fr)^2 / (2 s_fr^2)
+    gradients['means'] = (X_log_gradient - means * log_gradient_sum) / stds ** 2
+    gradients['stds'] = ((X * X).T @ log_gradient - 2 * means * X_log_gradient + means * means * log_gradient_sum) / \
+        stds ** 3
+    return gradients
+
+
+# Output of the model in batches of batch_size samples (bounded memory for any number of samples)
+def anfis_predict(parameters, X, batch_size=65536):
+    X = np.asarray(X, dtype=np.float64)
+    return np.concatenate([anfis_forward(parameters, X[start:start + batch_size])
+                           for start in range(0, len(X), batch_size)] or [np.empty(0)])
+
+
+# Train the parameters on X, y with mean squared error loss and SGD with Nesterov momentum (as keras.optimizers.SGD)
+def train_parameters(parameters, X, y, epochs=100, batch_size=32, learning_rate=0.01, momentum=0.9, seed=None):
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    velocities = {name: np.zeros_like(parameters[name]) for name in parameter_names}
+    losses = []
+    for epoch in range(epochs):
+        order = rng.permutation(len(X))
+        epoch_loss = 0.0
+        for start in range(0, len(X), batch_size):
+            batch = order[start:start + batch_size]
+            output, kept = anfis_forward(parameters, X[batch], keep=True)
+            error = output - y[batch]
+            epoch_loss += float(error @ error)
+            gradients = anfis_backward(parameters, kept, 2 * error / len(batch))
+            for name in parameter_names:
+                velocities[name] *= momentum
+                velocities[name] -= learning_rate * gradients[name]
+                parameters[name] += momentum * velocities[name] - learning_rate * gradients[name]
+        losses.append(epoch_loss / len(X))
+    return parameters, losses
+
+
+# Train an ANFIS on the prepared data (see Prepare_Data.py), as train_anfis of the notebook
+def fit_numpy_anfis(prepared, seed, epochs=100, num_rules=2, radius=0.2, batch_size=32):
+    rule_centers = prepared.get('rule_centers')
+    if rule_centers is None:
+        rule_centers = subtractive_clustering(prepared['X_train'], num_rules, radius=radius)
+    parameters = init_parameters(rule_centers, seed)
+    parameters, _ = train_parameters(parameters, prepared['X_train_balanced'], prepared['y_train_balanced'], epochs,
+                                     batch_size, seed=seed)
+    return parameters
@@ -0,0 +1,88 @@
+# CPU throughput of the ANFIS implementations: the Keras model of the notebook (build_anfis in Train_Models.py) and the
+# fused NumPy implementation (Anfis_NumPy.py).
+# Both are trained from the same initial parameters on the prepared ANFIS data (or on random samples with --samples),
+# with batches of 32 samples, and predict the test data. The throughput is given in samples per second:
+# TRAIN:        samples of the training epochs per second
+# PREDICT:      samples per second of the prediction of the test data (Keras: model.predict, as the notebook)
+# The mean squared error of the last epoch of each implementation is shown, to compare the trainings.
+#
+# Usage: python Benchmark_Anfis.py [--epochs 3] [--samples N] [--threads 1]
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from Anfis_NumPy import parameter_names, init_parameters, train_parameters, anfis_predict
+from Prepare_Data import stock_data_path, prepared_data
+from Subtractive_Clustering import subtractive_clustering
+from Train_Models import configure_tensorflow, build_anfis
+
+
+# Train and test arrays: prepared ANFIS data, or random samples (samples train rows and samples // 4 test rows)
+def benchmark_data(path=stock_data_path, samples=None, num_rules=2, seed=0):
+    if samples:
+        rng = np.random.default_rng(seed)
+        X_train = rng.normal(size=(samples, 11))
+        y_train = rng.integers(0, 2, samples).astype(np.float64)
+        X_test = rng.normal(size=(samples // 4, 11))
+        rule_centers = subtractive_clustering(X_train, num_rules)
+    else:
+        prepared = prepared_data('ANFIS', path)
+        X_train, y_train = prepared['X_train_balanced'], prepared['y_train_balanced']
+        X_test = prepared['X_test']
+        rule_centers = subtractive_clustering(prepared['X_train'], num_rules)
+    return np.asarray(X_train), np.asarray(y_train, dtype=np.float64), np.asarray(X_test), rule_centers
+
+
+def time_call(function, repeats=1):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return (time.perf_counter() - start_time) / repeats, result
+
+
+def benchmark(epochs=3, path=stock_data_path, samples=None, num_rules=2, seed=0, predict_repeats=5):
+    X_train, y_train, X_test, rule_centers = benchmark_data(path, samples, num_rules, seed)
+    initial = init_parameters(rule_centers, seed)
+    results = []
+
+    # Keras model of the notebook
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(seed)
+    keras_model = build_anfis(X_train.shape[1], num_rules, rule_centers)
+    keras_model.set_weights([initial[name].astype(np.float32) for name in parameter_names])
+    keras_model.predict(X_test[:32], verbose=0)
+    train_seconds, history = time_call(lambda: keras_model.fit(X_train, y_train, epochs=epochs, batch_size=32,
+                                                               verbose=0))
+    predict_seconds, _ = time_call(lambda: keras_model.predict(X_test, verbose=0), predict_repeats)
+    results.append({'IMPLEMENTATION': 'Keras', 'TRAIN': epochs * len(X_train) / train_seconds,
+                    'PREDICT': len(X_test) / predict_seconds, 'LOSS': history.history['loss'][-1]})
+
+    # Fused NumPy implementation
+    parameters = {name: value.copy() for name, value in initial.items()}
+    train_seconds, (parameters, losses) = time_call(lambda: train_parameters(parameters, X_train, y_train, epochs,
+                                                                             seed=seed))
+    predict_seconds, _ = time_call(lambda: anfis_predict(parameters, X_test), predict_repeats)
+    results.append({'IMPLEMENTATION': 'NumPy', 'TRAIN': epochs * len(X_train) / train_seconds,
+                    'PREDICT': len(X_test) / predict_seconds, 'LOSS': losses[-1]})
+
+    results = pd.DataFrame(results).set_index('IMPLEMENTATION')
+    results.loc['Speedup'] = results.loc['NumPy'] / results.loc['Keras']
+    results.loc['Speedup', 'LOSS'] = np.nan
+    return results, len(X_train), len(X_test)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CPU throughput of the Keras and NumPy ANFIS')
+    parser.add_argument('--epochs', type=int, default=3, help='training epochs')
+    parser.add_argument('--samples', type=int, default=None, help='random train samples instead of stockData')
+    parser.add_argument('--threads', type=int, default=None, help='threads of TensorFlow')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the initial parameters')
+    args = parser.parse_args()
+
+    configure_tensorflow(args.threads)
+    benchmark_results, train_rows, test_rows = benchmark(args.epochs, samples=args.samples, seed=args.seed)
+    print(f'ANFIS throughput (samples/s): {train_rows} train rows, {test_rows} test rows, {args.epochs} epochs')
+    print(benchmark_results.to_string(float_format=lambda x: f'{x:,.4g}'))
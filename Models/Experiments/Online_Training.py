@@ -0,0 +1,288 @@
+# Online (incremental) training of the logistic regression and the MLP.
+# The model notebooks train from scratch on all the (upsampled) rows until the cutoff year, so one more month of
+# stockData.csv costs a full training. Here a model is trained once (init) and then updated (update) with the rows of
+# stockData.csv that were not used before (new TICKER and DATE pairs), i.e. every month after the ETL runs:
+# - The scaler is kept as running statistics (number of rows, mean and variance of each feature), merged with the
+#   statistics of the new rows. The first layer of the model (LR coefficients, first dense layer of the MLP) is
+#   rewritten for the new scaler, so the model gives the same signals as before the update for the same rows.
+# - The outlier bounds are computed on the rows of the init (as Prepare_Data.py) and used for the rows of the updates.
+# - Classes are balanced with sample weights from the running class counts, instead of upsampling class 1.
+# - The LR is trained with lbfgs at init and updated with minibatch SGD steps on the weighted log loss (as partial_fit).
+#   The MLP is warm started from the weights of the last update and trained on the new rows for a few epochs.
+# - The cutoff of the signals is chosen on all the rows used for training (where the true positive and true negative
+#   rates cross, as in Run_Backtest.py).
+# The state of a model is saved in Online/<model> as an artifact of Score_Models.py (artifact.json and weights.npz),
+# with the running statistics in online.json and the TICKER and DATE of the rows used in trained_rows.parquet, so it
+# can be scored and served with Score_Models.py.
+#
+# Usage:
+# python Online_Training.py init --model LR [--until 2021-12] [--seed 0] [--epochs N] [--state Online/LR]
+# python Online_Training.py update --model LR [--until 2022-01] [--epochs N] [--state Online/LR]
+
+import argparse
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from Prepare_Data import stock_data_path, features, model_settings, read_stock_data, outlier_bounds_std, \
+    outlier_bounds_iqr
+from Score_Models import save_artifact, load_artifact, lr_signal, signal_functions
+from Train_Models import build_mlp, crossing_cutoff
+
+online_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Online')
+
+online_models = ['MLP', 'LR']
+
+# Epochs of the init (None: the LR is trained with lbfgs) and of each update
+init_epochs = {'MLP': 500, 'LR': None}
+update_epochs = {'MLP': 10, 'LR': 5}
+
+# SGD steps of the LR updates
+learning_rate = 0.01
+batch_size = 32
+l2_penalty = 1e-4
+
+keys = ['TICKER', 'DATE']
+mlp_weight_names = ['kernel_1', 'bias_1', 'kernel_2', 'bias_2']
+
+
+########################################################################################################################
+# Running statistics
+
+# Number of rows, mean and variance of the features, merged with the statistics of the rows X
+def merge_statistics(count, mean, var, X):
+    if len(X) == 0:
+        return count, mean, var
+    total = count + len(X)
+    delta = X.mean(axis=0) - mean
+    merged_mean = mean + delta * len(X) / total
+    merged_var = (var * count + X.var(axis=0) * len(X) + delta ** 2 * count * len(X) / total) / total
+    return total, merged_mean, merged_var
+
+
+# Scale of the features (as StandardScaler: features without variance are not scaled)
+def statistics_scale(var):
+    scale = np.sqrt(var)
+    return np.where(scale == 0, 1, scale)
+
+
+# Kernel and bias of the first layer for the inputs scaled with the new mean and scale, with the same outputs as the
+# kernel and bias for the inputs scaled with the old mean and scale
+def rescale_first_layer(kernel, bias, old_mean, old_scale, new_mean, new_scale):
+    rescaled_kernel = ((new_scale / old_scale) * kernel.T).T
+    return rescaled_kernel, bias + ((new_mean - old_mean) / old_scale) @ kernel
+
+
+def rescale_weights(model, weights, old_mean, old_scale, new_mean, new_scale):
+    weights = dict(weights)
+    first_layer = ['coef', 'intercept'] if model == 'LR' else ['kernel_1', 'bias_1']
+    weights[first_layer[0]], weights[first_layer[1]] = rescale_first_layer(
+        weights[first_layer[0]], weights[first_layer[1]], old_mean, old_scale, new_mean, new_scale)
+    return weights
+
+
+# Sample weights that balance the classes, from the class counts (negative, positive) of all the rows used
+def class_weights(y, class_counts):
+    counts = np.maximum(np.array(class_counts, dtype=float), 1)
+    weights = counts.sum() / (2 * counts)
+    return np.where(y == 1, weights[1], weights[0])
+
+
+########################################################################################################################
+# Rows
+
+# Outlier bounds of each outlier column, computed one column after the other (as prepare_split)
+def train_outlier_bounds(data_train, model, method='iqr', factor=9):
+    settings = model_settings[model]
+    if settings['replace_inf']:
+        data_train = data_train.replace(np.inf, 1e20)
+    bounds_function = outlier_bounds_std if method == 'std' else outlier_bounds_iqr
+    bounds = {}
+    for column in settings['outlier_columns']:
+        lower_bound, upper_bound = bounds_function(data_train, column, factor)
+        bounds[column] = [float(lower_bound), float(upper_bound)]
+        data_train = data_train[(data_train[column] >= lower_bound) & (data_train[column] <= upper_bound)]
+    return bounds
+
+
+# Features and classes of the rows inside the outlier bounds
+def model_inputs(rows, model, bounds):
+    settings = model_settings[model]
+    if settings['replace_inf']:
+        rows = rows.replace(np.inf, 1e20)
+    inside = np.ones(len(rows), dtype=bool)
+    for column, (lower_bound, upper_bound) in bounds.items():
+        inside &= ((rows[column] >= lower_bound) & (rows[column] <= upper_bound)).to_numpy()
+    rows = rows[inside]
+    X = rows[features].to_numpy(dtype=float)
+    y = rows['CLASS'].replace(0, settings['negative_class']).to_numpy().astype(int)
+    return X, y
+
+
+# Rows of the data whose TICKER and DATE are in the trained rows
+def trained_mask(data, trained_rows):
+    compared = data[keys].merge(trained_rows.drop_duplicates(), on=keys, how='left', indicator=True)
+    return (compared['_merge'] == 'both').to_numpy()
+
+
+########################################################################################################################
+# Training
+
+# Minibatch SGD steps on the weighted log loss (with L2 penalty), starting from the weights
+def lr_partial_fit(weights, X, y, sample_weight, epochs, seed):
+    rng = np.random.default_rng(seed)
+    coef, intercept = weights['coef'].copy(), weights['intercept'].copy()
+    target = (y == 1).astype(float)
+    for _ in range(epochs):
+        order = rng.permutation(len(X))
+        for start in range(0, len(X), batch_size):
+            batch = order[start:start + batch_size]
+            error = (lr_signal({'coef': coef, 'intercept': intercept}, X[batch]) - target[batch]) * sample_weight[batch]
+            coef -= learning_rate * (X[batch].T @ error / len(batch) + l2_penalty * coef)
+            intercept -= learning_rate * error.mean()
+    return {'coef': coef, 'intercept': intercept}
+
+
+# Train the LR (lbfgs without weights, SGD steps from the weights) on the scaled features X
+def train_lr(weights, X, y, sample_weight, epochs, seed):
+    if weights is not None:
+        return lr_partial_fit(weights, X, y, sample_weight, epochs, seed)
+    from sklearn.linear_model import LogisticRegression
+    LR = LogisticRegression(solver='lbfgs', max_iter=1000)
+    LR.fit(X, y, sample_weight=sample_weight)
+    return {'coef': LR.coef_[0], 'intercept': LR.intercept_}
+
+
+# Train the MLP of the notebook on the scaled features X, starting from the weights (if any)
+def train_mlp(weights, X, y, sample_weight, epochs, seed):
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(seed)
+    MLP = build_mlp(len(features))
+    if weights is not None:
+        MLP.set_weights([weights[name] for name in mlp_weight_names])
+    MLP.fit(X, y, sample_weight=sample_weight, epochs=epochs, verbose=0)
+    return dict(zip(mlp_weight_names, MLP.get_weights()))
+
+
+train_functions = {'MLP': train_mlp, 'LR': train_lr}
+
+
+# Cutoff where the true positive and true negative rates of the signals of the scaled features X cross
+def train_cutoff(model, weights, X, y):
+    signal = signal_functions[model](weights, X)
+    cutoff_points = np.linspace(-1, 1, 100) if model == 'MLP' else np.linspace(signal.min(), signal.max(), 100)
+    return crossing_cutoff(signal, y, cutoff_points, model_settings[model]['negative_class'])
+
+
+########################################################################################################################
+# State
+
+def new_state(model, seed=0, method='iqr', factor=9):
+    return {'model': model, 'seed': seed, 'method': method, 'factor': factor, 'bounds': None, 'count': 0,
+            'mean': [0.0] * len(features), 'var': [0.0] * len(features), 'class_counts': [0, 0], 'updates': 0}
+
+
+def load_state(path):
+    with open(os.path.join(path, 'online.json'), 'r', encoding='utf-8') as f:
+        online = json.load(f)
+    artifact = load_artifact(path)
+    trained_rows = pd.read_parquet(os.path.join(path, 'trained_rows.parquet'))
+    return online, artifact['weights'], trained_rows
+
+
+def save_state(path, online, weights, trained_rows, cutoff, info):
+    scaler = SimpleNamespace(mean_=np.array(online['mean']), scale_=statistics_scale(np.array(online['var'])))
+    save_artifact(path, online['model'], weights, scaler, cutoff, info)
+    with open(os.path.join(path, 'online.json'), 'w', encoding='utf-8') as f:
+        json.dump(online, f, indent=2)
+    trained_rows.to_parquet(os.path.join(path, 'trained_rows.parquet'), index=False)
+
+
+# Train the model of the state on the rows of the data that were not used before, with DATE until the month until (all
+# the rows if None). The state is started again if init is True. Returns the information saved in the artifact, or
+# None if there are no new rows.
+def update_state(path, data, model, until=None, epochs=None, init=False, seed=0, method='iqr', factor=9):
+    start_time = time.time()
+    if init or not os.path.exists(os.path.join(path, 'online.json')):
+        online, weights, trained_rows = new_state(model, seed, method, factor), None, data[keys].iloc[:0]
+    else:
+        online, weights, trained_rows = load_state(path)
+        if online['model'] != model:
+            raise ValueError(f'{path}: state of the {online["model"]} model, not {model}')
+
+    trained = trained_mask(data, trained_rows)
+    arrived = ~trained
+    if until:
+        arrived &= (data['DATE'].dt.to_period('M') <= pd.Period(until, freq='M')).to_numpy()
+    rows = data[arrived]
+    if rows.empty:
+        return None
+
+    if online['bounds'] is None:
+        if rows['CLASS'].nunique() < 2:
+            raise ValueError('only one class in the rows of the init')
+        online['bounds'] = train_outlier_bounds(rows, model, online['method'], online['factor'])
+    X, y = model_inputs(rows, model, online['bounds'])
+
+    # Running statistics of the features (the weights are rewritten for the new scaler) and class counts
+    old_mean, old_scale = np.array(online['mean']), statistics_scale(np.array(online['var']))
+    count, mean, var = merge_statistics(online['count'], old_mean, np.array(online['var']), X)
+    scale = statistics_scale(var)
+    if weights is not None:
+        weights = rescale_weights(model, weights, old_mean, old_scale, mean, scale)
+    class_counts = [online['class_counts'][0] + int((y != 1).sum()), online['class_counts'][1] + int((y == 1).sum())]
+
+    if epochs is None:
+        epochs = init_epochs[model] if weights is None else update_epochs[model]
+    if len(X):
+        weights = train_functions[model](weights, (X - mean) / scale, y, class_weights(y, class_counts), epochs,
+                                         online['seed'] + online['updates'])
+
+    # Cutoff on all the rows used for training
+    X_trained, y_trained = model_inputs(data[trained | arrived], model, online['bounds'])
+    cutoff = train_cutoff(model, weights, (X_trained - mean) / scale, y_trained)
+
+    online.update({'count': int(count), 'mean': mean.tolist(), 'var': var.tolist(), 'class_counts': class_counts,
+                   'updates': online['updates'] + 1})
+    trained_rows = pd.concat([trained_rows, rows[keys]], ignore_index=True)
+    info = {'seed': online['seed'], 'updates': online['updates'], 'epochs': epochs, 'until': until,
+            'last_date': str(rows['DATE'].max().date()), 'new_rows': len(rows), 'train_rows': len(X),
+            'rows': online['count'], 'class_counts': class_counts, 'seconds': time.time() - start_time}
+    save_state(path, online, weights, trained_rows, cutoff, info)
+    return info
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the LR and the MLP incrementally on the new rows')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    init_parser = commands.add_parser('init', help='train a model from scratch and start its state')
+    update_parser = commands.add_parser('update', help='train a model on the rows not used before')
+    for command_parser in [init_parser, update_parser]:
+        command_parser.add_argument('--model', default='MLP', choices=online_models, help='model to train')
+        command_parser.add_argument('--until', default=None, help='last month of the rows to use (YYYY-MM)')
+        command_parser.add_argument('--epochs', type=int, default=None, help='epochs (default: init_epochs and '
+                                                                             'update_epochs)')
+        command_parser.add_argument('--state', default=None, help='state folder (default: Online/<model>)')
+        command_parser.add_argument('--input', default=stock_data_path, help='stockData.csv file')
+    init_parser.add_argument('--seed', type=int, default=0, help='seed of the training')
+    init_parser.add_argument('--method', default='iqr', choices=['iqr', 'std'], help='outlier method')
+    init_parser.add_argument('--factor', type=float, default=9, help='outlier factor')
+    args = parser.parse_args()
+
+    state_path = args.state or os.path.join(online_dir, args.model)
+    stock_data = read_stock_data(args.input)
+    if args.command == 'init':
+        update_info = update_state(state_path, stock_data, args.model, args.until, args.epochs, True, args.seed,
+                                   args.method, args.factor)
+    else:
+        update_info = update_state(state_path, stock_data, args.model, args.until, args.epochs)
+    if update_info is None:
+        print(f'{args.model}: no new rows')
+    else:
+        print(f'{args.model} saved to {state_path}: {update_info["new_rows"]} new rows ({update_info["train_rows"]} '
+              f'without outliers), {update_info["rows"]} rows in total, {update_info["seconds"]:.2f} s')
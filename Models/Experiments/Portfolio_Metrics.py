@@ -0,0 +1,194 @@
+# Metrics of the monthly portfolios of the models.
+# The predictions are frames with the rows of stockData and the SIGNAL and CLASS_PRED columns (as saved by the model
+# notebooks, Run_Experiments.py and Run_Backtest.py). Every month, the portfolio of a model holds the assets predicted
+# as class 1, with equal weights, so its return is the average APPRECIATION of these assets. The metrics are computed
+# with grouped operations over the months (no loop over the years and months).
+#
+# The metrics of many runs (i.e. the 100 experiments of hipotesysTest.ipynb) are computed at once: the predictions of
+# all the runs are concatenated in one frame with a run column (see read_predictions), and the functions group by it.
+# The monthly returns of the runs are kept as a table with one column per run, so the cumulative returns, drawdowns and
+# Sharpe ratios are column-wise operations over all the runs.
+#
+# APPRECIATION is the appreciation in the next 12 months, so the portfolios of consecutive months overlap. To compound
+# them, the appreciation of each portfolio is converted to its equivalent monthly rate ((1 + APPRECIATION)^(1/12) - 1),
+# as if each month's portfolio was held for one month at the average rate of its 12 months. The market (BOVA11) is
+# compounded the same way.
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Average appreciation of the portfolio of each model and of the market (BOVA11) in each month
+# predictions:      dictionary {model name: predictions}
+# months:           months of the result (default: the months of the predictions)
+# Returns a DataFrame with the columns DATE (first date of the month in the predictions), one column per model and
+# MARKET, sorted by DATE. Months without assets predicted as class 1 have NaN returns.
+def monthly_portfolio_returns(predictions, market_data, months=None):
+    frames = list(predictions.values())
+    if months is None:
+        months = pd.concat([frame['DATE'].dt.to_period('M') for frame in frames]).unique()
+    months = pd.PeriodIndex(months, freq='M').sort_values()
+
+    # Reference date of each month: the first date of the month in the predictions
+    dates = pd.concat([frame['DATE'] for frame in frames], ignore_index=True)
+    first_dates = dates.groupby(dates.dt.to_period('M')).first().reindex(months)
+    returns = pd.DataFrame({'DATE': first_dates.fillna(pd.Series(months.to_timestamp(), index=months))})
+
+    for model, frame in predictions.items():
+        selected = frame[frame['CLASS_PRED'] == 1]
+        returns[model] = selected.groupby(selected['DATE'].dt.to_period('M'))['APPRECIATION'].mean()
+
+    market_months = market_data['DATE'].dt.to_period('M')
+    returns['MARKET'] = market_data.groupby(market_months)['APPRECIATION'].mean()
+    return returns.sort_values('DATE').reset_index(drop=True)
+
+
+# Number of months in which each model's portfolio had a higher appreciation than the market
+def months_outperforming(returns, models):
+    return returns[models].gt(returns['MARKET'], axis=0).sum()
+
+
+# Read the predictions saved by Run_Experiments.py (--predictions-dir) as one frame, with the EXPERIMENT column
+def read_predictions(predictions_dir, model):
+    paths = sorted(glob.glob(os.path.join(predictions_dir, f'{model}_*.csv')))
+    experiments = [int(os.path.splitext(os.path.basename(path))[0].rsplit('_', 1)[1]) for path in paths]
+    predictions = pd.concat([pd.read_csv(path, header=0, sep=';') for path in paths], keys=experiments,
+                            names=['EXPERIMENT', None]).reset_index(level=0).reset_index(drop=True)
+    predictions['DATE'] = pd.to_datetime(predictions['DATE'])
+    return predictions
+
+
+def run_keys(run_column):
+    if run_column is None:
+        return []
+    return [run_column] if isinstance(run_column, str) else list(run_column)
+
+
+########################################################################################################################
+# Signal metrics
+
+# Average appreciation of the top X% signals, for each percentage (results.ipynb). Each run is sorted once and the
+# averages of all the percentages come from the cumulative sum of the sorted appreciations.
+# Returns a Series indexed by the percentages, or a DataFrame with one row per run and one column per percentage.
+# The average of the top 0% (no assets) is NaN.
+def top_signal_curve(predictions, percentages=np.linspace(0, 100, 101), run_column=None):
+    keys = run_keys(run_column)
+    ordered = predictions.sort_values(keys + ['SIGNAL'], ascending=[True] * len(keys) + [False], kind='stable')
+    percentages = np.asarray(percentages, dtype=float)
+
+    if keys:
+        groups = ordered.groupby(keys, sort=False)
+        sizes = groups.size()
+        cumulative = groups['APPRECIATION'].cumsum().to_numpy()
+    else:
+        sizes = pd.Series([len(ordered)])
+        cumulative = ordered['APPRECIATION'].cumsum().to_numpy()
+    starts = np.concatenate([[0], np.cumsum(sizes.to_numpy())[:-1]])
+
+    # Number of assets in the top X% of each run: (runs, percentages)
+    counts = (sizes.to_numpy()[:, np.newaxis] * (percentages / 100)).astype(int)
+    positions = starts[:, np.newaxis] + np.maximum(counts, 1) - 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = np.where(counts > 0, cumulative[positions] / counts, np.nan)
+
+    if not keys:
+        return pd.Series(averages[0], index=percentages)
+    return pd.DataFrame(averages, index=sizes.index, columns=percentages)
+
+
+# Share of class 1 assets among the k highest signals, in each group of the predictions (i.e. each run, or each run and
+# month with run_column=['EXPERIMENT', 'DATE'])
+def precision_at_k(predictions, k, run_column=None):
+    keys = run_keys(run_column)
+    if keys:
+        ranks = predictions.groupby(keys)['SIGNAL'].rank(method='first', ascending=False)
+    else:
+        ranks = predictions['SIGNAL'].rank(method='first', ascending=False)
+    top = predictions[ranks <= k]
+    hits = top['CLASS'] == 1
+    if not keys:
+        return hits.mean()
+    return hits.groupby([top[key] for key in keys]).mean()
+
+
+# Share of the assets predicted as class 1 that are class 1, in each month (and run)
+# Returns a table with one row per month (DATE, first day of the month) and one column per run
+def hit_rate_by_month(predictions, run_column=None):
+    selected = predictions[predictions['CLASS_PRED'] == 1]
+    return monthly_table(selected['CLASS'] == 1, selected, run_column)
+
+
+########################################################################################################################
+# Portfolio metrics
+
+# Table with one row per month (DATE, first day of the month) and one column per run of the mean of values
+def monthly_table(values, predictions, run_column=None, name='PORTFOLIO'):
+    keys = run_keys(run_column)
+    month = predictions['DATE'].dt.to_period('M').dt.to_timestamp().rename('DATE')
+    table = values.groupby([month] + [predictions[key] for key in keys]).mean()
+    if not keys:
+        return table.to_frame(name)
+    return table.unstack(keys)
+
+
+# Appreciation of the portfolio of each month: one row per month and one column per run
+def portfolio_returns(predictions, run_column=None, name='PORTFOLIO'):
+    selected = predictions[predictions['CLASS_PRED'] == 1]
+    return monthly_table(selected['APPRECIATION'], selected, run_column, name)
+
+
+# Appreciation of the market (BOVA11) in each month
+def market_returns(market_data):
+    month = market_data['DATE'].dt.to_period('M').dt.to_timestamp().rename('DATE')
+    return market_data.groupby(month)['APPRECIATION'].mean().rename('MARKET')
+
+
+# Equivalent monthly rate of the 12 month appreciations
+def monthly_rates(returns):
+    return (1 + returns) ** (1 / 12) - 1
+
+
+# Cumulative return of the monthly returns of each column. Months without a portfolio (NaN) have no return.
+def cumulative_returns(returns):
+    return (1 + monthly_rates(returns).fillna(0)).cumprod() - 1
+
+
+# Drawdown of each month: loss from the highest value reached until the month
+def drawdowns(returns):
+    wealth = 1 + cumulative_returns(returns)
+    return wealth / wealth.cummax().clip(lower=1) - 1
+
+
+# Annualized Sharpe ratio of the monthly rates (risk_free: monthly risk free rate)
+def sharpe_ratio(returns, risk_free=0):
+    excess = monthly_rates(returns) - risk_free
+    return excess.mean() / excess.std() * np.sqrt(12)
+
+
+# Metrics of the portfolio of each run, compared to the market in the same months
+# Returns a DataFrame with one row per run
+def portfolio_summary(predictions, market_data, run_column=None, k=10, risk_free=0):
+    returns = portfolio_returns(predictions, run_column)
+    market = market_returns(market_data).reindex(returns.index)
+    cumulative = cumulative_returns(returns).iloc[-1]
+    market_cumulative = cumulative_returns(market).iloc[-1]
+
+    summary = pd.DataFrame({
+        'MONTHS': returns.notna().sum(),
+        'PORTFOLIO_APPRECIATION': returns.mean(),
+        'MARKET_APPRECIATION': market.mean(),
+        'MONTHS_OUTPERFORMING': returns.gt(market, axis=0).sum(),
+        'CUMULATIVE_RETURN': cumulative,
+        'MARKET_CUMULATIVE_RETURN': market_cumulative,
+        'EXCESS_CUMULATIVE_RETURN': cumulative - market_cumulative,
+        'MAX_DRAWDOWN': drawdowns(returns).min(),
+        'MARKET_MAX_DRAWDOWN': drawdowns(market).min(),
+        'SHARPE': sharpe_ratio(returns, risk_free),
+        'MARKET_SHARPE': sharpe_ratio(market, risk_free),
+        'HIT_RATE': hit_rate_by_month(predictions, run_column).mean(),
+    })
+    summary[f'PRECISION_AT_{k}'] = precision_at_k(predictions, k, run_column)
+    return summary
@@ -0,0 +1,189 @@
+# Data preparation shared by the model notebooks and the experiments: split train and test data on a cutoff year, remove
+# outliers, scale the features and upsample class 1 in the train data.
+# The prepared data is cached for each version of stockData.csv (SHA-256 of its content) and settings (cutoff year,
+# outlier policy, seed and model settings). The arrays are stored as .npy files and loaded as read-only memory maps, so
+# the notebooks and every process of an experiment run share them without preparing the data again.
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from sklearn.utils import resample, shuffle
+
+stock_data_path = '../../ETL/Load/stockData.csv'
+
+# Model inputs (stockData.csv columns between DATE and APPRECIATION)
+features = ['PE', 'BVPS', 'ROE', 'DPR', 'DY', 'PBR', 'CA', 'GROSS_DEBT', 'ANS', 'CURRENT_RATIO', 'EPS']
+
+# Settings of each model notebook (the logistic regression prepares the data as the ANFIS):
+# negative_class:   label of class 0 (the MLP uses -1 for its tanh output)
+# outlier_columns:  columns the outliers are removed on
+# replace_inf:      replace inf values by 1e20 before removing the outliers
+model_settings = {
+    'MLP': {'negative_class': -1, 'outlier_columns': features, 'replace_inf': True},
+    'ANFIS': {'negative_class': 0, 'outlier_columns': features + ['APPRECIATION'], 'replace_inf': False},
+    'LR': {'negative_class': 0, 'outlier_columns': features + ['APPRECIATION'], 'replace_inf': False},
+}
+
+# Prepared data of each version of stockData.csv and settings
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Cache')
+array_names = ['X_train', 'X_train_balanced', 'y_train_balanced', 'X_test', 'y_test']
+frame_names = ['data_train', 'data_test']
+
+
+def read_stock_data(path=stock_data_path):
+    data = pd.read_csv(path, header=0, sep=';')
+    data['DATE'] = pd.to_datetime(data['DATE'])
+    return data
+
+
+# Bounds of the values of a column (outside of them are outliers) using std
+def outlier_bounds_std(data_train, column, factor=3):
+    data_std = data_train[column].std()
+    data_mean = data_train[column].mean()
+    return data_mean - factor * data_std, data_mean + factor * data_std
+
+
+# Bounds of the values of a column (outside of them are outliers) using IQR
+def outlier_bounds_iqr(data_train, column, factor=1.5):
+    Q1 = data_train[column].quantile(0.25)
+    Q3 = data_train[column].quantile(0.75)
+    IQR = Q3 - Q1
+    return Q1 - factor * IQR, Q3 + factor * IQR
+
+
+# Function to remove outliers using std
+def remove_outliers_std(data_train, data_test, column, factor=3):
+    lower_bound, upper_bound = outlier_bounds_std(data_train, column, factor)
+    data_train = data_train[(data_train[column] >= lower_bound) & (data_train[column] <= upper_bound)]
+    data_test = data_test[(data_test[column] >= lower_bound) & (data_test[column] <= upper_bound)]
+    return data_train, data_test
+
+
+# Function to remove outliers using IQR
+def remove_outliers_iqr(data_train, data_test, column, factor=1.5):
+    lower_bound, upper_bound = outlier_bounds_iqr(data_train, column, factor)
+    data_train = data_train[(data_train[column] >= lower_bound) & (data_train[column] <= upper_bound)]
+    data_test = data_test[(data_test[column] >= lower_bound) & (data_test[column] <= upper_bound)]
+    return data_train, data_test
+
+
+# Scaler of the features, fitted on the train data (without outliers)
+def fit_scaler(data_train):
+    return StandardScaler().fit(data_train[features].to_numpy(dtype=float))
+
+
+# Split train and test data on cutoff_year, remove outliers, scale the features and upsample class 1 in the train data
+# Returns a dictionary with:
+# X_train:                  scaled train features (before upsampling, used for the ANFIS rule centers)
+# X_train_balanced, y_train_balanced:   upsampled and shuffled train data
+# X_test, y_test:           scaled test features and classes
+# data_train, data_test:   train and test rows of stockData (without outliers)
+def prepare_data(data, model, cutoff_year=2021, method='iqr', factor=9, random_state=42):
+    # Separate train and test data
+    data_train = data[data['DATE'].dt.year <= cutoff_year]
+    data_test = data[data['DATE'].dt.year > cutoff_year]
+    return prepare_split(data_train, data_test, model, method, factor, random_state)
+
+
+# Prepare train and test rows already separated (i.e. by the walk-forward backtest, see Run_Backtest.py)
+# train_only_columns:   outlier columns whose bounds only remove train rows. The walk-forward backtest passes
+#                       ['APPRECIATION'], as the appreciation of the predicted rows is not known at the origin.
+def prepare_split(data_train, data_test, model, method='iqr', factor=9, random_state=42, train_only_columns=()):
+    settings = model_settings[model]
+    if settings['replace_inf']:
+        # Replace inf values by very large number
+        data_train = data_train.replace(np.inf, 1e20)
+        data_test = data_test.replace(np.inf, 1e20)
+
+    # Clean outliers from data
+    remove_outliers = remove_outliers_std if method == 'std' else remove_outliers_iqr
+    for column in settings['outlier_columns']:
+        if column in train_only_columns:
+            data_train, _ = remove_outliers(data_train, data_train, column, factor)
+        else:
+            data_train, data_test = remove_outliers(data_train, data_test, column, factor)
+
+    # Scale the data
+    scaler = fit_scaler(data_train)
+    X_train = scaler.transform(data_train[features].to_numpy(dtype=float))
+    X_test = scaler.transform(data_test[features].to_numpy(dtype=float))
+
+    # Classes (0 is replaced by the negative class of the model)
+    y_train = data_train['CLASS'].replace(0, settings['negative_class']).to_numpy().astype(int)
+    y_test = data_test['CLASS'].replace(0, settings['negative_class']).to_numpy().astype(int)
+
+    # Upsample 1 Class: resample minority class to match the majority class size
+    X_train_frame = pd.DataFrame(X_train)
+    y_train_series = pd.Series(y_train)
+    majority = y_train_series != 1
+    X_train_minority_upsampled = resample(X_train_frame[~majority], replace=True, n_samples=int(majority.sum()),
+                                          random_state=random_state)
+    y_train_minority_upsampled = resample(y_train_series[~majority], replace=True, n_samples=int(majority.sum()),
+                                          random_state=random_state)
+
+    # Combine majority class and upsampled minority class and shuffle the data
+    X_train_balanced = pd.concat([X_train_frame[majority], X_train_minority_upsampled])
+    y_train_balanced = pd.concat([y_train_series[majority], y_train_minority_upsampled])
+    X_train_balanced, y_train_balanced = shuffle(X_train_balanced, y_train_balanced, random_state=random_state)
+
+    return {'X_train': X_train, 'X_train_balanced': X_train_balanced.to_numpy(),
+            'y_train_balanced': y_train_balanced.to_numpy(), 'X_test': X_test, 'y_test': y_test,
+            'data_train': data_train.reset_index(drop=True), 'data_test': data_test.reset_index(drop=True)}
+
+
+########################################################################################################################
+# Cache
+
+def file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write_entry(entry_dir, prepared, settings):
+    # Write to a temporary folder first, so an interrupted run (or another process preparing the same data) does not
+    # leave an incomplete entry
+    tmp_dir = f'{entry_dir}.{os.getpid()}.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name in array_names:
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), prepared[name])
+    for name in frame_names:
+        prepared[name].to_parquet(os.path.join(tmp_dir, f'{name}.parquet'), index=False)
+    with open(os.path.join(tmp_dir, 'settings.json'), 'w', encoding='utf-8') as f:
+        json.dump(settings, f, indent=2, sort_keys=True)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Already written by another process
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_entry(entry_dir, mmap_mode='r'):
+    prepared = {name: np.load(os.path.join(entry_dir, f'{name}.npy'), mmap_mode=mmap_mode) for name in array_names}
+    for name in frame_names:
+        prepared[name] = pd.read_parquet(os.path.join(entry_dir, f'{name}.parquet'))
+    return prepared
+
+
+# Prepared data of a model (see prepare_data), from the cache if stockData.csv and the settings did not change.
+# The arrays are read-only memory maps (mmap_mode=None loads them in memory); copy an array before changing it.
+def prepared_data(model, path=stock_data_path, cutoff_year=2021, method='iqr', factor=9, random_state=42,
+                  mmap_mode='r'):
+    settings = {'data_sha256': file_hash(path), 'model_settings': model_settings[model], 'cutoff_year': cutoff_year,
+                'method': method, 'factor': factor, 'random_state': random_state}
+    key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+    entry_dir = os.path.join(cache_dir, key)
+
+    if not os.path.exists(entry_dir):
+        print(f'Preparing {model} data ({key})')
+        prepared = prepare_data(read_stock_data(path), model, cutoff_year, method, factor, random_state)
+        os.makedirs(cache_dir, exist_ok=True)
+        write_entry(entry_dir, prepared, settings)
+    return read_entry(entry_dir, mmap_mode)
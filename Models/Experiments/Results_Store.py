@@ -0,0 +1,260 @@
+# Results store: the predictions of every run of the models in one SQLite file (no server), instead of a CSV file per
+# model that is written again by every run (MLP_test_results.csv, anfis_test_results.csv) and read again to filter each
+# month. A run is a model trained with a seed in an experiment (i.e. a call of Run_Experiments.py or Run_Backtest.py,
+# or the results of a notebook), and its predictions are appended to the store:
+# RUNS:         EXPERIMENT_ID, MODEL, SEED, CREATED, CUTOFF, METRICS and SETTINGS (JSON)
+# PREDICTIONS:  EXPERIMENT_ID, MODEL, SEED, TICKER, DATE (YYYY-MM-DD), APPRECIATION, CLASS, SIGNAL, CLASS_PRED
+# MONTHS:       EXPERIMENT_ID, MODEL, SEED, MONTH (YYYY-MM) and the aggregates of the predictions of the month, computed
+#               when the run is saved
+# The predictions are keyed by (EXPERIMENT_ID, MODEL, SEED, TICKER, DATE) and indexed on DATE and on (MODEL, DATE), so
+# the queries below only read the rows of the runs, models and dates they select. The monthly aggregates and the run
+# summaries read the MONTHS table (one row per run and month), so they do not read the predictions again, and their
+# start and end dates select whole months:
+# month_aggregates:     rows, picks (CLASS_PRED = 1), portfolio appreciation (average APPRECIATION of the picks, as
+#                       results.ipynb), average signal and accuracy of each run and month
+# top_signals:          the k rows with the highest signals of each run and date
+# run_summaries:        months, rows, accuracy and average monthly portfolio appreciation of each run
+# compare_runs:         monthly portfolio appreciation of the runs side by side (one column per run)
+# read_predictions:     predictions of a run (TICKER, DATE, APPRECIATION, CLASS, SIGNAL, CLASS_PRED), as read by
+#                       Significance_Tests.py
+# Every process opens its own connection, so the processes of Run_Experiments.py can save their runs at the same time
+# (the writes wait for each other, up to timeout seconds).
+#
+# Usage:
+# python Results_Store.py import --experiment-id notebooks --model MLP --seed 0 MLP_test_results.csv
+# python Results_Store.py runs [--model MLP] [--experiment-id ID]
+# python Results_Store.py months [--model MLP] [--experiment-id ID] [--seed 0]
+# python Results_Store.py top [--k 10] [--model MLP] [--experiment-id ID] [--seed 0] [--start 2022-01-01]
+
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+store_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Results', 'Predictions',
+                          'predictions.sqlite')
+
+run_keys = ['EXPERIMENT_ID', 'MODEL', 'SEED']
+prediction_columns = ['TICKER', 'DATE', 'APPRECIATION', 'CLASS', 'SIGNAL', 'CLASS_PRED']
+
+schema = '''
+CREATE TABLE IF NOT EXISTS RUNS (
+    EXPERIMENT_ID TEXT NOT NULL,
+    MODEL TEXT NOT NULL,
+    SEED INTEGER NOT NULL,
+    CREATED TEXT NOT NULL,
+    CUTOFF REAL,
+    METRICS TEXT,
+    SETTINGS TEXT,
+    PRIMARY KEY (EXPERIMENT_ID, MODEL, SEED)
+);
+CREATE TABLE IF NOT EXISTS PREDICTIONS (
+    EXPERIMENT_ID TEXT NOT NULL,
+    MODEL TEXT NOT NULL,
+    SEED INTEGER NOT NULL,
+    TICKER TEXT NOT NULL,
+    DATE TEXT NOT NULL,
+    APPRECIATION REAL,
+    CLASS INTEGER,
+    SIGNAL REAL,
+    CLASS_PRED INTEGER,
+    PRIMARY KEY (EXPERIMENT_ID, MODEL, SEED, TICKER, DATE)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS PREDICTIONS_DATE ON PREDICTIONS (DATE);
+CREATE INDEX IF NOT EXISTS PREDICTIONS_MODEL ON PREDICTIONS (MODEL, DATE);
+CREATE TABLE IF NOT EXISTS MONTHS (
+    EXPERIMENT_ID TEXT NOT NULL,
+    MODEL TEXT NOT NULL,
+    SEED INTEGER NOT NULL,
+    MONTH TEXT NOT NULL,
+    ROWS INTEGER,
+    PICKS INTEGER,
+    PORTFOLIO_APPRECIATION REAL,
+    SIGNAL REAL,
+    ACCURACY REAL,
+    PRIMARY KEY (EXPERIMENT_ID, MODEL, SEED, MONTH)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS MONTHS_MONTH ON MONTHS (MONTH);
+CREATE INDEX IF NOT EXISTS MONTHS_MODEL ON MONTHS (MODEL, MONTH);
+'''
+
+
+# Connection to the store (created if it does not exist)
+def connect(path=store_path, timeout=60):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=timeout)
+    # Readers do not wait for the writers (write-ahead log)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(schema)
+    return connection
+
+
+########################################################################################################################
+# Writing
+
+# Save the predictions of a run (DataFrame with the prediction_columns), replacing the predictions of the run if it
+# was already saved
+# metrics:          metrics of the run (i.e. of Train_Models.evaluate), CUTOFF is saved in its own column
+# settings:         settings of the run (i.e. epochs, cutoff_year, number of the experiment)
+def save_run(connection, experiment_id, model, seed, predictions, metrics=None, settings=None):
+    metrics = {name: float(value) for name, value in (metrics or {}).items()}
+    run = (str(experiment_id), model, int(seed))
+    rows = pd.DataFrame({'TICKER': predictions['TICKER'].astype(str),
+                         'DATE': pd.to_datetime(predictions['DATE']).dt.strftime('%Y-%m-%d'),
+                         'APPRECIATION': predictions['APPRECIATION'].astype(float),
+                         'CLASS': predictions['CLASS'].astype(int),
+                         'SIGNAL': predictions['SIGNAL'].astype(float),
+                         'CLASS_PRED': predictions['CLASS_PRED'].astype(int)})
+    # NaN values (i.e. rows without signal) are saved as NULL
+    rows = rows.astype(object).where(rows.notna(), None)
+    where = 'WHERE EXPERIMENT_ID = ? AND MODEL = ? AND SEED = ?'
+    with connection:
+        connection.execute(f'DELETE FROM PREDICTIONS {where}', run)
+        connection.execute(f'DELETE FROM MONTHS {where}', run)
+        connection.execute('INSERT OR REPLACE INTO RUNS VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           run + (datetime.datetime.now().isoformat(timespec='seconds'), metrics.get('CUTOFF'),
+                                  json.dumps(metrics), json.dumps(settings or {})))
+        connection.executemany(f'INSERT INTO PREDICTIONS VALUES (?, ?, ?, {", ".join("?" * len(prediction_columns))})',
+                               (run + row for row in rows.itertuples(index=False, name=None)))
+        connection.execute(f'''
+            INSERT INTO MONTHS
+            SELECT EXPERIMENT_ID, MODEL, SEED, substr(DATE, 1, 7) AS MONTH, COUNT(*), SUM(CLASS_PRED),
+                   AVG(CASE WHEN CLASS_PRED = 1 THEN APPRECIATION END), AVG(SIGNAL), AVG(CLASS_PRED = (CLASS = 1))
+            FROM PREDICTIONS {where}
+            GROUP BY MONTH''', run)
+
+
+# Delete the runs (and their predictions) of the experiments, models and seeds
+def delete_runs(connection, experiment_id=None, model=None, seed=None):
+    where, parameters = where_clause(experiment_id, model, seed)
+    with connection:
+        for table in ['PREDICTIONS', 'MONTHS', 'RUNS']:
+            connection.execute(f'DELETE FROM {table} {where}', parameters)
+
+
+########################################################################################################################
+# Queries
+
+# WHERE clause of the filters (a value or a list of values of each run key, and the first and last dates)
+# date_format:      format of the dates in the table (DATE: %Y-%m-%d, MONTH: %Y-%m)
+def where_clause(experiment_id=None, model=None, seed=None, start=None, end=None, date_column='DATE',
+                 date_format='%Y-%m-%d'):
+    conditions, parameters = [], []
+    for column, values in zip(run_keys, [experiment_id, model, seed]):
+        if values is None:
+            continue
+        values = list(values) if isinstance(values, (list, tuple, np.ndarray, pd.Series)) else [values]
+        conditions.append(f'{column} IN ({", ".join("?" * len(values))})')
+        parameters += [value.item() if isinstance(value, np.generic) else value for value in values]
+    if start is not None:
+        conditions.append(f'{date_column} >= ?')
+        parameters.append(pd.Timestamp(start).strftime(date_format))
+    if end is not None:
+        conditions.append(f'{date_column} <= ?')
+        parameters.append(pd.Timestamp(end).strftime(date_format))
+    return ('WHERE ' + ' AND '.join(conditions)) if conditions else '', parameters
+
+
+# Aggregates of each run and month (of the months of the filtered runs and dates)
+def month_aggregates_query(**filters):
+    where, parameters = where_clause(**filters, date_column='MONTH', date_format='%Y-%m')
+    return f'SELECT * FROM MONTHS {where}', parameters
+
+
+def month_aggregates(connection, **filters):
+    query, parameters = month_aggregates_query(**filters)
+    return pd.read_sql_query(query + ' ORDER BY EXPERIMENT_ID, MODEL, SEED, MONTH', connection, params=parameters)
+
+
+# The k rows with the highest signals of each run and date
+def top_signals(connection, k=10, **filters):
+    where, parameters = where_clause(**filters)
+    query = f'''
+        SELECT * FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY EXPERIMENT_ID, MODEL, SEED, DATE ORDER BY SIGNAL DESC) AS RANK
+            FROM PREDICTIONS {where})
+        WHERE RANK <= ?
+        ORDER BY EXPERIMENT_ID, MODEL, SEED, DATE, RANK'''
+    return pd.read_sql_query(query, connection, params=parameters + [k])
+
+
+# Months, rows, accuracy and average monthly portfolio appreciation of each run, with its cutoff and creation time
+def run_summaries(connection, **filters):
+    query, parameters = month_aggregates_query(**filters)
+    query = f'''
+        SELECT M.EXPERIMENT_ID, M.MODEL, M.SEED, COUNT(*) AS MONTHS, SUM(M.ROWS) AS ROWS,
+               SUM(M.ACCURACY * M.ROWS) / SUM(M.ROWS) AS ACCURACY,
+               AVG(M.PORTFOLIO_APPRECIATION) AS PORTFOLIO_APPRECIATION, R.CUTOFF, R.CREATED
+        FROM ({query}) AS M
+        LEFT JOIN RUNS AS R USING (EXPERIMENT_ID, MODEL, SEED)
+        GROUP BY M.EXPERIMENT_ID, M.MODEL, M.SEED
+        ORDER BY M.EXPERIMENT_ID, M.MODEL, M.SEED'''
+    return pd.read_sql_query(query, connection, params=parameters)
+
+
+# Monthly portfolio appreciation of the runs side by side: one row per month and one column per run
+# (EXPERIMENT_ID/MODEL/SEED)
+def compare_runs(connection, **filters):
+    months = month_aggregates(connection, **filters)
+    months['RUN'] = months['EXPERIMENT_ID'] + '/' + months['MODEL'] + '/' + months['SEED'].astype(str)
+    return months.pivot(index='MONTH', columns='RUN', values='PORTFOLIO_APPRECIATION')
+
+
+# Predictions of a run, as the prediction tables read by Significance_Tests.py
+def read_predictions(connection, experiment_id, model, seed):
+    where, parameters = where_clause(experiment_id, model, seed)
+    predictions = pd.read_sql_query(f'SELECT {", ".join(prediction_columns)} FROM PREDICTIONS {where} ORDER BY DATE, '
+                                    f'TICKER', connection, params=parameters)
+    predictions['DATE'] = pd.to_datetime(predictions['DATE'])
+    return predictions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Save and query the predictions of the model runs')
+    parser.add_argument('--store', default=store_path, help='SQLite file of the store')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help='save a predictions CSV file (i.e. of a notebook) as a run')
+    import_parser.add_argument('--experiment-id', required=True, help='experiment of the run')
+    import_parser.add_argument('--model', required=True, help='model of the run')
+    import_parser.add_argument('--seed', type=int, default=0, help='seed of the run')
+    import_parser.add_argument('file', help='CSV file with TICKER, DATE, APPRECIATION, CLASS, SIGNAL, CLASS_PRED')
+
+    query_parsers = [commands.add_parser('runs', help='summary of each run'),
+                     commands.add_parser('months', help='aggregates of each run and month'),
+                     commands.add_parser('top', help='rows with the highest signals of each run and date')]
+    for query_parser in query_parsers:
+        query_parser.add_argument('--experiment-id', default=None, help='experiment of the runs')
+        query_parser.add_argument('--model', default=None, help='model of the runs')
+        query_parser.add_argument('--seed', type=int, default=None, help='seed of the runs')
+        query_parser.add_argument('--start', default=None, help='first date (YYYY-MM-DD)')
+        query_parser.add_argument('--end', default=None, help='last date (YYYY-MM-DD)')
+        query_parser.add_argument('--output', default=None, help='save the result to a CSV file')
+    query_parsers[2].add_argument('--k', type=int, default=10, help='rows of each run and date')
+    args = parser.parse_args()
+
+    store = connect(args.store)
+    if args.command == 'import':
+        file_predictions = pd.read_csv(args.file, header=0, sep=';')
+        save_run(store, args.experiment_id, args.model, args.seed, file_predictions,
+                 settings={'file': os.path.abspath(args.file)})
+        print(f'{len(file_predictions)} predictions saved to {args.store}')
+    else:
+        query_filters = {'experiment_id': args.experiment_id, 'model': args.model, 'seed': args.seed,
+                         'start': args.start, 'end': args.end}
+        if args.command == 'runs':
+            query_result = run_summaries(store, **query_filters)
+        elif args.command == 'months':
+            query_result = month_aggregates(store, **query_filters)
+        else:
+            query_result = top_signals(store, args.k, **query_filters)
+        if args.output:
+            query_result.to_csv(args.output, sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+        else:
+            print(query_result.to_string(index=False))
+    store.close()
@@ -0,0 +1,201 @@
+# Walk-forward (rolling origin) backtest of the models over stockData.csv.
+# Instead of the single split of the model notebooks (train until 2021, test 2022-2023), the portfolio is rebalanced
+# every month. At each monthly origin, the model is trained on the rows whose class is already known at the origin and
+# predicts the classes of the rows of the origin month:
+# - APPRECIATION (and CLASS) is the appreciation in the next 12 months, so a row is only used for training when its
+#   date is at least embargo_months (12) before the origin. Without this gap, the train data would contain the future.
+# - The model is retrained every retrain_months origins (1: at every origin). The origins between two trainings use the
+#   last trained model.
+# - The cutoff of the signals is chosen on the train data (where the true positive and true negative rates cross), so
+#   nothing of the predicted months is used to train or calibrate the model.
+# - The outliers of APPRECIATION (removed by the ANFIS and LR settings of Prepare_Data.py) are only removed from the
+#   train data. The rows of the predicted months are only filtered on the features.
+# Each training (with the months it predicts) is independent of the others, so they run in a pool of processes. The
+# monthly portfolio returns are compared to the market (marketData.csv) with Portfolio_Metrics.py.
+#
+# The predictions can also be saved as a run of the results store (see Results_Store.py), with the seed of the first
+# training.
+#
+# Usage: python Run_Backtest.py [--model MLP] [--start 2014-01] [--end 2023-12] [--retrain-months 12] [--workers N]
+#                               [--store] [--experiment-id ID]
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from Portfolio_Metrics import monthly_portfolio_returns, months_outperforming
+from Prepare_Data import stock_data_path, model_settings, read_stock_data, prepare_split
+from Results_Store import store_path, connect, save_run
+from Train_Models import read_market_data, configure_tensorflow, crossing_cutoff, fit_functions, predict_signal
+
+# stockData, set in every process of the pool
+worker_data = {}
+
+
+def init_worker(path, model, threads):
+    if model != 'LR':
+        configure_tensorflow(threads)
+    worker_data['stock_data'] = read_stock_data(path)
+
+
+# Monthly origins between start and end (months of the data by default). The first origin has at least
+# min_train_months months of train data.
+def monthly_origins(data, start=None, end=None, embargo_months=12, min_train_months=24):
+    months = data['DATE'].dt.to_period('M')
+    first_origin = months.min() + embargo_months + min_train_months - 1
+    start = max(pd.Period(start, freq='M'), first_origin) if start else first_origin
+    end = pd.Period(end, freq='M') if end else months.max()
+    return pd.period_range(start, end, freq='M')
+
+
+# Origins of each training: every retrain_months consecutive origins share a model, trained at the first of them
+def training_groups(origins, retrain_months=1):
+    return [origins[i:i + retrain_months] for i in range(0, len(origins), retrain_months)]
+
+
+# Train a model at the first origin of the group and predict the rows of all the origins of the group
+# train_months:     train on the last train_months months with known classes only (default: all the past months)
+def backtest_group(origins, model, seed, epochs=None, embargo_months=12, train_months=None, method='iqr', factor=9):
+    start_time = time.time()
+    data = worker_data['stock_data']
+    months = data['DATE'].dt.to_period('M')
+    last_train_month = origins[0] - embargo_months
+    train_mask = months <= last_train_month
+    if train_months:
+        train_mask &= months > last_train_month - train_months
+    data_train = data[train_mask]
+    data_test = data[months.isin(origins)]
+    result = {'ORIGIN': str(origins[0]), 'MONTHS': len(origins), 'TRAIN_ROWS': len(data_train),
+              'TEST_ROWS': len(data_test)}
+
+    if data_test.empty:
+        result['ERROR'] = 'no rows to predict'
+        return result, None
+    if data_train['CLASS'].nunique() < 2:
+        result['ERROR'] = 'only one class in the train data'
+        return result, None
+
+    # The rows to predict are only filtered on the features: their appreciation is the future at the origin
+    prepared = prepare_split(data_train, data_test, model, method, factor, random_state=seed,
+                             train_only_columns=['APPRECIATION'])
+    kwargs = {'epochs': epochs} if epochs else {}
+    fitted = fit_functions[model](prepared, seed, **kwargs)
+    train_signal = predict_signal(fitted, prepared['X_train_balanced'])
+    signal = predict_signal(fitted, prepared['X_test'])
+    if not (np.isfinite(train_signal).all() and np.isfinite(signal).all()):
+        result['ERROR'] = f'{model} predicted non finite values (seed {seed})'
+        return result, None
+
+    # Cutoff on the train data
+    if model == 'MLP':
+        cutoff_points = np.linspace(-1, 1, 100)
+    else:
+        cutoff_points = np.linspace(train_signal.min(), train_signal.max(), 100)
+    cutoff = crossing_cutoff(train_signal, prepared['y_train_balanced'], cutoff_points,
+                             model_settings[model]['negative_class'])
+
+    predictions = prepared['data_test']
+    predictions['ORIGIN'] = result['ORIGIN']
+    predictions['SIGNAL'] = signal
+    predictions['CLASS_PRED'] = (signal >= cutoff).astype(int)
+    result['CUTOFF'] = float(cutoff)
+    result['SECONDS'] = round(time.time() - start_time, 3)
+    return result, predictions
+
+
+# Run the walk-forward backtest of a model
+# retrain_months:   number of origins that share a trained model
+# max_workers:      number of processes (one training per process at a time). Default: number of CPUs
+# Returns the predictions of all the origins (rows of stockData with ORIGIN, SIGNAL and CLASS_PRED) and one row per
+# training with its origin, sizes, cutoff and duration.
+def run_backtest(model='MLP', start=None, end=None, retrain_months=1, embargo_months=12, train_months=None,
+                 min_train_months=24, max_workers=None, seed=0, epochs=None, method='iqr', factor=9,
+                 path=stock_data_path):
+    origins = monthly_origins(read_stock_data(path), start, end, embargo_months, min_train_months)
+    groups = training_groups(origins, retrain_months)
+
+    max_workers = max_workers or os.cpu_count()
+    # Share the CPUs between the processes, so TensorFlow does not start more threads than CPUs
+    threads = max(1, os.cpu_count() // max_workers)
+
+    trainings = []
+    predictions = []
+    # Processes are spawned, as TensorFlow does not support being forked
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker, initargs=(path, model, threads)) as executor:
+        futures = [executor.submit(backtest_group, group, model, seed + i, epochs, embargo_months, train_months,
+                                   method, factor)
+                   for i, group in enumerate(groups)]
+        for future in as_completed(futures):
+            result, group_predictions = future.result()
+            trainings.append(result)
+            if group_predictions is None:
+                print(f'Origin {result["ORIGIN"]}: skipped: {result["ERROR"]}')
+            else:
+                predictions.append(group_predictions)
+                print(f'Origin {result["ORIGIN"]}: {result["TRAIN_ROWS"]} train rows, {result["TEST_ROWS"]} test rows '
+                      f'({result["SECONDS"]}s)')
+
+    trainings = pd.DataFrame(trainings).sort_values('ORIGIN', ignore_index=True)
+    if not predictions:
+        return pd.DataFrame(), trainings
+    predictions = pd.concat(predictions, ignore_index=True).sort_values(['DATE', 'TICKER'], ignore_index=True)
+    return predictions, trainings
+
+
+def print_backtest_summary(returns, model):
+    print(72*'-')
+    print(f'{model} walk-forward backtest: {len(returns)} months ({returns["DATE"].min():%Y-%m} to '
+          f'{returns["DATE"].max():%Y-%m})')
+    print(f'Average {model} portfolio appreciation: {returns[model].mean()*100:.3f}%')
+    print(f'Average Market ETF appreciation: {returns["MARKET"].mean()*100:.3f}%')
+    print(f'{model} Portfolios Outperforming the Market: {months_outperforming(returns, [model])[model]}/'
+          f'{returns["MARKET"].notna().sum()}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Walk-forward backtest of a model')
+    parser.add_argument('--model', default='MLP', choices=list(fit_functions), help='model to backtest')
+    parser.add_argument('--start', default=None, help='first origin (YYYY-MM)')
+    parser.add_argument('--end', default=None, help='last origin (YYYY-MM)')
+    parser.add_argument('--retrain-months', type=int, default=1, help='retrain the model every N origins')
+    parser.add_argument('--train-months', type=int, default=None, help='train on the last N months only')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: number of CPUs)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first training')
+    parser.add_argument('--epochs', type=int, default=None, help='epochs of the model (default: as the notebooks)')
+    parser.add_argument('--output', default='backtest', help='prefix of the CSV files with the results')
+    parser.add_argument('--store', nargs='?', const=store_path, default=None,
+                        help='save the predictions to the results store (default file: Results/Predictions)')
+    parser.add_argument('--experiment-id', default=None, help='experiment of the run saved to the results store '
+                                                              '(default: backtest-<date and time>)')
+    args = parser.parse_args()
+
+    backtest_predictions, backtest_trainings = run_backtest(args.model, args.start, args.end, args.retrain_months,
+                                                            train_months=args.train_months,
+                                                            max_workers=args.workers, seed=args.seed,
+                                                            epochs=args.epochs)
+    backtest_trainings.to_csv(f'{args.output}_trainings.csv', sep=';', decimal='.', encoding='ISO-8859-1',
+                              index=False)
+    if backtest_predictions.empty:
+        print('No predictions')
+    else:
+        backtest_returns = monthly_portfolio_returns({args.model: backtest_predictions}, read_market_data())
+        backtest_predictions.to_csv(f'{args.output}_predictions.csv', sep=';', decimal='.', encoding='ISO-8859-1',
+                                    index=False)
+        backtest_returns.to_csv(f'{args.output}_returns.csv', sep=';', decimal='.', encoding='ISO-8859-1',
+                                index=False)
+        if args.store:
+            backtest_id = args.experiment_id or f'backtest-{datetime.datetime.now():%Y%m%d-%H%M%S}'
+            store_connection = connect(args.store)
+            save_run(store_connection, backtest_id, args.model, args.seed, backtest_predictions,
+                     settings={'start': args.start, 'end': args.end, 'retrain_months': args.retrain_months,
+                               'train_months': args.train_months, 'epochs': args.epochs})
+            store_connection.close()
+            print(f'Predictions saved to {args.store} ({backtest_id})')
+        print_backtest_summary(backtest_returns, args.model)
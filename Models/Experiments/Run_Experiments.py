@@ -0,0 +1,166 @@
+# Run the MLP and ANFIS experiments of hipotesysTest.ipynb in a pool of processes.
+# Every process loads the prepared data from the cache of Prepare_Data.py (read-only memory maps shared by all the
+# processes) and imports TensorFlow once, when it starts, so the experiments only train and evaluate the models (see
+# Train_Models.py). The ANFIS rule centers only depend on the train data, so they are computed once for all the
+# experiments. Each experiment trains every model with its
+# own seed. A training that fails (i.e. the ANFIS predicts NaN values) is retried with a new seed, at most max_attempts
+# times. The metrics are returned as a DataFrame with one row per experiment and model. The predictions of each
+# experiment can be saved as CSV files (predictions_dir) or as runs of the results store (see Results_Store.py).
+#
+# Usage: python Run_Experiments.py [--experiments 100] [--workers N] [--output experiment_results.csv]
+#                                  [--store] [--experiment-id ID]
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from Prepare_Data import stock_data_path, prepared_data
+from Results_Store import store_path, connect, save_run
+from Train_Models import read_market_data, anfis_rule_centers, market_appreciation, configure_tensorflow, run_model
+
+metric_columns = ['ACCURACY', 'PRECISION', 'RECALL', 'F1_SCORE', 'R_VALUE', 'PORTFOLIO_APPRECIATION']
+
+# Prepared data of each model, set in every process of the pool
+worker_data = {}
+
+
+def init_worker(path, models, cutoff_year, rule_centers, threads):
+    configure_tensorflow(threads)
+    for model in models:
+        worker_data[model] = prepared_data(model, path, cutoff_year)
+    if 'ANFIS' in worker_data:
+        worker_data['ANFIS']['rule_centers'] = rule_centers
+
+
+# Seed of each attempt of an experiment. The first attempt uses the seed of the experiment.
+def attempt_seed(seed, attempt):
+    if attempt == 0:
+        return seed
+    return int(np.random.SeedSequence([seed, attempt]).generate_state(1)[0] % 2**31)
+
+
+def run_experiment(experiment, model, seed, max_attempts=3, epochs=None, predictions_dir=None, options=None,
+                   store=None, experiment_id=None):
+    start_time = time.time()
+    result = {'EXPERIMENT': experiment, 'MODEL': model}
+    for attempt in range(max_attempts):
+        result['SEED'] = attempt_seed(seed, attempt)
+        result['ATTEMPTS'] = attempt + 1
+        try:
+            metrics, predictions = run_model(worker_data[model], model, result['SEED'], epochs, options)
+        except Exception as e:
+            result['ERROR'] = str(e)
+            continue
+        result.update(metrics)
+        result.pop('ERROR', None)
+        if predictions_dir:
+            predictions.to_csv(os.path.join(predictions_dir, f'{model}_{experiment:03d}.csv'), sep=';', decimal='.',
+                               encoding='ISO-8859-1', index=False)
+        if store:
+            connection = connect(store)
+            save_run(connection, experiment_id, model, result['SEED'], predictions, metrics,
+                     {'experiment': experiment, 'attempts': result['ATTEMPTS'], 'epochs': epochs, 'options': options})
+            connection.close()
+        break
+    result['SECONDS'] = round(time.time() - start_time, 3)
+    return result
+
+
+# Run n_experiments experiments of each model
+# max_workers:      number of processes (one experiment per process at a time). Default: number of CPUs
+# max_attempts:     maximum number of trainings of an experiment
+# epochs:           number of epochs of every model (default: the epochs of the model notebooks)
+# predictions_dir:  save the test data with the predicted signals and classes of each experiment in this folder
+# fit_options:      other arguments of the fit function of each model, i.e. {'ANFIS': {'backend': 'numpy'}}
+# store:            save the predictions of each experiment to this results store, as runs of experiment_id (default:
+#                   experiments-<date and time>)
+def run_experiments(n_experiments=100, models=('MLP', 'ANFIS'), max_workers=None, max_attempts=3, base_seed=0,
+                    epochs=None, path=stock_data_path, cutoff_year=2021, predictions_dir=None, fit_options=None,
+                    store=None, experiment_id=None):
+    # Prepare the data once, before the processes load it
+    prepared = {model: prepared_data(model, path, cutoff_year) for model in models}
+    rule_centers = anfis_rule_centers(prepared['ANFIS'])['rule_centers'] if 'ANFIS' in prepared else None
+    if predictions_dir:
+        os.makedirs(predictions_dir, exist_ok=True)
+    if store:
+        experiment_id = experiment_id or f'experiments-{datetime.datetime.now():%Y%m%d-%H%M%S}'
+        connect(store).close()
+
+    max_workers = max_workers or os.cpu_count()
+    # Share the CPUs between the processes, so TensorFlow does not start more threads than CPUs
+    threads = max(1, os.cpu_count() // max_workers)
+
+    results = []
+    # Processes are spawned, as TensorFlow does not support being forked
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker,
+                             initargs=(path, models, cutoff_year, rule_centers, threads)) as executor:
+        futures = [executor.submit(run_experiment, experiment, model, base_seed + experiment, max_attempts, epochs,
+                                   predictions_dir, (fit_options or {}).get(model), store, experiment_id)
+                   for experiment in range(n_experiments) for model in models]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if 'ERROR' in result:
+                print(f'Experiment {result["EXPERIMENT"] + 1} {result["MODEL"]}: failed after {result["ATTEMPTS"]} '
+                      f'attempts: {result["ERROR"]}')
+            else:
+                print(f'Experiment {result["EXPERIMENT"] + 1} {result["MODEL"]}: '
+                      f'Accuracy {result["ACCURACY"]:.4f}, R-Value {result["R_VALUE"]:.4f} ({result["SECONDS"]}s)')
+
+    results = pd.DataFrame(results).sort_values(['EXPERIMENT', 'MODEL'], ignore_index=True)
+    for column in metric_columns:
+        if column not in results:
+            results[column] = np.nan
+    return results
+
+
+# Average of the metrics of each model
+def summarize(results):
+    return results.groupby('MODEL', sort=False)[metric_columns + ['ATTEMPTS', 'SECONDS']].mean()
+
+
+def print_summary(results, market_data=None, cutoff_year=2021):
+    summary = summarize(results)
+    for model, metrics in summary.iterrows():
+        print(72*'-')
+        print(f'{model} measures:')
+        print(f'Accuracy: {metrics["ACCURACY"]}')
+        print(f'Precision: {metrics["PRECISION"]}')
+        print(f'Recall (Sensitivity): {metrics["RECALL"]}')
+        print(f'F1-Score: {metrics["F1_SCORE"]}')
+        print(f'R-value: {metrics["R_VALUE"]}')
+        print(f'Average portfolio appreciation: {metrics["PORTFOLIO_APPRECIATION"]*100:.3f}%')
+    if market_data is not None:
+        print(72*'-')
+        print(f'Average Market ETF appreciation: {market_appreciation(market_data, cutoff_year)*100:.3f}%')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the MLP and ANFIS experiments')
+    parser.add_argument('--experiments', type=int, default=100, help='number of experiments')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: number of CPUs)')
+    parser.add_argument('--attempts', type=int, default=3, help='maximum number of trainings of an experiment')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first experiment')
+    parser.add_argument('--epochs', type=int, default=None, help='epochs of every model (default: as the notebooks)')
+    parser.add_argument('--models', nargs='+', default=['MLP', 'ANFIS'], help='models to train')
+    parser.add_argument('--predictions-dir', default=None, help='save the predictions of each experiment')
+    parser.add_argument('--anfis-backend', default='keras', choices=['keras', 'numpy'], help='ANFIS implementation')
+    parser.add_argument('--output', default='experiment_results.csv', help='CSV file with the metrics')
+    parser.add_argument('--store', nargs='?', const=store_path, default=None,
+                        help='save the predictions to the results store (default file: Results/Predictions)')
+    parser.add_argument('--experiment-id', default=None, help='experiment of the runs saved to the results store')
+    args = parser.parse_args()
+
+    experiment_results = run_experiments(args.experiments, args.models, args.workers, args.attempts, args.seed,
+                                         args.epochs, predictions_dir=args.predictions_dir,
+                                         fit_options={'ANFIS': {'backend': args.anfis_backend}}, store=args.store,
+                                         experiment_id=args.experiment_id)
+    experiment_results.to_csv(args.output, sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+    print_summary(experiment_results, read_market_data())
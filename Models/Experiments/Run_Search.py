@@ -0,0 +1,246 @@
+# Hyperparameter search of the MLP, the ANFIS and the logistic regression, instead of changing the values of the
+# notebooks by hand (num_rules, radius, outlier policy, cutoff_year and MLP layer sizes).
+# A configuration is a model with a cutoff year, an outlier method and factor (see Prepare_Data.py), a seed and the
+# options of the model (MLP: hidden_layers, ANFIS: num_rules, radius and backend). Every combination of the values of
+# the search space is a configuration. A trial trains a configuration for a number of epochs and evaluates it on the
+# test period with the metrics of results.ipynb (see Train_Models.evaluate).
+# Successive halving: every configuration is trained with the epochs of the first rung (max_epochs / eta^(rungs - 1)),
+# and only the best 1/eta configurations of each model (by metric) are trained again in the next rung, with eta times
+# more epochs, up to max_epochs (the epochs of the notebooks) in the last rung. The LR has no epochs, so it is trained
+# once and its trials of the next rungs come from the cache.
+# The metrics of each trial are saved in Search/Trials/<key>.json, where the key is the hash of the configuration, the
+# epochs and stockData.csv (SHA-256), so a trial is never trained again (i.e. by a search with more values). The data of
+# each model, cutoff year and outlier policy is prepared once, before the trials (cache of Prepare_Data.py), and the
+# trials of a rung run in a pool of processes (as Run_Experiments.py).
+# The leaderboard ranks the configurations of each model by the rung they reached and then by the metric of their last
+# trial (the rungs of the models are not comparable, i.e. the LR reaches the last rung from the cache), and lists the
+# first configuration of every model, then the second ones, and so on. As in the notebooks, the metrics are the ones of
+# the test period (after cutoff_year), so the configuration at the top should be confirmed on other periods with
+# Run_Backtest.py.
+#
+# Usage: python Run_Search.py [--models MLP ANFIS LR] [--space space.json] [--metric PORTFOLIO_APPRECIATION]
+#                             [--rungs 3] [--eta 3] [--workers N] [--output search_leaderboard.csv]
+
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from Prepare_Data import stock_data_path, prepared_data, file_hash
+from Run_Experiments import metric_columns
+from Train_Models import market_data_path, read_market_data, market_appreciation, configure_tensorflow, run_model
+
+trials_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Search', 'Trials')
+
+# Values of each parameter. The data values apply to every model (outliers: [method, factor]). A JSON file with the same
+# layout (--space) replaces the values it has, i.e. {"data": {"cutoff_year": [2020]}} keeps the outliers values.
+search_space = {
+    'data': {'cutoff_year': [2020, 2021], 'outliers': [['iqr', 9], ['iqr', 1.5], ['std', 3]]},
+    'MLP': {'hidden_layers': [[22], [11], [44], [22, 11]]},
+    'ANFIS': {'num_rules': [2, 3, 4], 'radius': [0.1, 0.2, 0.3]},
+    'LR': {},
+}
+
+# Epochs of the last rung (the epochs of the model notebooks)
+max_epochs = {'MLP': 500, 'ANFIS': 100, 'LR': None}
+
+
+########################################################################################################################
+# Configurations and trials
+
+def configurations(space, models, seed=0, anfis_backend='keras'):
+    configs = []
+    for model in models:
+        model_space = space.get(model, {})
+        for cutoff_year, (method, factor), *values in itertools.product(space['data']['cutoff_year'],
+                                                                        space['data']['outliers'],
+                                                                        *model_space.values()):
+            options = dict(zip(model_space, values))
+            if model == 'ANFIS':
+                options['backend'] = anfis_backend
+            configs.append({'model': model, 'cutoff_year': cutoff_year, 'method': method, 'factor': factor,
+                            'seed': seed, 'options': options})
+    return configs
+
+
+# Epochs of each rung (None for the LR)
+def rung_epochs(model, rungs=3, eta=3, last_epochs=None):
+    if max_epochs[model] is None:
+        return [None] * rungs
+    last_epochs = last_epochs or max_epochs[model]
+    return [max(1, round(last_epochs / eta ** (rungs - 1 - rung))) for rung in range(rungs)]
+
+
+def trial_key(config, epochs, data_sha256):
+    content = json.dumps({'config': config, 'epochs': epochs, 'data_sha256': data_sha256}, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+def read_trial(key):
+    path = os.path.join(trials_dir, f'{key}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_trial(trial):
+    # Write to a temporary file first, so an interrupted trial does not leave an incomplete file
+    path = os.path.join(trials_dir, f'{trial["key"]}.json')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(trial, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def init_worker(threads):
+    configure_tensorflow(threads)
+
+
+# Train and evaluate a configuration, and save its metrics. A training that fails (i.e. the ANFIS predicts NaN values)
+# is saved with its error, as it fails again with the same configuration.
+def run_trial(config, epochs, key, path=stock_data_path):
+    start_time = time.time()
+    trial = {'key': key, 'config': config, 'epochs': epochs}
+    try:
+        prepared = prepared_data(config['model'], path, config['cutoff_year'], config['method'], config['factor'])
+        metrics, _ = run_model(prepared, config['model'], config['seed'], epochs, config['options'])
+        trial['metrics'] = {name: float(value) for name, value in metrics.items()}
+    except ValueError as e:
+        trial['error'] = str(e)
+    trial['seconds'] = round(time.time() - start_time, 3)
+    write_trial(trial)
+    return trial
+
+
+# Score of the trials used to rank them (trials that failed are last)
+def trial_score(trial, metric):
+    value = trial.get('metrics', {}).get(metric, np.nan)
+    return -np.inf if np.isnan(value) else value
+
+
+########################################################################################################################
+# Search
+
+# Run the successive halving search. Returns the leaderboard (see leaderboard).
+# metric:           metric used to promote and rank the configurations (metrics of Train_Models.evaluate)
+# rungs, eta:       number of rungs, and factor of the epochs between rungs (1/eta configurations are promoted)
+# last_epochs:      epochs of the last rung of every model (default: max_epochs)
+# max_workers:      number of processes (one trial per process at a time). Default: number of CPUs
+def run_search(models=('MLP', 'ANFIS'), space=None, metric='PORTFOLIO_APPRECIATION', rungs=3, eta=3, last_epochs=None,
+               max_workers=None, seed=0, anfis_backend='keras', path=stock_data_path):
+    space = {section: {**search_space.get(section, {}), **(space or {}).get(section, {})}
+             for section in {**search_space, **(space or {})}}
+    data_sha256 = file_hash(path)
+    configs = configurations(space, models, seed, anfis_backend)
+    epochs = {model: rung_epochs(model, rungs, eta, last_epochs) for model in models}
+
+    # Prepare the data once, before the processes load it
+    for model, cutoff_year, (method, factor) in itertools.product(models, space['data']['cutoff_year'],
+                                                                  space['data']['outliers']):
+        prepared_data(model, path, cutoff_year, method, factor)
+    os.makedirs(trials_dir, exist_ok=True)
+
+    max_workers = max_workers or os.cpu_count()
+    # Share the CPUs between the processes, so TensorFlow does not start more threads than CPUs
+    threads = max(1, os.cpu_count() // max_workers)
+
+    trials = []
+    active = list(range(len(configs)))
+    # Processes are spawned, as TensorFlow does not support being forked
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker, initargs=(threads,)) as executor:
+        for rung in range(rungs):
+            rung_trials = {}
+            futures = {}
+            for i in active:
+                config = configs[i]
+                key = trial_key(config, epochs[config['model']][rung], data_sha256)
+                cached = read_trial(key)
+                if cached is not None:
+                    rung_trials[i] = dict(cached, cached=True)
+                else:
+                    futures[executor.submit(run_trial, config, epochs[config['model']][rung], key, path)] = i
+            print(f'Rung {rung + 1}/{rungs}: {len(active)} configurations ({len(futures)} trials to train, '
+                  f'{len(rung_trials)} cached)')
+            for future in as_completed(futures):
+                trial = rung_trials[futures[future]] = dict(future.result(), cached=False)
+                if 'error' in trial:
+                    print(f'Trial {trial["key"]} {trial["config"]["model"]}: failed: {trial["error"]}')
+                else:
+                    epochs_text = f' ({trial["epochs"]} epochs)' if trial['epochs'] else ''
+                    print(f'Trial {trial["key"]} {trial["config"]["model"]}{epochs_text}: '
+                          f'{metric} {trial["metrics"][metric]:.4f} ({trial["seconds"]}s)')
+            trials += [dict(rung_trials[i], index=i, rung=rung + 1) for i in active]
+
+            # Promote the best 1/eta configurations of each model
+            promoted = []
+            for model in models:
+                model_active = sorted((i for i in active if configs[i]['model'] == model),
+                                      key=lambda i: trial_score(rung_trials[i], metric), reverse=True)
+                promoted += model_active[:math.ceil(len(model_active) / eta)]
+            active = sorted(promoted)
+    return leaderboard(trials, metric)
+
+
+# One row per configuration with its last trial. RANK is the rank of the configuration within its model, by rung and
+# metric, and the rows are sorted by RANK and metric.
+def leaderboard(trials, metric='PORTFOLIO_APPRECIATION'):
+    rows = []
+    for trial in trials:
+        config = trial['config']
+        row = {'MODEL': config['model'], 'CUTOFF_YEAR': config['cutoff_year'], 'METHOD': config['method'],
+               'FACTOR': config['factor'], 'SEED': config['seed'],
+               'OPTIONS': json.dumps(config['options'], sort_keys=True), 'RUNG': trial['rung'],
+               'EPOCHS': trial['epochs'], 'INDEX': trial['index']}
+        row.update({name: trial.get('metrics', {}).get(name, np.nan) for name in ['CUTOFF'] + metric_columns})
+        row.update({'SECONDS': trial['seconds'], 'CACHED': trial['cached'], 'KEY': trial['key'],
+                    'ERROR': trial.get('error')})
+        rows.append(row)
+    board = pd.DataFrame(rows).sort_values('RUNG').drop_duplicates('INDEX', keep='last')
+    board = board.sort_values(['RUNG', metric], ascending=False, na_position='last', kind='stable')
+    board.insert(0, 'RANK', board.groupby('MODEL', sort=False).cumcount() + 1)
+    board = board.sort_values(['RANK', metric], ascending=[True, False], na_position='last', kind='stable')
+    return board.drop(columns='INDEX').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Successive halving search of the model hyperparameters')
+    parser.add_argument('--models', nargs='+', default=['MLP', 'ANFIS'], choices=list(max_epochs),
+                        help='models to search')
+    parser.add_argument('--space', default=None, help='JSON file with the values of the parameters')
+    parser.add_argument('--metric', default='PORTFOLIO_APPRECIATION', choices=metric_columns,
+                        help='metric used to promote and rank the configurations')
+    parser.add_argument('--rungs', type=int, default=3, help='number of rungs of the successive halving')
+    parser.add_argument('--eta', type=int, default=3, help='1/eta configurations are promoted, with eta x epochs')
+    parser.add_argument('--epochs', type=int, default=None, help='epochs of the last rung (default: as the notebooks)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: number of CPUs)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the trainings')
+    parser.add_argument('--anfis-backend', default='keras', choices=['keras', 'numpy'], help='ANFIS implementation')
+    parser.add_argument('--input', default=stock_data_path, help='stockData.csv file')
+    parser.add_argument('--market', default=market_data_path, help='marketData.csv file')
+    parser.add_argument('--output', default='search_leaderboard.csv', help='CSV file with the leaderboard')
+    args = parser.parse_args()
+
+    space_values = None
+    if args.space:
+        with open(args.space, 'r', encoding='utf-8') as space_file:
+            space_values = json.load(space_file)
+    search_leaderboard = run_search(args.models, space_values, args.metric, args.rungs, args.eta, args.epochs,
+                                    args.workers, args.seed, args.anfis_backend, args.input)
+    search_leaderboard.to_csv(args.output, sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+    print(72*'-')
+    leaderboard_columns = ['RANK', 'MODEL', 'CUTOFF_YEAR', 'METHOD', 'FACTOR', 'OPTIONS', 'RUNG', 'EPOCHS', args.metric]
+    print(search_leaderboard.head(10)[leaderboard_columns].to_string(index=False))
+    if os.path.exists(args.market):
+        market_data = read_market_data(args.market)
+        for year in sorted(search_leaderboard['CUTOFF_YEAR'].unique()):
+            print(f'Average Market ETF appreciation after {year}: {market_appreciation(market_data, year)*100:.3f}%')
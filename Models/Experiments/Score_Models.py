@@ -0,0 +1,272 @@
+# Score tickers with trained models, without the notebooks and without TensorFlow.
+# A trained model is saved as an artifact folder:
+# artifact.json:    model, features, scaler (mean and scale of each feature), cutoff of the signal, negative class and
+#                   the settings and metrics of the training
+# weights.npz:      weights of the model (MLP: dense layers, ANFIS: membership functions and rule consequents,
+#                   LR: coefficients)
+# Loading an artifact reads the scaler and the weights once. The signals of a batch of rows (stockData.csv layout) are
+# computed with NumPy in one vectorized call, and CLASS_PRED is 1 where the signal reaches the cutoff. TensorFlow is
+# only imported to train the model of a new artifact.
+#
+# The ANFIS signals are computed by Anfis_NumPy.py, which normalizes the rule strengths in log space, so rows far from
+# every rule center get a signal instead of NaN.
+#
+# Usage:
+# python Score_Models.py train --model MLP [--seed 0] [--epochs N] [--artifact Artifacts/MLP]
+# python Score_Models.py score --artifact Artifacts/MLP --input ../../ETL/Load/stockData.csv --output scores.csv
+# python Score_Models.py serve --artifact Artifacts/MLP Artifacts/ANFIS [--port 8000]
+#
+# The serve mode answers POST /score with JSON {"model": "MLP", "rows": [{"PE": ..., "BVPS": ..., ...}, ...]} (rows
+# can also be lists of the 11 features in stockData.csv order) and returns {"SIGNAL": [...], "CLASS_PRED": [...]}.
+# Requests that arrive within max_wait seconds of each other are scored together in one batch.
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+from Anfis_NumPy import anfis_predict
+from Prepare_Data import stock_data_path, features, model_settings, read_stock_data, prepared_data, fit_scaler
+
+artifacts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Artifacts')
+
+ARTIFACT_VERSION = 1
+
+
+########################################################################################################################
+# Artifacts
+
+# Weights of a fitted model (see Train_Models.py) as NumPy arrays
+def model_weights(fitted, model):
+    if isinstance(fitted, dict):
+        # Weights already as NumPy arrays (NumPy ANFIS, models of Online_Training.py)
+        return fitted
+    if model == 'LR':
+        return {'coef': fitted.coef_[0], 'intercept': fitted.intercept_}
+    if model == 'MLP':
+        kernel_1, bias_1, kernel_2, bias_2 = fitted.get_weights()
+        return {'kernel_1': kernel_1, 'bias_1': bias_1, 'kernel_2': kernel_2, 'bias_2': bias_2}
+    # ANFIS: weights of the FuzzificationLayer and the WeightedCombinationLayer
+    return {variable.name: np.asarray(variable) for variable in fitted.weights}
+
+
+def save_artifact(path, model, fitted, scaler, cutoff, info=None):
+    os.makedirs(path, exist_ok=True)
+    np.savez(os.path.join(path, 'weights.npz'), **model_weights(fitted, model))
+    artifact = {'version': ARTIFACT_VERSION, 'model': model, 'features': features,
+                'scaler_mean': scaler.mean_.tolist(), 'scaler_scale': scaler.scale_.tolist(),
+                'cutoff': float(np.asarray(cutoff).item()),
+                'negative_class': model_settings[model]['negative_class'],
+                'replace_inf': model_settings[model]['replace_inf'], 'info': info or {}}
+    with open(os.path.join(path, 'artifact.json'), 'w', encoding='utf-8') as f:
+        json.dump(artifact, f, indent=2)
+
+
+def load_artifact(path):
+    with open(os.path.join(path, 'artifact.json'), 'r', encoding='utf-8') as f:
+        artifact = json.load(f)
+    if artifact['version'] != ARTIFACT_VERSION:
+        raise ValueError(f'{path}: artifact version {artifact["version"]} is not supported')
+    with np.load(os.path.join(path, 'weights.npz')) as weights:
+        artifact['weights'] = {name: weights[name].astype(np.float64) for name in weights.files}
+    artifact['scaler_mean'] = np.array(artifact['scaler_mean'])
+    artifact['scaler_scale'] = np.array(artifact['scaler_scale'])
+    return artifact
+
+
+# Train a model on the prepared data of the model notebooks and save it as an artifact. The cutoff is chosen as in the
+# notebooks (where the true positive and true negative rates cross on the test data).
+def train_artifact(model, path, seed=0, epochs=None, data_path=stock_data_path, cutoff_year=2021):
+    from Train_Models import configure_tensorflow, anfis_rule_centers, fit_functions, predict_signal, evaluate
+    if model != 'LR':
+        configure_tensorflow()
+    prepared = prepared_data(model, data_path, cutoff_year)
+    if model == 'ANFIS':
+        prepared = anfis_rule_centers(dict(prepared))
+    kwargs = {'epochs': epochs} if epochs else {}
+    fitted = fit_functions[model](prepared, seed, **kwargs)
+    metrics, _ = evaluate(predict_signal(fitted, prepared['X_test']), prepared, model)
+    info = {'seed': seed, 'epochs': epochs, 'cutoff_year': cutoff_year, 'metrics': metrics}
+    save_artifact(path, model, fitted, fit_scaler(prepared['data_train']), metrics['CUTOFF'], info)
+    return metrics
+
+
+########################################################################################################################
+# Scoring
+
+def mlp_signal(weights, X):
+    hidden = np.tanh(X @ weights['kernel_1'] + weights['bias_1'])
+    return np.tanh(hidden @ weights['kernel_2'] + weights['bias_2'])[:, 0]
+
+
+def lr_signal(weights, X):
+    return 1 / (1 + np.exp(-(X @ weights['coef'] + weights['intercept'])))
+
+
+signal_functions = {'MLP': mlp_signal, 'ANFIS': anfis_predict, 'LR': lr_signal}
+
+
+# Scaled features of the rows (DataFrame with the feature columns, or array with the features in stockData.csv order)
+def scaled_features(artifact, rows):
+    if isinstance(rows, pd.DataFrame):
+        X = rows[artifact['features']].to_numpy(dtype=np.float64)
+    else:
+        X = np.asarray(rows, dtype=np.float64).reshape(-1, len(artifact['features']))
+    if artifact['replace_inf']:
+        X = np.where(X == np.inf, 1e20, X)
+    return (X - artifact['scaler_mean']) / artifact['scaler_scale']
+
+
+def artifact_signal(artifact, X):
+    return signal_functions[artifact['model']](artifact['weights'], X)
+
+
+# Signals and classes of the rows: returns a copy of the rows with the SIGNAL and CLASS_PRED columns. Rows with missing
+# features (removed from the data of the notebooks with the outliers) have a NaN signal and CLASS_PRED 0.
+def score(artifact, rows):
+    signal = artifact_signal(artifact, scaled_features(artifact, rows))
+    scored = rows.copy()
+    scored['SIGNAL'] = signal
+    scored['CLASS_PRED'] = (signal >= artifact['cutoff']).astype(int)
+    return scored
+
+
+########################################################################################################################
+# HTTP mode
+
+# Scores the requests of many threads in batches: the first request waits at most max_wait seconds for others, and all
+# the waiting requests (up to max_rows rows) are scored together
+class MicroBatcher:
+    def __init__(self, artifact, max_wait=0.002, max_rows=100000):
+        self.artifact = artifact
+        self.max_wait = max_wait
+        self.max_rows = max_rows
+        self.requests = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def score(self, X):
+        request = {'X': X, 'done': threading.Event()}
+        self.requests.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['signal']
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            rows = len(batch[0]['X'])
+            deadline = time.monotonic() + self.max_wait
+            while rows < self.max_rows:
+                try:
+                    request = self.requests.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                rows += len(request['X'])
+            try:
+                signals = artifact_signal(self.artifact, np.concatenate([request['X'] for request in batch]))
+                for request, signal in zip(batch, np.split(signals, np.cumsum([len(r['X']) for r in batch])[:-1])):
+                    request['signal'] = signal
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            for request in batch:
+                request['done'].set()
+
+
+def make_handler(artifacts, batchers):
+    class ScoreHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, content):
+            body = json.dumps(content).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/models':
+                self.send_json(404, {'error': 'not found'})
+                return
+            self.send_json(200, {model: {'features': artifact['features'], 'cutoff': artifact['cutoff']}
+                                 for model, artifact in artifacts.items()})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self.send_json(404, {'error': 'not found'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                artifact = artifacts[request['model']]
+                rows = request['rows']
+                if rows and isinstance(rows[0], dict):
+                    rows = pd.DataFrame.from_records(rows)
+                X = scaled_features(artifact, rows)
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {'error': f'invalid request: {e}'})
+                return
+            signal = batchers[artifact['model']].score(X)
+            # Rows with missing features have no signal (null)
+            self.send_json(200, {'SIGNAL': np.where(np.isnan(signal), None, signal).tolist(),
+                                 'CLASS_PRED': (signal >= artifact['cutoff']).astype(int).tolist()})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoreHandler
+
+
+def make_server(artifact_paths, host='127.0.0.1', port=8000, max_wait=0.002):
+    artifacts = {}
+    for path in artifact_paths:
+        artifact = load_artifact(path)
+        artifacts[artifact['model']] = artifact
+    batchers = {model: MicroBatcher(artifact, max_wait) for model, artifact in artifacts.items()}
+    return ThreadingHTTPServer((host, port), make_handler(artifacts, batchers))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train, save and score model artifacts')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = commands.add_parser('train', help='train a model and save its artifact')
+    train_parser.add_argument('--model', default='MLP', choices=list(signal_functions), help='model to train')
+    train_parser.add_argument('--seed', type=int, default=0, help='seed of the training')
+    train_parser.add_argument('--epochs', type=int, default=None, help='epochs (default: as the notebooks)')
+    train_parser.add_argument('--artifact', default=None, help='artifact folder (default: Artifacts/<model>)')
+
+    score_parser = commands.add_parser('score', help='score the rows of a CSV file (stockData.csv layout)')
+    score_parser.add_argument('--artifact', required=True, help='artifact folder')
+    score_parser.add_argument('--input', default=stock_data_path, help='CSV file with the features')
+    score_parser.add_argument('--output', default='scores.csv', help='CSV file with SIGNAL and CLASS_PRED')
+
+    serve_parser = commands.add_parser('serve', help='score the rows posted to a local HTTP server')
+    serve_parser.add_argument('--artifact', nargs='+', required=True, help='artifact folders')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='address of the server')
+    serve_parser.add_argument('--port', type=int, default=8000, help='port of the server')
+    serve_parser.add_argument('--max-wait', type=float, default=0.002, help='seconds a request waits for a batch')
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        artifact_path = args.artifact or os.path.join(artifacts_dir, args.model)
+        train_metrics = train_artifact(args.model, artifact_path, args.seed, args.epochs)
+        print(f'{args.model} saved to {artifact_path}: Accuracy {train_metrics["ACCURACY"]:.4f}, '
+              f'Cutoff {train_metrics["CUTOFF"]:.4f}')
+    elif args.command == 'score':
+        model_artifact = load_artifact(args.artifact)
+        stock_data = read_stock_data(args.input)
+        start_time = time.time()
+        scores = score(model_artifact, stock_data)
+        print(f'{len(scores)} rows scored in {(time.time() - start_time)*1000:.1f} ms')
+        scores.to_csv(args.output, sep=';', decimal='.', encoding='ISO-8859-1', index=False)
+    else:
+        server = make_server(args.artifact, args.host, args.port, args.max_wait)
+        print(f'Scoring on http://{args.host}:{args.port}/score')
+        server.serve_forever()
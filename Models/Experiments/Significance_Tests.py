@@ -0,0 +1,261 @@
+# Bootstrap and permutation tests on saved prediction tables (MLP_test_results.csv, anfis_test_results.csv or the
+# predictions of Run_Experiments.py and Run_Backtest.py: TICKER, DATE, APPRECIATION, CLASS, SIGNAL, CLASS_PRED), without
+# training the models again.
+#
+# The metrics are computed from sums: for each month, the number of rows, the sums of SIGNAL, APPRECIATION, their
+# squares and products (r-value), the correct classes (accuracy) and the sum of APPRECIATION of the assets predicted as
+# class 1 (monthly portfolio, as results.ipynb). A resample only changes how many times each row or month is counted,
+# so the metrics of thousands of resamples come from a few matrix products over a (resamples, rows or months) array of
+# counts, in chunks of chunk_size resamples.
+#
+# unit='row':       the rows are resampled within their months: each month keeps its number of rows, so it keeps its
+#                   weight in the r-value and accuracy. Two models are paired on the rows they both predict (same
+#                   TICKER and DATE).
+# unit='month':     whole months are resampled, keeping the assets of a month together. With block_length > 1, blocks
+#                   of consecutive months are resampled (moving blocks), keeping the dependence between the months (the
+#                   appreciations of consecutive months overlap, as they span 12 months).
+# The permutation tests swap months (or blocks of months): between the two models for "MLP vs ANFIS", and between the
+# model and the market for "model beats BOVA11" (sign flip of the monthly excess appreciation).
+#
+# Usage: python Significance_Tests.py [--mlp MLP_test_results.csv] [--anfis anfis_test_results.csv] [--unit month]
+#                                     [--block-length 3] [--resamples 10000]
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from Train_Models import read_market_data
+
+statistic_names = ['N', 'SUM_SIGNAL', 'SUM_APPRECIATION', 'SUM_SIGNAL2', 'SUM_APPRECIATION2', 'SUM_PRODUCT', 'CORRECT',
+                   'PICKS', 'PICKS_APPRECIATION']
+metric_names = ['ACCURACY', 'R_VALUE', 'PORTFOLIO_APPRECIATION', 'EXCESS_APPRECIATION']
+
+
+def read_results(path):
+    results = pd.read_csv(path, header=0, sep=';')
+    results['DATE'] = pd.to_datetime(results['DATE'])
+    return results
+
+
+# Statistics of each row (rows, statistic_names) and the month of each row
+def row_statistics(predictions, months):
+    signal = predictions['SIGNAL'].to_numpy(dtype=np.float64)
+    appreciation = predictions['APPRECIATION'].to_numpy(dtype=np.float64)
+    picks = (predictions['CLASS_PRED'] == 1).to_numpy()
+    if 'CLASS' in predictions:
+        correct = (predictions['CLASS'].replace(-1, 0) == predictions['CLASS_PRED']).to_numpy()
+    else:
+        correct = np.full(len(predictions), np.nan)
+    statistics = np.column_stack([np.ones(len(predictions)), signal, appreciation, signal * signal,
+                                  appreciation * appreciation, signal * appreciation, correct, picks,
+                                  np.where(picks, appreciation, 0)])
+    month_index = months.get_indexer(predictions['DATE'].dt.to_period('M'))
+    return statistics, month_index
+
+
+# Sums of the statistics of each month (months, statistics)
+def month_statistics(statistics, month_index, n_months):
+    sums = np.zeros((n_months, statistics.shape[1]))
+    np.add.at(sums, month_index, statistics)
+    return sums
+
+
+# Metrics from the sums of the statistics of each month (..., months, statistics) and the weight of each month
+# (..., months) in the average of the monthly portfolios. Returns a dictionary of arrays (...,).
+def metrics_from_sums(sums, weights, market=None):
+    totals = sums.sum(axis=-2)
+    n, sx, sy, sxx, syy, sxy, correct = (totals[..., i] for i in range(7))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r_value = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+        # Average appreciation of the monthly portfolios (months without assets predicted as class 1 are skipped)
+        portfolio = sums[..., 8] / sums[..., 7]
+        weights = np.where(np.isnan(portfolio), 0, weights)
+        portfolio = np.nan_to_num(portfolio)
+        metrics = {'ACCURACY': correct / n, 'R_VALUE': r_value,
+                   'PORTFOLIO_APPRECIATION': (weights * portfolio).sum(axis=-1) / weights.sum(axis=-1)}
+        if market is not None:
+            # Months without market data are skipped
+            weights = np.where(np.isnan(market), 0, weights)
+            excess = np.nan_to_num(portfolio - market)
+            metrics['EXCESS_APPRECIATION'] = (weights * excess).sum(axis=-1) / weights.sum(axis=-1)
+    return metrics
+
+
+# Number of times each unit is drawn in each resample (resamples, units). Blocks of block_length consecutive units are
+# drawn until there are as many units as in the data (block_length 1: ordinary bootstrap).
+def bootstrap_counts(n_units, n_resamples, rng, block_length=1):
+    if block_length <= 1:
+        return rng.multinomial(n_units, np.full(n_units, 1 / n_units), size=n_resamples).astype(np.float64)
+    block_length = min(block_length, n_units)
+    n_blocks = -(-n_units // block_length)
+    starts = rng.integers(0, n_units - block_length + 1, size=(n_resamples, n_blocks))
+    units = (starts[:, :, np.newaxis] + np.arange(block_length)).reshape(n_resamples, -1)[:, :n_units]
+    counts = np.zeros((n_resamples, n_units))
+    np.add.at(counts, (np.arange(n_resamples)[:, np.newaxis], units), 1)
+    return counts
+
+
+# Number of times each row is drawn in each resample (resamples, rows), for rows sorted by month: the rows of each month
+# (bounds[m]:bounds[m + 1]) are resampled on their own, so every month keeps its number of rows
+def month_row_counts(bounds, n_resamples, rng):
+    sizes = np.diff(bounds)
+    return np.concatenate([bootstrap_counts(size, n_resamples, rng) for size in sizes if size] +
+                          [np.zeros((n_resamples, 0))], axis=1)
+
+
+# Which months are swapped in each permutation (resamples, months): blocks of block_length consecutive months are
+# swapped together
+def swap_months(n_months, n_resamples, rng, block_length=1):
+    block_length = max(1, block_length)
+    swaps = rng.random((n_resamples, -(-n_months // block_length))) < 0.5
+    return np.repeat(swaps, block_length, axis=1)[:, :n_months]
+
+
+# Metrics of the resamples of one or more paired models
+# Returns a list (one per model) of dictionaries of arrays (n_resamples,)
+def bootstrap_metrics(predictions, months, market, n_resamples, unit, block_length, rng, chunk_size):
+    n_months = len(months)
+    if unit == 'month':
+        month_sums = [month_statistics(*row_statistics(frame, months), n_months) for frame in predictions]
+    else:
+        rows = [row_statistics(frame, months) for frame in predictions]
+        # Rows sorted by month, so the rows of each month are a slice
+        order = np.argsort(rows[0][1], kind='stable')
+        rows = [(statistics[order], month_index[order]) for statistics, month_index in rows]
+        bounds = np.searchsorted(rows[0][1], np.arange(n_months + 1))
+
+    results = [{name: [] for name in metric_names} for _ in predictions]
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        if unit == 'month':
+            counts = bootstrap_counts(n_months, size, rng, block_length)
+            resampled = [counts[:, :, np.newaxis] * sums for sums in month_sums]
+            weights = counts
+        else:
+            counts = month_row_counts(bounds, size, rng)
+            resampled = [np.stack([counts[:, bounds[m]:bounds[m + 1]] @ statistics[bounds[m]:bounds[m + 1]]
+                                   for m in range(n_months)], axis=1) for statistics, _ in rows]
+            weights = np.ones((size, n_months))
+        for result, sums in zip(results, resampled):
+            for name, values in metrics_from_sums(sums, weights, market).items():
+                result[name].append(values)
+    return [{name: np.concatenate(values) for name, values in result.items() if values} for result in results]
+
+
+def study_months(predictions):
+    return pd.PeriodIndex(np.unique(np.concatenate([frame['DATE'].dt.to_period('M').to_numpy()
+                                                    for frame in predictions])), freq='M')
+
+
+def monthly_market(market_data, months):
+    market = market_data.groupby(market_data['DATE'].dt.to_period('M'))['APPRECIATION'].mean()
+    return market.reindex(months).to_numpy()
+
+
+# Rows predicted by both models, in the same order
+def paired_rows(predictions_a, predictions_b):
+    keys = ['TICKER', 'DATE']
+    common = predictions_a[keys].merge(predictions_b[keys], on=keys)
+    return tuple(predictions.merge(common, on=keys).sort_values(keys, ignore_index=True)
+                 for predictions in [predictions_a, predictions_b])
+
+
+def interval(values, confidence):
+    values = values[np.isfinite(values)]
+    return np.quantile(values, [(1 - confidence) / 2, (1 + confidence) / 2]) if len(values) else [np.nan, np.nan]
+
+
+# Does the model beat the market (BOVA11)? Bootstrap confidence intervals of the metrics, and p-value of the monthly
+# excess appreciation (portfolio - market) being positive, from sign flips of months (or blocks of months).
+def compare_to_market(predictions, market_data, n_resamples=10000, unit='row', block_length=1, confidence=0.95,
+                      seed=0, chunk_size=500):
+    rng = np.random.default_rng(seed)
+    months = study_months([predictions])
+    market = monthly_market(market_data, months)
+    month_sums = month_statistics(*row_statistics(predictions, months), len(months))
+    estimates = metrics_from_sums(month_sums, np.ones(len(months)), market)
+    resamples = bootstrap_metrics([predictions], months, market, n_resamples, unit, block_length, rng, chunk_size)[0]
+
+    # Sign flips of the monthly excess appreciation (months without portfolio are skipped)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        excess = month_sums[:, 8] / month_sums[:, 7] - market
+    valid = np.isfinite(excess)
+    excess = np.where(valid, excess, 0)
+    exceed = 0
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        signs = np.where(swap_months(len(months), size, rng, block_length), -1, 1)
+        exceed += ((signs * excess).sum(axis=1) / valid.sum() >= estimates['EXCESS_APPRECIATION'] - 1e-12).sum()
+
+    comparison = pd.DataFrame({'ESTIMATE': {name: float(estimates[name]) for name in metric_names}})
+    comparison[['CI_LOW', 'CI_HIGH']] = [interval(resamples[name], confidence) for name in metric_names]
+    comparison['P_VALUE'] = np.nan
+    comparison.loc['EXCESS_APPRECIATION', 'P_VALUE'] = (1 + exceed) / (1 + n_resamples)
+    comparison.loc['MARKET_APPRECIATION'] = [np.nanmean(np.where(valid, market, np.nan)), np.nan, np.nan, np.nan]
+    return comparison
+
+
+# Is model A different from model B (i.e. MLP vs ANFIS)? Bootstrap confidence intervals of the differences of the
+# metrics (A - B) on paired resamples, and two-sided p-values from permutations swapping the months (or blocks of
+# months) of the two models.
+def compare_models(predictions_a, predictions_b, n_resamples=10000, unit='row', block_length=1, confidence=0.95,
+                   seed=0, chunk_size=500):
+    rng = np.random.default_rng(seed)
+    if unit == 'row':
+        predictions_a, predictions_b = paired_rows(predictions_a, predictions_b)
+    months = study_months([predictions_a, predictions_b])
+    # The excess appreciation over the market has the same difference as the portfolio appreciation
+    names = metric_names[:-1]
+
+    sums_a = month_statistics(*row_statistics(predictions_a, months), len(months))
+    sums_b = month_statistics(*row_statistics(predictions_b, months), len(months))
+    estimate_a = metrics_from_sums(sums_a, np.ones(len(months)))
+    estimate_b = metrics_from_sums(sums_b, np.ones(len(months)))
+    differences = {name: estimate_a[name] - estimate_b[name] for name in names}
+
+    resample_a, resample_b = bootstrap_metrics([predictions_a, predictions_b], months, None, n_resamples, unit,
+                                               block_length, rng, chunk_size)
+
+    exceed = {name: 0 for name in names}
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        swaps = swap_months(len(months), size, rng, block_length)[:, :, np.newaxis]
+        permuted_a = metrics_from_sums(np.where(swaps, sums_b, sums_a), np.ones(len(months)))
+        permuted_b = metrics_from_sums(np.where(swaps, sums_a, sums_b), np.ones(len(months)))
+        for name in names:
+            exceed[name] += (np.abs(permuted_a[name] - permuted_b[name]) >= abs(differences[name]) - 1e-12).sum()
+
+    comparison = pd.DataFrame({'A': {name: float(estimate_a[name]) for name in names},
+                               'B': {name: float(estimate_b[name]) for name in names},
+                               'DIFFERENCE': {name: float(differences[name]) for name in names}})
+    comparison[['CI_LOW', 'CI_HIGH']] = [interval(resample_a[name] - resample_b[name], confidence) for name in names]
+    comparison['P_VALUE'] = [(1 + exceed[name]) / (1 + n_resamples) for name in names]
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bootstrap and permutation tests of the saved model results')
+    parser.add_argument('--mlp', default='../Multilayer Perceptron/MLP_test_results.csv', help='MLP predictions')
+    parser.add_argument('--anfis', default='../Adaptative Neuro-Fuzzy Inference System/anfis_test_results.csv',
+                        help='ANFIS predictions')
+    parser.add_argument('--unit', default='row', choices=['row', 'month'], help='unit of the bootstrap')
+    parser.add_argument('--block-length', type=int, default=1,
+                        help='months resampled (unit month) and swapped together')
+    parser.add_argument('--resamples', type=int, default=10000, help='number of resamples and permutations')
+    parser.add_argument('--confidence', type=float, default=0.95, help='confidence of the intervals')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the resamples')
+    args = parser.parse_args()
+
+    market_data = read_market_data()
+    mlp_results = read_results(args.mlp)
+    anfis_results = read_results(args.anfis)
+    options = {'n_resamples': args.resamples, 'unit': args.unit, 'block_length': args.block_length,
+               'confidence': args.confidence, 'seed': args.seed}
+    for model, results in [('MLP', mlp_results), ('ANFIS', anfis_results)]:
+        print(72*'-')
+        print(f'{model} vs market:')
+        print(compare_to_market(results, market_data, **options).to_string())
+    print(72*'-')
+    print('MLP (A) vs ANFIS (B):')
+    print(compare_models(mlp_results, anfis_results, **options).to_string())
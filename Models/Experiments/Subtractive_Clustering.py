@@ -0,0 +1,72 @@
+# Subtractive clustering, used to initialize the centers of the ANFIS rules (means of the gaussian membership
+# functions).
+# The potential of each point is the sum of exp(-|x - x_j|^2 / (radius/2)^2) over all the points. Instead of building
+# the N x N distance matrix, the potentials are computed over blocks of rows, so the memory used is bounded by
+# memory_limit for any number of points. The blocks can be computed by several threads (NumPy releases the GIL in the
+# matrix products). For hundreds of thousands of points, method='tree' approximates the potentials with a KD-tree
+# kernel density estimate, which skips the pairs of points that are far apart.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# Sum over the rows of B of exp(-|a - b|^2 / denominator) for each row a of A
+def block_potentials(A, B, B_squared_norms, denominator):
+    # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, computed in place in a single block of len(A) x len(B)
+    block = A @ B.T
+    block *= -2
+    block += np.einsum('ij,ij->i', A, A)[:, np.newaxis]
+    block += B_squared_norms[np.newaxis, :]
+    np.maximum(block, 0, out=block)
+    block *= -1 / denominator
+    np.exp(block, out=block)
+    return block.sum(axis=1)
+
+
+# Potential of each point
+# memory_limit:     maximum size in bytes of the block of distances computed at once (per thread)
+# max_workers:      number of threads computing blocks at the same time
+# method:           exact (blocked sums over all the pairs) or tree (KD-tree approximation with relative error rtol)
+def point_potentials(X, radius=0.2, memory_limit=64 * 2**20, max_workers=1, method='exact', rtol=1e-6):
+    X = np.asarray(X, dtype=np.float64)
+    denominator = (radius / 2) ** 2
+
+    if method == 'tree':
+        from sklearn.neighbors import KDTree
+        # The gaussian kernel of the tree is exp(-d^2 / (2 h^2)). Its densities are normalized by a constant factor,
+        # which is removed so the potentials keep the same scale as the exact method.
+        bandwidth = np.sqrt(denominator / 2)
+        log_density = KDTree(X).kernel_density(X, h=bandwidth, kernel='gaussian', rtol=rtol, return_log=True)
+        return np.exp(log_density + X.shape[1] / 2 * np.log(2 * np.pi * bandwidth ** 2))
+
+    squared_norms = np.einsum('ij,ij->i', X, X)
+    block_size = max(1, int(memory_limit // (8 * len(X))))
+    starts = range(0, len(X), block_size)
+
+    def compute(start):
+        return block_potentials(X[start:start + block_size], X, squared_norms, denominator)
+
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return np.concatenate(list(executor.map(compute, starts)))
+    return np.concatenate([compute(start) for start in starts])
+
+
+# Select number_of_rules cluster centers. Each center is the point with the highest potential, after subtracting the
+# potential explained by the previous centers.
+# Returns the centers as columns: (number of features, number_of_rules)
+def subtractive_clustering(X, number_of_rules, radius=0.2, **kwargs):
+    X = np.asarray(X, dtype=np.float64)
+    denominator = (radius / 2) ** 2
+    potential = point_potentials(X, radius, **kwargs)
+
+    idx = np.argmax(potential)
+    rule_centers = [X[idx]]
+    for i in range(number_of_rules - 1):
+        potential_star = potential[idx]
+        distances = np.sum((X - X[idx]) ** 2, axis=1)
+        potential = potential - potential_star * np.exp(-distances / denominator)
+        idx = np.argmax(potential)
+        rule_centers.append(X[idx])
+    return np.array(rule_centers).T
@@ -0,0 +1,250 @@
+# Train and evaluate the MLP and ANFIS models (and the logistic regression) as plain Python functions.
+# The steps follow the model notebooks (multi_layer_perceptron.ipynb and anfis.ipynb), so an experiment can run without
+# executing the notebooks: data preparation, training, choice of the cutoff point where the true positive and true
+# negative rates cross, classification metrics and the metrics of results.ipynb (r-value and portfolio appreciation).
+# The data preparation is in Prepare_Data.py. TensorFlow is only imported when a model is built (the ANFIS can also be
+# trained without TensorFlow, see Anfis_NumPy.py).
+
+import numpy as np
+import pandas as pd
+from scipy.stats import linregress
+from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+
+from Prepare_Data import features, model_settings
+from Subtractive_Clustering import subtractive_clustering
+from Anfis_NumPy import fit_numpy_anfis, anfis_predict
+
+market_data_path = '../../ETL/Load/marketData.csv'
+
+
+def read_market_data(path=market_data_path):
+    market_data = pd.read_csv(path, header=0, sep=';')
+    market_data['DATE'] = pd.to_datetime(market_data['DATE'])
+    return market_data
+
+
+########################################################################################################################
+# Models
+
+# Limit the threads used by TensorFlow (several experiments run at the same time, one per process)
+def configure_tensorflow(threads=None):
+    import tensorflow as tf
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+    return tf
+
+
+# hidden_layers:    neurons of each hidden layer (default: one layer with 2x input neurons, as the notebook)
+def build_mlp(input_neurons=11, hidden_layers=None):
+    from tensorflow import keras
+
+    # Hidden layers (default: 22 neurons, 2x input neurons) and output layer, with tangent sigmoid activation
+    MLP = keras.models.Sequential()
+    MLP.add(keras.layers.Input(shape=(input_neurons,)))
+    for neurons in hidden_layers or [2 * input_neurons]:
+        MLP.add(keras.layers.Dense(neurons, activation='tanh'))
+    MLP.add(keras.layers.Dense(1, activation='tanh'))
+
+    optimizer = keras.optimizers.SGD(learning_rate=0.01, momentum=0.9, nesterov=True)
+    MLP.compile(optimizer=optimizer, loss='mean_squared_error')
+    return MLP
+
+
+def build_anfis(input_dim, num_rules, rule_centers):
+    import tensorflow as tf
+    from tensorflow import keras
+
+    class FuzzificationLayer(keras.layers.Layer):
+        def __init__(self, num_rules, initial_means, **kwargs):
+            super().__init__(**kwargs)
+            self.num_rules = num_rules
+            self.initial_means = np.asarray(initial_means, dtype=np.float32)  # Initial means
+
+        def build(self, input_shape):
+            num_features = input_shape[-1]
+            # Ensure means match the dimensions
+            assert self.initial_means.shape == (num_features, self.num_rules), \
+                f"Expected shape {(num_features, self.num_rules)}, but got {self.initial_means.shape}"
+
+            # Trainable parameters for Gaussian membership functions
+            self.means = self.add_weight(shape=(num_features, self.num_rules),
+                                         initializer=keras.initializers.Constant(self.initial_means),
+                                         trainable=True, name='means')
+            self.stds = self.add_weight(shape=(num_features, self.num_rules),
+                                        initializer=keras.initializers.Constant(1.0), trainable=True, name='stds')
+
+        def call(self, inputs):
+            # Gaussian membership functions: (batch_size, num_features, num_rules)
+            inputs_expanded = tf.expand_dims(inputs, axis=-1)
+            return tf.exp(-((inputs_expanded - self.means) ** 2) / (2 * (self.stds ** 2)))
+
+    class RuleLayer(keras.layers.Layer):
+        def call(self, inputs):
+            # Multiply membership values across features for each rule: (batch_size, num_rules)
+            return tf.reduce_prod(inputs, axis=1)
+
+    class NormalizationLayer(keras.layers.Layer):
+        def call(self, inputs):
+            # Normalize rule strengths
+            return inputs / tf.reduce_sum(inputs, axis=1, keepdims=True)
+
+    class WeightedCombinationLayer(keras.layers.Layer):
+        def __init__(self, input_dim, num_rules, **kwargs):
+            super().__init__(**kwargs)
+            self.input_dim = input_dim
+            self.num_rules = num_rules
+
+        def build(self, input_shape):
+            # Weights for each rule and input dimension, and biases for each rule
+            self.rule_weights = self.add_weight(shape=(self.input_dim, self.num_rules),
+                                                initializer=keras.initializers.GlorotUniform(), trainable=True,
+                                                name='rule_weights')
+            self.biases = self.add_weight(shape=(self.num_rules,), initializer='zeros', trainable=True, name='biases')
+
+        def call(self, inputs):
+            normalized_weights, original_inputs = inputs  # [batch_size, num_rules], [batch_size, input_dim]
+            # Linear consequent of each rule, scaled by the normalized rule strengths
+            return normalized_weights * (tf.matmul(original_inputs, self.rule_weights) + self.biases)
+
+    class OutputLayer(keras.layers.Layer):
+        def call(self, inputs):
+            # Defuzzification
+            return tf.reduce_sum(inputs, axis=1, keepdims=True)
+
+    inputs = keras.layers.Input(shape=(input_dim,), name='InputLayer')
+    fuzzification = FuzzificationLayer(num_rules, rule_centers, name='FuzzificationLayer')(inputs)
+    rule_strengths = RuleLayer(name='RuleLayer')(fuzzification)
+    normalized_weights = NormalizationLayer(name='NormalizationLayer')(rule_strengths)
+    weighted_combination = WeightedCombinationLayer(input_dim, num_rules, name='WeightedCombinationLayer')(
+        [normalized_weights, inputs])
+    outputs = OutputLayer(name='OutputLayerSum')(weighted_combination)
+
+    anfis_model = keras.Model(inputs=inputs, outputs=outputs)
+    optimizer = keras.optimizers.SGD(learning_rate=0.01, momentum=0.9, nesterov=True)
+    anfis_model.compile(optimizer=optimizer, loss='mse')
+    return anfis_model
+
+
+########################################################################################################################
+# Evaluation
+
+# Cutoff point where the true positive and true negative rates cross
+def crossing_cutoff(y_pred, y_test, cutoff_points, negative_class):
+    positives = y_test == 1
+    negatives = y_test == negative_class
+    # Classify predictions for every cutoff at once: (cutoffs, rows)
+    predicted_positive = y_pred[np.newaxis, :] >= cutoff_points[:, np.newaxis]
+    tpr = (predicted_positive & positives).sum(axis=1) / positives.sum() if positives.any() else \
+        np.zeros(len(cutoff_points))
+    tnr = (~predicted_positive & negatives).sum(axis=1) / negatives.sum() if negatives.any() else \
+        np.zeros(len(cutoff_points))
+    return cutoff_points[np.argmin(np.abs(tpr - tnr))]
+
+
+# Average appreciation of the monthly portfolios of assets predicted as class 1 (results.ipynb)
+def portfolio_appreciation(predictions):
+    months = [predictions['DATE'].dt.year, predictions['DATE'].dt.month]
+    return predictions[predictions['CLASS_PRED'] == 1].groupby(months)['APPRECIATION'].mean().mean()
+
+
+# Average appreciation of the market in the monthly portfolios after cutoff_year (results.ipynb)
+def market_appreciation(market_data, cutoff_year=2021):
+    market_data = market_data[market_data['DATE'].dt.year > cutoff_year]
+    months = [market_data['DATE'].dt.year, market_data['DATE'].dt.month]
+    return market_data.groupby(months)['APPRECIATION'].mean().mean()
+
+
+# Classification metrics, r-value and portfolio appreciation of the predicted signals.
+# Returns the metrics and the test data with the SIGNAL and CLASS_PRED columns (as saved by the model notebooks).
+def evaluate(signal, prepared, model):
+    negative_class = model_settings[model]['negative_class']
+    y_test = prepared['y_test']
+    if model == 'MLP':
+        cutoff_points = np.linspace(-1, 1, 100)
+    else:
+        cutoff_points = np.linspace(signal.min(), signal.max(), 100)
+    cutoff = crossing_cutoff(signal, y_test, cutoff_points, negative_class)
+
+    y_pred = (signal >= cutoff).astype(int)
+    y_true = (y_test == 1).astype(int)
+
+    predictions = prepared['data_test'].copy()
+    predictions['SIGNAL'] = signal
+    predictions['CLASS_PRED'] = y_pred
+
+    metrics = {'CUTOFF': float(cutoff),
+               'ACCURACY': accuracy_score(y_true, y_pred),
+               'PRECISION': precision_score(y_true, y_pred, zero_division=0),
+               'RECALL': recall_score(y_true, y_pred, zero_division=0),
+               'F1_SCORE': f1_score(y_true, y_pred, zero_division=0),
+               'R_VALUE': linregress(predictions['SIGNAL'], predictions['APPRECIATION'] * 100).rvalue,
+               'PORTFOLIO_APPRECIATION': portfolio_appreciation(predictions)}
+    return metrics, predictions
+
+
+########################################################################################################################
+# Training
+
+def fit_mlp(prepared, seed, epochs=500, hidden_layers=None):
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(seed)
+    MLP = build_mlp(len(features), hidden_layers)
+    MLP.fit(prepared['X_train_balanced'], prepared['y_train_balanced'], epochs=epochs, verbose=0)
+    return MLP
+
+
+# backend:          keras (model of the notebook) or numpy (fused NumPy implementation, see Anfis_NumPy.py)
+def fit_anfis(prepared, seed, epochs=100, num_rules=2, radius=0.2, backend='keras'):
+    # Rule centers (means of gaussian membership functions). They only depend on the train data, so they can be
+    # computed once for all the experiments (see anfis_rule_centers)
+    rule_centers = prepared.get('rule_centers')
+    if rule_centers is None:
+        rule_centers = subtractive_clustering(prepared['X_train'], num_rules, radius=radius)
+    if backend == 'numpy':
+        return fit_numpy_anfis(dict(prepared, rule_centers=rule_centers), seed, epochs)
+
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(seed)
+    anfis_model = build_anfis(len(features), num_rules, rule_centers)
+    anfis_model.fit(prepared['X_train_balanced'], prepared['y_train_balanced'], epochs=epochs, verbose=0)
+    return anfis_model
+
+
+# Logistic regression (logistic_regression.ipynb). It has no epochs, so the epochs argument is ignored.
+def fit_lr(prepared, seed, epochs=None):
+    from sklearn.linear_model import LogisticRegression
+    LR = LogisticRegression(solver='lbfgs', max_iter=1000)
+    LR.fit(prepared['X_train_balanced'], prepared['y_train_balanced'])
+    return LR
+
+
+# Signal of a fitted model: network output, or probability of class 1 for the logistic regression
+def predict_signal(fitted, X):
+    if isinstance(fitted, dict):
+        # Parameters of the NumPy ANFIS
+        return anfis_predict(fitted, X)
+    if hasattr(fitted, 'predict_proba'):
+        return fitted.predict_proba(X)[:, 1]
+    return fitted.predict(X, verbose=0).flatten()
+
+
+# Add the ANFIS rule centers to the prepared data
+def anfis_rule_centers(prepared, num_rules=2, radius=0.2):
+    prepared['rule_centers'] = subtractive_clustering(prepared['X_train'], num_rules, radius=radius)
+    return prepared
+
+
+fit_functions = {'MLP': fit_mlp, 'ANFIS': fit_anfis, 'LR': fit_lr}
+
+
+# Train a model and evaluate it on the test data. Raises ValueError if the model predicts NaN values (i.e. the ANFIS
+# rule strengths vanished), so the experiment can be retried.
+# options:          other arguments of the fit function of the model (i.e. {'backend': 'numpy'} for the ANFIS)
+def run_model(prepared, model, seed, epochs=None, options=None):
+    kwargs = {'epochs': epochs} if epochs else {}
+    kwargs.update(options or {})
+    signal = predict_signal(fit_functions[model](prepared, seed, **kwargs), prepared['X_test'])
+    if not np.isfinite(signal).all():
+        raise ValueError(f'{model} predicted non finite values (seed {seed})')
+    return evaluate(signal, prepared, model)